@@ -8,6 +8,9 @@ BEGIN
   END IF;
 END$$;
 
+-- Триграммы для нечёткого поиска по названиям (/submitData/search)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Нормализация email для индекса (обрезка пробелов + lower)
 CREATE OR REPLACE FUNCTION trim_lower_email(txt text) RETURNS text
 LANGUAGE sql IMMUTABLE AS $$ SELECT lower(btrim($1)) $$;
@@ -33,6 +36,11 @@ CREATE TABLE IF NOT EXISTS public.coords (
       CHECK (latitude BETWEEN -90 AND 90 AND longitude BETWEEN -180 AND 180)
 );
 
+-- Гео-поиск (/submitData/near, /submitData/bbox): GiST по точке (lon, lat) в градусах.
+-- Выражение должно совпадать с geo.coords_point(), иначе планировщик индекс не возьмёт
+CREATE INDEX IF NOT EXISTS idx_coords_point
+  ON public.coords USING gist (point(longitude::double precision, latitude::double precision));
+
 -- ====== LEVELS ======
 CREATE TABLE IF NOT EXISTS public.levels (
     id       BIGSERIAL PRIMARY KEY,
@@ -63,6 +71,29 @@ CREATE INDEX IF NOT EXISTS idx_pereval_user_id   ON public.pereval(user_id);
 CREATE INDEX IF NOT EXISTS idx_pereval_coords_id ON public.pereval(coords_id);
 CREATE INDEX IF NOT EXISTS idx_pereval_levels_id ON public.pereval(levels_id);
 
+-- Текст для поиска по названиям: все три поля, lower, ё -> е (как _normalize_search в repository.py)
+CREATE OR REPLACE FUNCTION pereval_search_text(title text, beauty_title text, other_titles text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+  SELECT translate(lower(beauty_title || ' ' || title || ' ' || other_titles), 'ё', 'е')
+$$;
+CREATE INDEX IF NOT EXISTS idx_pereval_search_trgm
+  ON public.pereval USING gin (pereval_search_text(title, beauty_title, other_titles) gin_trgm_ops);
+
+-- Очередь модерации: кто взял запись (status=pending) и до какого момента.
+-- Просроченная аренда возвращает запись в очередь
+ALTER TABLE public.pereval ADD COLUMN IF NOT EXISTS claimed_by       TEXT;
+ALTER TABLE public.pereval ADD COLUMN IF NOT EXISTS claim_expires_at TIMESTAMPTZ;
+CREATE INDEX IF NOT EXISTS idx_pereval_queue_new
+  ON public.pereval(id) WHERE status = 'new';
+CREATE INDEX IF NOT EXISTS idx_pereval_claim_expires
+  ON public.pereval(claim_expires_at) WHERE status = 'pending';
+
+-- Лента изменений /submitData/changes: keyset по (updated_at, id), общая и по пользователю
+CREATE INDEX IF NOT EXISTS idx_pereval_updated
+  ON public.pereval(updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_pereval_user_updated
+  ON public.pereval(user_id, updated_at, id);
+
 -- Триггер на автообновление updated_at
 CREATE OR REPLACE FUNCTION set_updated_at() RETURNS trigger AS $$
 BEGIN
@@ -80,7 +111,74 @@ CREATE TABLE IF NOT EXISTS public.images (
     id         BIGSERIAL PRIMARY KEY,
     pereval_id BIGINT   NOT NULL REFERENCES public.pereval(id) ON DELETE CASCADE,
     title      TEXT     NOT NULL,
-    data       BYTEA    NOT NULL,
+    sha256     TEXT,                -- ключ в BlobStore (байты лежат вне БД)
+    size       BIGINT,
+    mime_type  TEXT,
+    data       BYTEA,               -- legacy: только для строк до миграции
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
 CREATE INDEX IF NOT EXISTS idx_images_pereval_id ON public.images(pereval_id);
+
+-- Миграция со старой схемы (картинки в BYTEA): добавляем колонки BlobStore,
+-- data становится необязательной. Перенос байтов: python -m app.migrate_blobs
+ALTER TABLE public.images ADD COLUMN IF NOT EXISTS sha256    TEXT;
+ALTER TABLE public.images ADD COLUMN IF NOT EXISTS size      BIGINT;
+ALTER TABLE public.images ADD COLUMN IF NOT EXISTS mime_type TEXT;
+ALTER TABLE public.images ALTER COLUMN data DROP NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_images_sha256 ON public.images(sha256);
+
+-- Производные картинок (превью, веб-версия): статус на каждую картинку,
+-- очередь фонового воркера — частичный индекс по незавершённым.
+-- Уже лежащие картинки получают pending и обрабатываются в фоне
+ALTER TABLE public.images ADD COLUMN IF NOT EXISTS variants_status     TEXT NOT NULL DEFAULT 'pending';
+ALTER TABLE public.images ADD COLUMN IF NOT EXISTS variants_claimed_at TIMESTAMPTZ;
+ALTER TABLE public.images ADD COLUMN IF NOT EXISTS variants_error      TEXT;
+CREATE INDEX IF NOT EXISTS idx_images_variants_todo
+  ON public.images(id) WHERE variants_status IN ('pending', 'processing');
+
+CREATE TABLE IF NOT EXISTS public.image_variants (
+    id         BIGSERIAL PRIMARY KEY,
+    image_id   BIGINT   NOT NULL REFERENCES public.images(id) ON DELETE CASCADE,
+    variant    TEXT     NOT NULL,   -- имя из IMAGE_VARIANTS: thumb, web, ...
+    sha256     TEXT     NOT NULL,   -- ключ в BlobStore
+    size       BIGINT   NOT NULL,
+    mime_type  TEXT     NOT NULL,
+    width      INTEGER  NOT NULL,
+    height     INTEGER  NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    CONSTRAINT image_variants_image_variant_key UNIQUE (image_id, variant)
+);
+
+-- Idempotency-Key у POST /submitData: повтор с тем же ключом и тем же телом
+-- получает исходный ответ без повторной записи. Ключ занимается в одной
+-- транзакции с созданием записи; просроченные удаляет фоновая очистка
+CREATE TABLE IF NOT EXISTS public.idempotency_keys (
+    key          TEXT PRIMARY KEY,
+    request_hash TEXT   NOT NULL,   -- sha256 канонического тела запроса
+    pereval_id   BIGINT REFERENCES public.pereval(id) ON DELETE CASCADE,
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    expires_at   TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON public.idempotency_keys(expires_at);
+
+-- Очередь приёма (POST /submitData с Prefer: respond-async): запрос отвечает
+-- 202 после одной вставки сюда, запись создаёт фоновый IngestWorker пачками.
+-- payload — провалидированный SubmitDataIn, картинки уже в BlobStore (sha256).
+-- processing дольше INGEST_CLAIM_TIMEOUT (воркер упал) снова берётся в работу
+CREATE TABLE IF NOT EXISTS public.ingest_queue (
+    id          BIGSERIAL PRIMARY KEY,
+    ticket      UUID     NOT NULL,   -- отдаётся клиенту: id подряд перебирать нельзя
+    payload     JSONB    NOT NULL,
+    state       TEXT     NOT NULL DEFAULT 'queued',   -- queued, processing, done, failed
+    attempts    INTEGER  NOT NULL DEFAULT 0,
+    pereval_id  BIGINT REFERENCES public.pereval(id) ON DELETE SET NULL,
+    error       TEXT,
+    created_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    claimed_at  TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    CONSTRAINT ingest_queue_ticket_key UNIQUE (ticket)
+);
+CREATE INDEX IF NOT EXISTS idx_ingest_queue_todo
+  ON public.ingest_queue(id) WHERE state IN ('queued', 'processing');
+CREATE INDEX IF NOT EXISTS idx_ingest_queue_finished
+  ON public.ingest_queue(finished_at) WHERE state IN ('done', 'failed');
@@ -0,0 +1,162 @@
+"""Допуск тяжёлых запросов с картинками: лимиты размера и байт в обработке.
+
+* BodyLimitMiddleware — тело не-GET запроса больше лимита отвергается 413
+  сразу по Content-Length, а без него — как только пришло больше лимита:
+  до разбора JSON и валидации SubmitDataIn дело не доходит. Лимит —
+  MAX_BODY_BYTES, у multipart (``.../upload``) — MAX_IMAGES_PER_SUBMIT
+  картинок по MAX_IMAGE_BYTES; батч NDJSON ограничивается построчно в
+  обработчике.
+* check_images — число картинок и размер каждой после декодирования base64
+  (оценка по длине строки, без декодирования) — тоже 413.
+* image_budget — декодированные байты картинок в обработке на процесс: base64
+  -> bytes -> sha256 -> файл держит в памяти копии каждой картинки. Не хватило
+  бюджета за ADMISSION_WAIT_SECONDS — 503 с Retry-After.
+
+Каждый отказ считается в fstr_admission_rejected_total{reason}.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Iterable, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from .config import settings
+from .metrics import Counter, registry
+
+ADMISSION_REJECTED = registry.register(Counter(
+    "fstr_admission_rejected_total", "Отказы в приёме: body, image_count, image_size (413), busy (503)",
+    ("reason",)))
+
+class AdmissionRejected(HTTPException):
+    def __init__(self, status_code: int, reason: str, message: str, headers: Optional[dict] = None):
+        super().__init__(status_code=status_code, detail=message, headers=headers)
+        self.reason = reason
+
+class PayloadTooLarge(AdmissionRejected):
+    def __init__(self, reason: str, message: str):
+        super().__init__(413, reason, message)
+
+class ServerBusy(AdmissionRejected):
+    def __init__(self, retry_after: int):
+        super().__init__(503, "busy", "Сервер перегружен картинками, повторите позже",
+                         {"Retry-After": str(retry_after)})
+
+def rejection_response(method: str, exc: AdmissionRejected) -> JSONResponse:
+    """Тело в форме ответа маршрута: PatchOut у PATCH, SubmitDataOut у остальных."""
+    ADMISSION_REJECTED.inc((exc.reason,))
+    if method == "PATCH":
+        content = {"state": 0, "message": exc.detail}
+    else:
+        content = {"status": exc.status_code, "message": exc.detail, "id": None}
+    return JSONResponse(content=content, status_code=exc.status_code, headers=exc.headers)
+
+def upload_body_limit() -> int:
+    return settings.MAX_IMAGES_PER_SUBMIT * settings.MAX_IMAGE_BYTES + settings.MAX_METADATA_BYTES + 64 * 1024
+
+def default_body_limit(path: str) -> Optional[int]:
+    if path.endswith("/upload"):
+        return upload_body_limit()
+    if path.endswith("/batch"):
+        return None
+    return settings.MAX_BODY_BYTES
+
+class BodyLimitMiddleware:
+    def __init__(self, app, limit_for: Callable[[str], Optional[int]] = default_body_limit):
+        self.app = app
+        self.limit_for = limit_for
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            return await self.app(scope, receive, send)
+        limit = self.limit_for(scope["path"])
+        if limit is None:
+            return await self.app(scope, receive, send)
+        too_large = PayloadTooLarge("body", f"Тело запроса больше {limit} байт")
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            # Тело не читаем вовсе: клиент узнает об отказе до отправки мегабайтов
+            return await rejection_response(scope["method"], too_large)(scope, receive, send)
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # HTTPException проходит сквозь разбор тела FastAPI до обработчика в main
+                    raise too_large
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+def decoded_size(data: str) -> int:
+    """Размер base64 после декодирования — по длине строки."""
+    n = len(data)
+    return n * 3 // 4 - data.endswith("=") - data.endswith("==")
+
+def check_images(images: Iterable[Any]) -> int:
+    """413 при превышении числа или размера картинок; декодированных байт всего."""
+    images = list(images or ())
+    if len(images) > settings.MAX_IMAGES_PER_SUBMIT:
+        raise PayloadTooLarge("image_count", f"Картинок больше {settings.MAX_IMAGES_PER_SUBMIT}")
+    total = 0
+    for im in images:
+        data = im.get("data") if isinstance(im, dict) else getattr(im, "data", None)
+        if not data:
+            continue  # ссылка по sha256 или уже загруженный multipart-файл
+        size = decoded_size(data)
+        if size > settings.MAX_IMAGE_BYTES:
+            raise PayloadTooLarge("image_size", f"Картинка больше {settings.MAX_IMAGE_BYTES} байт")
+        total += size
+    return total
+
+class ByteBudget:
+    """Семафор по байтам: занять ``n`` или дождаться, пока освободят."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, n: int, timeout: Optional[float]) -> bool:
+        # Больше ёмкости не займёт никто — такой запрос ждёт, пока бюджет не опустеет целиком
+        n = min(n, self.capacity)
+        async with self._cond:
+            if self.in_use + n > self.capacity:
+                if timeout is not None and timeout <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(self._cond.wait_for(lambda: self.in_use + n <= self.capacity), timeout)
+                except asyncio.TimeoutError:
+                    return False
+            self.in_use += n
+            return True
+
+    async def release(self, n: int) -> None:
+        n = min(n, self.capacity)
+        async with self._cond:
+            self.in_use -= n
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def reserve(self, n: int, wait: Optional[float]) -> AsyncIterator[None]:
+        """Занять ``n`` байт на время блока; не дождались за ``wait`` с — 503 (None — ждать сколько нужно)."""
+        if n > 0 and not await self.acquire(n, wait):
+            raise ServerBusy(settings.ADMISSION_RETRY_AFTER)
+        try:
+            yield
+        finally:
+            if n > 0:
+                await self.release(n)
+
+image_budget = ByteBudget(settings.IMAGE_BYTES_IN_FLIGHT)
+
+def budget_collector(budget: ByteBudget):
+    def collect():
+        return [
+            ("fstr_image_bytes_in_flight", "gauge", "Декодированных байт картинок в обработке", budget.in_use),
+            ("fstr_image_bytes_in_flight_limit", "gauge", "Лимит IMAGE_BYTES_IN_FLIGHT", budget.capacity),
+        ]
+    return collect
@@ -0,0 +1,168 @@
+"""In-process кэши: готовые ответы GET /submitData/{id} и пользователи по email.
+
+LRU ограничен суммарным размером тел в байтах, а не числом записей:
+одна запись с десятком фото весит как тысяча записей без картинок.
+
+Инвалидация локальная (update_pereval_from_payload, смена статуса); другие
+воркеры увидят изменения не позже чем через ``ttl`` секунд.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from .config import settings
+from .metrics import Counter, registry
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: str
+    updated_at: datetime
+    stored_at: float = field(default_factory=time.monotonic)
+
+class ResponseCache:
+    GENERATION_BUCKETS = 4096
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple[int, Hashable], CachedResponse]" = OrderedDict()
+        self._variants: Dict[int, Set[Hashable]] = {}
+        # Поколение растёт при каждой инвалидации: чтение, начатое до правки,
+        # не сможет положить в кэш устаревшее тело. Счётчики по корзинам id,
+        # чтобы не копить их на каждую когда-либо правленную запись
+        self._generations: List[int] = [0] * self.GENERATION_BUCKETS
+        self._invalidated_at: List[float] = [0.0] * self.GENERATION_BUCKETS
+        self._lock = threading.Lock()
+
+    def generation(self, pereval_id: int) -> int:
+        with self._lock:
+            return self._generations[pereval_id % self.GENERATION_BUCKETS]
+
+    def get(self, pereval_id: int, variant: Hashable) -> Optional[CachedResponse]:
+        key = (pereval_id, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.stored_at > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, pereval_id: int, variant: Hashable, entry: CachedResponse, generation: int,
+            settle: float = 0.0) -> None:
+        """``settle`` — тело прочитано с реплики: не кэшировать, если запись правили
+        в этом процессе меньше ``settle`` секунд назад (реплика могла отстать)."""
+        if len(entry.body) > self.max_bytes:
+            return
+        key = (pereval_id, variant)
+        bucket = pereval_id % self.GENERATION_BUCKETS
+        with self._lock:
+            if self._generations[bucket] != generation:
+                return
+            if settle and time.monotonic() - self._invalidated_at[bucket] < settle:
+                return
+            old = self._entries.get(key)
+            if old is not None:
+                if old.updated_at > entry.updated_at:
+                    return
+                self._drop(key)
+            self._entries[key] = entry
+            self._variants.setdefault(pereval_id, set()).add(variant)
+            self.size_bytes += len(entry.body)
+            while self.size_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, pereval_id: int) -> None:
+        with self._lock:
+            self._generations[pereval_id % self.GENERATION_BUCKETS] += 1
+            self._invalidated_at[pereval_id % self.GENERATION_BUCKETS] = time.monotonic()
+            for variant in list(self._variants.get(pereval_id, ())):
+                self._drop((pereval_id, variant))
+
+    def _drop(self, key) -> None:
+        entry = self._entries.pop(key)
+        self.size_bytes -= len(entry.body)
+        variants = self._variants[key[0]]
+        variants.discard(key[1])
+        if not variants:
+            del self._variants[key[0]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_MAX_BYTES, settings.RESPONSE_CACHE_TTL)
+
+# ====== Пользователи по email ======
+USER_CACHE_TOTAL = registry.register(Counter(
+    "fstr_user_cache_lookups_total", "Поиск пользователя по email в кэше", ("outcome",)))
+
+@dataclass(frozen=True)
+class CachedUser:
+    id: int
+    full_name: str
+    phone: str
+
+class UserCache:
+    """email (нормализованный) -> пользователь; LRU по числу записей + TTL.
+
+    id пользователя не меняется, ФИО и телефон — могут: create сравнивает их
+    с кэшем и при расхождении идёт обычным upsert, обновляя запись кэша. При
+    совпадении users читается по первичному ключу с проверкой ФИО/телефона —
+    правку из другого воркера кэш этого процесса может не знать до TTL.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[CachedUser, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, email: str) -> Optional[CachedUser]:
+        with self._lock:
+            hit = self._entries.get(email)
+            if hit is not None and time.monotonic() - hit[1] > self.ttl:
+                del self._entries[email]
+                hit = None
+            if hit is None:
+                USER_CACHE_TOTAL.inc(("miss",))
+                return None
+            self._entries.move_to_end(email)
+        USER_CACHE_TOTAL.inc(("hit",))
+        return hit[0]
+
+    def put(self, email: str, user: CachedUser) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries.pop(email, None)
+            self._entries[email] = (user, time.monotonic())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, email: str) -> None:
+        with self._lock:
+            self._entries.pop(email, None)
+
+user_cache = UserCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
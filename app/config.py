@@ -14,6 +14,84 @@ if not DATABASE_URL:
 
 class Settings(BaseSettings):
     DATABASE_URL: str = DATABASE_URL
+    # Пул asyncpg на процесс: всего соединений до (DB_POOL_SIZE + DB_MAX_OVERFLOW) * воркеров
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 10.0  # ожидание свободного соединения, с
+    DB_POOL_RECYCLE: int = 30 * 60  # переоткрывать соединения старше, с (-1 — никогда)
+    DB_POOL_PRE_PING: bool = True  # проверка соединения на каждом checkout: +1 round trip
+    DB_POOL_PREWARM: int = 0  # открыть столько соединений при старте процесса
+    DB_CONNECT_TIMEOUT: float = 10.0
+    DB_STATEMENT_TIMEOUT_MS: int = 30_000  # statement_timeout для API (0 — без лимита)
+    DB_APPLICATION_NAME: str = "fstr_api"
+    # Реплики для чтения (через запятую, как DATABASE_URL); пусто — всё читается с primary.
+    # После своей записи клиент читает с primary REPLICA_STICKY_SECONDS (cookie), реплика,
+    # к которой не удалось подключиться, пропускается REPLICA_RETRY_SECONDS
+    DATABASE_REPLICA_URLS: str = ""
+    REPLICA_STICKY_SECONDS: float = 5.0
+    REPLICA_RETRY_SECONDS: float = 30.0
+    # Схема при старте процесса: create — create_all (разработка), verify — только
+    # проверить, skip — ничего (прод: схему ставит python -m app.migrate до запуска)
+    SCHEMA_ON_STARTUP: str = "create"
+    # Хранилище картинок (content-addressed): пока только локальная ФС
+    BLOB_STORE_BACKEND: str = "local"
+    BLOB_STORE_PATH: str = "./blobs"
+    # Потоковая загрузка multipart (/submitData/upload)
+    MAX_IMAGE_BYTES: int = 20 * 1024 * 1024  # на одну картинку (и после base64-декодирования)
+    MAX_METADATA_BYTES: int = 256 * 1024
+    # Допуск запросов с картинками: тело JSON (и строка NDJSON батча) — 413 уже по
+    # Content-Length или по мере прихода байтов; картинок в одной записи
+    MAX_BODY_BYTES: int = 64 * 1024 * 1024
+    MAX_IMAGES_PER_SUBMIT: int = 20
+    # Декодированных байт картинок в обработке на процесс; сверх — ждать
+    # ADMISSION_WAIT_SECONDS, затем 503 с Retry-After
+    IMAGE_BYTES_IN_FLIGHT: int = 256 * 1024 * 1024
+    ADMISSION_WAIT_SECONDS: float = 1.0
+    ADMISSION_RETRY_AFTER: int = 2
+    ALLOWED_IMAGE_TYPES: str = "image/jpeg,image/png,image/webp,image/heic,image/gif"
+    # POST /submitData/batch: записей на одну транзакцию
+    BATCH_CHUNK_SIZE: int = 200
+    # Кэш ответов GET /submitData/{id}: лимит по байтам тел и TTL для других воркеров
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_CACHE_TTL: float = 60.0
+    # Кэш email -> (id, ФИО, телефон) пользователя: повторный submit без upsert в users
+    # (только чтение по первичному ключу), список по email — без join с users
+    USER_CACHE_SIZE: int = 10_000
+    USER_CACHE_TTL: float = 300.0
+    # /submitData/search: порог word_similarity (pg_trgm), 0..1 — ниже порог, больше опечаток прощается
+    SEARCH_SIMILARITY: float = 0.4
+    # Очередь модерации: аренда по умолчанию и максимум (секунды), записей за один claim
+    MODERATION_LEASE_SECONDS: int = 15 * 60
+    MODERATION_MAX_LEASE_SECONDS: int = 4 * 60 * 60
+    MODERATION_MAX_CLAIM: int = 100
+    # Производные картинок: имя:длинная сторона; какой вариант отдавать по умолчанию
+    # (original — исходник); фоновые процессы-воркеры (0 — не запускать в этом процессе)
+    IMAGE_VARIANTS: str = "thumb:320,web:1600"
+    DEFAULT_IMAGE_VARIANT: str = "original"
+    THUMBNAIL_WORKERS: int = 2
+    THUMBNAIL_BATCH: int = 16
+    THUMBNAIL_POLL_SECONDS: float = 2.0
+    THUMBNAIL_CLAIM_TIMEOUT: int = 300
+    # /submitData/changes: строки моложе лага не отдаются — updated_at = время начала
+    # транзакции, и ещё не закоммиченная правка могла получить метку раньше уже отданных
+    CHANGES_SAFETY_LAG_SECONDS: float = 2.0
+    # Idempotency-Key у POST /submitData: сколько помнить ключ и как часто чистить просроченные
+    IDEMPOTENCY_KEY_TTL_SECONDS: int = 24 * 60 * 60
+    IDEMPOTENCY_PURGE_SECONDS: float = 15 * 60
+    # Приём с Prefer: respond-async — 202 и запись в ingest_queue, создаёт фоновый воркер.
+    # INGEST_ASYNC=false — предпочтение игнорируется, всё синхронно; воркер пачками по
+    # INGEST_BATCH (0 воркеров — очередь в этом процессе не разбирается); зависшие в
+    # processing дольше INGEST_CLAIM_TIMEOUT — заново, после INGEST_MAX_ATTEMPTS — failed;
+    # завершённые заявки хранятся INGEST_RETENTION_SECONDS
+    INGEST_ASYNC: bool = True
+    INGEST_WORKERS: int = 1
+    INGEST_BATCH: int = 200
+    INGEST_POLL_SECONDS: float = 1.0
+    INGEST_CLAIM_TIMEOUT: int = 60
+    INGEST_MAX_ATTEMPTS: int = 5
+    INGEST_RETENTION_SECONDS: int = 7 * 24 * 60 * 60
+    # /metrics: SQL-операторы дольше порога пишутся в лог fstr.sql (0 — выключено)
+    SLOW_QUERY_MS: float = 200.0
 
 settings = Settings()
 
@@ -1,17 +1,68 @@
+import asyncio
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from .config import settings
+from .metrics import TimedAsyncPool, instrument_engine
 
+def async_url(url: str) -> str:
+    """postgresql[+psycopg2]://... -> postgresql+asyncpg://... (sslmode -> ssl)."""
+    u = make_url(url)
+    if u.drivername in ("postgres", "postgresql", "postgresql+psycopg2"):
+        u = u.set(drivername="postgresql+asyncpg")
+    if "sslmode" in u.query:
+        query = dict(u.query)
+        query["ssl"] = query.pop("sslmode")
+        u = u.set(query=query)
+    return u.render_as_string(hide_password=False)
+
+# Синхронный движок — только для утилит (migrate, migrate_blobs); соединение
+# открывается лениво, API его не трогает. Без statement_timeout: миграции долгие
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,
+    connect_args={"connect_timeout": int(settings.DB_CONNECT_TIMEOUT),
+                  "application_name": settings.DB_APPLICATION_NAME + "_util"},
 )
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+def _server_settings() -> dict:
+    server = {"application_name": settings.DB_APPLICATION_NAME}
+    if settings.DB_STATEMENT_TIMEOUT_MS > 0:
+        server["statement_timeout"] = str(settings.DB_STATEMENT_TIMEOUT_MS)
+    return server
+
+def make_async_engine(url: str):
+    """asyncpg-движок с настройками пула из Settings; primary и реплики одинаковые."""
+    eng = create_async_engine(
+        async_url(url),
+        poolclass=TimedAsyncPool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={"timeout": settings.DB_CONNECT_TIMEOUT, "server_settings": _server_settings()},
+    )
+    instrument_engine(eng.sync_engine)
+    return eng
+
+# Асинхронный движок (asyncpg) — для всех обработчиков API; чтения могут уйти на реплики (replicas.py)
+async_engine = make_async_engine(settings.DATABASE_URL)
+instrument_engine(engine)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+async def prewarm_pool(n: int) -> None:
+    """Открыть ``n`` соединений заранее: первые запросы не платят за TCP/TLS и auth."""
+    n = min(n, settings.DB_POOL_SIZE)
+    if n <= 0:
+        return
+    conns = await asyncio.gather(*(async_engine.connect() for _ in range(n)))
+    # Соединения возвращаются в пул и остаются в нём открытыми
+    await asyncio.gather(*(c.close() for c in conns))
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,232 @@
+"""Выгрузка каталога перевалов: NDJSON, CSV, GeoJSON.
+
+    GET /submitData/export?format=csv&status=accepted&updated_since=2024-01-01T00:00:00Z
+    python -m app.export --format geojson --status accepted -o passes.geojson
+
+Строки читаются серверным курсором пачками по ``batch`` (yield_per) и
+плоским Core-select без ORM-объектов: в памяти одна пачка, картинки не
+читаются вовсе — только их число. Персональные данные (ФИО, email,
+телефон) в выгрузку не входят. Скорость (записей/с) — в лог fstr.export,
+в /metrics (fstr_export_rows_total, fstr_export_seconds) и в stderr CLI.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import logging
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import orjson
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .metrics import Counter, Histogram, registry
+
+logger = logging.getLogger("fstr.export")
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "geojson": ("application/geo+json", "geojson"),
+}
+CHUNK_BYTES = 64 * 1024
+
+EXPORT_ROWS = registry.register(Counter("fstr_export_rows_total", "Выгружено записей", ("format",)))
+EXPORT_SECONDS = registry.register(Histogram(
+    "fstr_export_seconds", "Длительность выгрузки", (0.1, 0.5, 1, 5, 15, 60, 300, 900), ("format",)))
+
+@dataclass
+class ExportFilter:
+    statuses: Sequence[str] = ()
+    updated_since: Optional[datetime] = None  # включительно
+    updated_before: Optional[datetime] = None  # не включительно
+
+def as_utc(dt: Optional[datetime]) -> Optional[datetime]:
+    """Время фильтра без пояса считается UTC, а не поясом сессии БД."""
+    if dt is not None and dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+def export_query(flt: ExportFilter):
+    p, c, lv = models.Pereval, models.Coords, models.Levels
+    images = (select(func.count(models.Image.id)).where(models.Image.pereval_id == p.id)
+              .correlate(p).scalar_subquery())
+    stmt = (
+        select(p.id, p.status, p.beauty_title, p.title, p.other_titles, p.connect, p.add_time,
+               p.created_at, p.updated_at, c.latitude, c.longitude, c.height,
+               lv.winter, lv.summer, lv.autumn, lv.spring, images.label("images"))
+        .join(c, p.coords_id == c.id)
+        .join(lv, p.levels_id == lv.id)
+    )
+    if flt.statuses:
+        stmt = stmt.where(p.status.in_([models.ModerationStatus(s) for s in flt.statuses]))
+    if flt.updated_since is not None:
+        stmt = stmt.where(p.updated_at >= flt.updated_since)
+    if flt.updated_before is not None:
+        stmt = stmt.where(p.updated_at < flt.updated_before)
+    return stmt.order_by(p.id)
+
+def _item(row) -> Dict[str, Any]:
+    return {
+        "id": int(row.id),
+        "status": row.status.value,
+        "beauty_title": row.beauty_title,
+        "title": row.title,
+        "other_titles": row.other_titles,
+        "connect": row.connect,
+        "add_time": row.add_time.isoformat(sep=" "),
+        "created_at": row.created_at.isoformat(sep=" "),
+        "updated_at": row.updated_at.isoformat(sep=" "),
+        "coords": {"latitude": float(row.latitude), "longitude": float(row.longitude), "height": int(row.height)},
+        "level": {"winter": row.winter, "summer": row.summer, "autumn": row.autumn, "spring": row.spring},
+        "images": int(row.images),
+    }
+
+# ====== Форматы: начало, строки пачки, конец ======
+class NDJSONFormat:
+    def header(self) -> bytes:
+        return b""
+
+    def rows(self, rows) -> bytes:
+        return b"".join(orjson.dumps(_item(r)) + b"\n" for r in rows)
+
+    def footer(self) -> bytes:
+        return b""
+
+class CSVFormat:
+    COLUMNS = ("id", "status", "beauty_title", "title", "other_titles", "connect", "add_time",
+               "created_at", "updated_at", "latitude", "longitude", "height",
+               "winter", "summer", "autumn", "spring", "images")
+
+    def _write(self, rows: List[list]) -> bytes:
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        return buf.getvalue().encode("utf-8")
+
+    def header(self) -> bytes:
+        # BOM: Excel иначе открывает UTF-8 как cp1251
+        return b"\xef\xbb\xbf" + self._write([list(self.COLUMNS)])
+
+    def rows(self, rows) -> bytes:
+        out = []
+        for r in rows:
+            it = _item(r)
+            out.append([it["id"], it["status"], it["beauty_title"], it["title"], it["other_titles"], it["connect"],
+                        it["add_time"], it["created_at"], it["updated_at"], *it["coords"].values(),
+                        *it["level"].values(), it["images"]])
+        return self._write(out)
+
+    def footer(self) -> bytes:
+        return b""
+
+@dataclass
+class GeoJSONFormat:
+    _first: bool = field(default=True, init=False)
+
+    def header(self) -> bytes:
+        return b'{"type":"FeatureCollection","features":[\n'
+
+    def rows(self, rows) -> bytes:
+        parts = []
+        for r in rows:
+            props = _item(r)
+            coords = props.pop("coords")
+            parts.append(orjson.dumps({
+                "type": "Feature",
+                "id": props["id"],
+                "geometry": {"type": "Point",
+                             "coordinates": [coords["longitude"], coords["latitude"], coords["height"]]},
+                "properties": props,
+            }))
+        if not parts:
+            return b""
+        chunk = b",\n".join(parts)
+        if not self._first:
+            chunk = b",\n" + chunk
+        self._first = False
+        return chunk
+
+    def footer(self) -> bytes:
+        return b"\n]}\n"
+
+def make_format(name: str):
+    return {"ndjson": NDJSONFormat, "csv": CSVFormat, "geojson": GeoJSONFormat}[name]()
+
+@dataclass
+class ExportStats:
+    rows: int = 0
+    bytes: int = 0
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def seconds(self) -> float:
+        return time.perf_counter() - self.started
+
+    def summary(self) -> str:
+        s = max(self.seconds, 1e-9)
+        return (f"{self.rows} записей, {self.bytes / 1e6:.1f} МБ за {s:.1f} с "
+                f"({self.rows / s:.0f} записей/с, {self.bytes / 1e6 / s:.1f} МБ/с)")
+
+async def stream_export(db: AsyncSession, fmt_name: str, flt: ExportFilter, batch: int = 1000,
+                        stats: Optional[ExportStats] = None) -> AsyncIterator[bytes]:
+    """Куски тела по ~CHUNK_BYTES; ``stats`` заполняется по ходу."""
+    fmt = make_format(fmt_name)
+    stats = stats or ExportStats()
+    buf = bytearray(fmt.header())
+    completed = False
+    try:
+        result = await db.stream(export_query(flt).execution_options(yield_per=batch))
+        async for rows in result.partitions():
+            buf += fmt.rows(rows)
+            stats.rows += len(rows)
+            if len(buf) >= CHUNK_BYTES:
+                stats.bytes += len(buf)
+                yield bytes(buf)
+                buf.clear()
+        buf += fmt.footer()
+        stats.bytes += len(buf)
+        yield bytes(buf)
+        completed = True
+    finally:
+        EXPORT_ROWS.inc((fmt_name,), stats.rows)
+        EXPORT_SECONDS.observe((fmt_name,), stats.seconds)
+        logger.info("экспорт %s%s: %s", fmt_name, "" if completed else " (прерван)", stats.summary())
+
+# ====== CLI ======
+def _parse_dt(raw: str) -> datetime:
+    return as_utc(datetime.fromisoformat(raw.replace("Z", "+00:00")))
+
+async def _run(args) -> None:
+    from .db import AsyncSessionLocal, async_engine
+
+    flt = ExportFilter(args.status or (), args.updated_since, args.updated_before)
+    stats = ExportStats()
+    out = open(args.output, "wb") if args.output != "-" else sys.stdout.buffer
+    try:
+        async with AsyncSessionLocal() as db:
+            async for chunk in stream_export(db, args.format, flt, args.batch, stats):
+                out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        await async_engine.dispose()
+    print(f"экспорт {args.format}: {stats.summary()}", file=sys.stderr)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Выгрузка каталога перевалов")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="ndjson")
+    parser.add_argument("--status", action="append", choices=[s.value for s in models.ModerationStatus],
+                        help="можно несколько раз; без него — все")
+    parser.add_argument("--updated-since", type=_parse_dt)
+    parser.add_argument("--updated-before", type=_parse_dt)
+    parser.add_argument("--batch", type=int, default=1000, help="строк на FETCH серверного курсора")
+    parser.add_argument("-o", "--output", default="-")
+    asyncio.run(_run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
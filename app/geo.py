@@ -0,0 +1,74 @@
+"""Гео-поиск по coords: расстояние по сфере и bbox-предфильтр под GiST.
+
+Индекс idx_coords_point — GiST по point(longitude, latitude) в градусах.
+Он умеет только «точка внутри прямоугольника», поэтому поиск в радиусе
+идёт в два шага: индекс отбирает описанный вокруг круга bbox, точное
+расстояние (haversine) отсекает углы и задаёт порядок.
+"""
+import math
+from typing import List, Tuple
+
+from sqlalchemy import and_, cast, func, or_
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+
+from . import models
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# (min_lon, min_lat, max_lon, max_lat)
+Box = Tuple[float, float, float, float]
+
+def split_antimeridian(min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> List[Box]:
+    """min_lon > max_lon — рамка пересекает 180-й меридиан: две рамки."""
+    if min_lon <= max_lon:
+        return [(min_lon, min_lat, max_lon, max_lat)]
+    return [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)]
+
+def boxes_around(lat: float, lon: float, radius_km: float) -> List[Box]:
+    dlat = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    # У полюса круг накрывает все долготы
+    cos_lat = min(math.cos(math.radians(min_lat)), math.cos(math.radians(max_lat)))
+    if max_lat >= 90.0 or min_lat <= -90.0 or cos_lat <= 0 or dlat / cos_lat >= 180.0:
+        return [(-180.0, min_lat, 180.0, max_lat)]
+    dlon = dlat / cos_lat
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180.0:
+        return split_antimeridian(min_lat, min_lon + 360.0, max_lat, max_lon)
+    if max_lon > 180.0:
+        return split_antimeridian(min_lat, min_lon, max_lat, max_lon - 360.0)
+    return [(min_lon, min_lat, max_lon, max_lat)]
+
+def box_center(min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> Tuple[float, float]:
+    width = (max_lon - min_lon) % 360.0
+    lon = min_lon + width / 2
+    if lon > 180.0:
+        lon -= 360.0
+    return (min_lat + max_lat) / 2, lon
+
+def coords_point():
+    # Ровно то выражение, по которому построен idx_coords_point
+    return func.point(cast(models.Coords.longitude, DOUBLE_PRECISION), cast(models.Coords.latitude, DOUBLE_PRECISION))
+
+def in_boxes(boxes: List[Box]):
+    pt = coords_point()
+    conds = [
+        pt.op("<@")(func.box(func.point(b[0], b[1]), func.point(b[2], b[3])))
+        for b in boxes
+    ]
+    return conds[0] if len(conds) == 1 else or_(*conds)
+
+def distance_km(lat: float, lon: float):
+    """Haversine от (lat, lon) до coords в километрах, SQL-выражение."""
+    la = func.radians(cast(models.Coords.latitude, DOUBLE_PRECISION))
+    lo = func.radians(cast(models.Coords.longitude, DOUBLE_PRECISION))
+    lat0, lon0 = math.radians(lat), math.radians(lon)
+    a = (func.power(func.sin((la - lat0) / 2), 2)
+         + math.cos(lat0) * func.cos(la) * func.power(func.sin((lo - lon0) / 2), 2))
+    # least(): погрешность округления может дать sqrt чуть больше 1
+    return 2 * EARTH_RADIUS_KM * func.asin(func.least(1.0, func.sqrt(a)))
+
+def after_key(dist, distance: float, pereval_id: int):
+    """Keyset по (distance, id): строго после последней отданной строки."""
+    return or_(dist > distance, and_(dist == distance, models.Pereval.id > pereval_id))
@@ -0,0 +1,85 @@
+"""Idempotency-Key у POST /submitData (и /submitData/upload).
+
+Клиент с плохой связью повторяет запрос по таймауту с тем же ключом.
+Ключ занимается INSERT ... ON CONFLICT в той же транзакции, что создаёт
+запись (DataRepository.create_pereval_idempotent), поэтому:
+* повтор после успеха находит ключ с pereval_id и получает тот же ответ,
+  картинки не декодируются и ничего не пишется;
+* параллельный дубль ждёт на уникальном индексе, пока первый запрос не
+  закоммитит (-> повтор ответа) или не откатится (-> создаёт сам);
+* тот же ключ с другим телом — 422.
+
+Тело сравнивается по sha256 канонического JSON (ключи отсортированы),
+так что пробелы и порядок полей роли не играют.
+"""
+import asyncio
+import hashlib
+import logging
+from typing import Any, Dict
+
+import orjson
+from sqlalchemy import text
+
+from .db import AsyncSessionLocal
+from .metrics import Counter, registry
+from .storage import StoredBlob
+
+logger = logging.getLogger("fstr.idempotency")
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENCY_TOTAL = registry.register(Counter(
+    "fstr_idempotency_requests_total", "POST с Idempotency-Key", ("outcome",)))
+
+class IdempotencyKeyMismatch(ValueError):
+    """Ключ уже использован с другим телом запроса."""
+
+def check_key(key: str) -> str:
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+        raise ValueError(f"Некорректный {IDEMPOTENCY_HEADER}: 1..{MAX_KEY_LENGTH} печатных символов")
+    return key
+
+def _default(obj):
+    # multipart: вместо байтов картинки — её sha256
+    if isinstance(obj, StoredBlob):
+        return obj.sha256
+    raise TypeError
+
+def fingerprint(payload: Dict[str, Any]) -> str:
+    return hashlib.sha256(orjson.dumps(payload, default=_default, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+# Пачками и SKIP LOCKED: очистка из нескольких процессов не мешает ни себе, ни POST
+_PURGE_SQL = text("""
+DELETE FROM idempotency_keys
+WHERE key IN (
+    SELECT key FROM idempotency_keys
+    WHERE expires_at < now()
+    LIMIT :batch
+    FOR UPDATE SKIP LOCKED
+)
+""")
+
+async def purge_expired(batch: int = 10_000) -> int:
+    total = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            deleted = (await db.execute(_PURGE_SQL, {"batch": batch})).rowcount
+            await db.commit()
+            total += deleted
+            if deleted < batch:
+                return total
+
+async def purge_loop(interval: float) -> None:
+    while True:
+        try:
+            deleted = await purge_expired()
+            if deleted:
+                logger.info("удалено просроченных Idempotency-Key: %d", deleted)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("ошибка очистки Idempotency-Key")
+        await asyncio.sleep(interval)
@@ -0,0 +1,71 @@
+"""Производные картинок (превью, веб-версия) — код для процессов-воркеров.
+
+Выполняется в ProcessPoolExecutor (thumbnails.ThumbnailWorker): Pillow
+держит GIL на декодировании, в потоке событийного цикла ему не место.
+Модуль импортирует только Pillow и хранилище — дочерний процесс (spawn)
+не тянет за собой FastAPI и движки БД.
+
+Оригинал читается из BlobStore по sha256 (legacy-строки передают байты),
+результат пишется туда же, в процесс-родитель уходят только метаданные.
+"""
+import io
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps
+
+from .storage import get_blob_store
+
+# Без лимита Pillow сам ругается только после 89 Мпикс; фото с телефона меньше
+Image.MAX_IMAGE_PIXELS = 100_000_000
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+def parse_variants(spec: str) -> Dict[str, int]:
+    """``"thumb:320,web:1600"`` -> {"thumb": 320, "web": 1600} (длинная сторона, px)."""
+    variants = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, side = part.partition(":")
+        if not name or not side.isdigit() or int(side) <= 0 or name == "original":
+            raise ValueError(f"Некорректный вариант картинки: {part!r}")
+        variants[name] = int(side)
+    return variants
+
+def _encode(img: Image.Image) -> "tuple[bytes, str]":
+    out = io.BytesIO()
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        # Прозрачность: WEBP вместо JPEG, чтобы не получить чёрный фон
+        img.convert("RGBA").save(out, "WEBP", quality=WEBP_QUALITY, method=4)
+        return out.getvalue(), "image/webp"
+    img.convert("RGB").save(out, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return out.getvalue(), "image/jpeg"
+
+def render_variants(sha256: Optional[str], data: Optional[bytes], variants: Dict[str, int]) -> Dict[str, dict]:
+    """Все варианты одной картинки: {имя: {sha256, size, mime_type, width, height}}.
+
+    Исходник декодируется один раз, варианты — от большего к меньшему,
+    каждый следующий уменьшается из предыдущего.
+    """
+    if not variants:
+        # IMAGE_VARIANTS пуст: производных нет, картинка сразу ready
+        return {}
+    store = get_blob_store()
+    if data is None:
+        with store.open(sha256) as f:
+            data = f.read()
+    with Image.open(io.BytesIO(data)) as src:
+        # draft: JPEG декодируется сразу в уменьшенном масштабе (DCT), в разы быстрее
+        src.draft("RGB", (max(variants.values()),) * 2)
+        img = ImageOps.exif_transpose(src)
+        img.load()
+    out = {}
+    for name, side in sorted(variants.items(), key=lambda kv: -kv[1]):
+        img.thumbnail((side, side), Image.LANCZOS)
+        body, mime = _encode(img)
+        blob = store.put(body)
+        out[name] = {"sha256": blob.sha256, "size": blob.size, "mime_type": mime,
+                     "width": img.width, "height": img.height}
+    return out
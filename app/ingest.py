@@ -0,0 +1,261 @@
+"""Отложенная запись: POST /submitData с ``Prefer: respond-async``.
+
+Запрос проверяется как обычно (схема, лимиты, base64, add_time), картинки
+пишутся в BlobStore, а вместо многотабличной вставки — одна строка в
+ingest_queue (DataRepository.enqueue_pereval) и сразу 202 с ticket. Статус —
+GET /submitData/ingest/{ticket}.
+
+IngestWorker живёт в каждом процессе API (lifespan) и:
+* берёт пачку queued одним UPDATE ... FOR UPDATE SKIP LOCKED в порядке
+  поступления — процессы делят очередь без блокировок;
+* вставляет пачку DataRepository.create_perevals_batch — многострочными
+  INSERT одной транзакцией; заявки отмечаются done в ней же, поэтому после
+  падения между вставкой и отметкой дублей нет: откатилось всё или ничего;
+* заявки, оставшиеся processing от упавшего процесса, берёт заново через
+  INGEST_CLAIM_TIMEOUT; после INGEST_MAX_ATTEMPTS захватов — failed;
+* ошибка данных (чужой телефон и т.п.) — failed с тем же текстом, что
+  вернул бы синхронный POST; сбой БД — заявка снова queued.
+
+Разобрать очередь без сервера:
+    python -m app.ingest --drain
+"""
+import argparse
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, IntegrityError
+
+from .config import settings
+from .db import AsyncSessionLocal, async_engine
+from .metrics import LATENCY_BUCKETS, Counter, Histogram, registry
+from .repository import DataRepository
+from .storage import StoredBlob
+from .thumbnails import thumbnail_worker
+
+logger = logging.getLogger("fstr.ingest")
+
+INGEST_TOTAL = registry.register(Counter(
+    "fstr_ingest_total", "Заявки очереди приёма: queued, done, failed, retried, lost", ("outcome",)))
+INGEST_LAG_SECONDS = registry.register(Histogram(
+    "fstr_ingest_lag_seconds", "От 202 до создания записи", LATENCY_BUCKETS + (30.0, 60.0, 300.0)))
+INGEST_BATCH_SECONDS = registry.register(Histogram(
+    "fstr_ingest_batch_seconds", "Вставка одной пачки очереди", LATENCY_BUCKETS))
+
+PREFER_ASYNC = "respond-async"
+
+_CLAIM_SQL = text("""
+UPDATE ingest_queue q
+SET state = 'processing', claimed_at = now(), attempts = q.attempts + 1
+FROM (
+    SELECT id FROM ingest_queue
+    WHERE state = 'queued'
+       OR (state = 'processing' AND claimed_at < now() - make_interval(secs => :timeout))
+    ORDER BY id
+    LIMIT :batch
+    FOR UPDATE SKIP LOCKED
+) todo
+WHERE q.id = todo.id
+RETURNING q.id, q.payload, q.attempts, q.created_at, q.claimed_at
+""")
+
+# Только своя заявка: перехваченную по таймауту отмечает тот, кто перехватил
+_DONE_SQL = text("""
+UPDATE ingest_queue q
+SET state = 'done', pereval_id = v.pereval_id, error = NULL, finished_at = now()
+FROM unnest(CAST(:id AS bigint[]), CAST(:pereval_id AS bigint[])) AS v(id, pereval_id)
+WHERE q.id = v.id AND q.state = 'processing' AND q.claimed_at = :claimed_at
+""")
+
+_FAILED_SQL = text("""
+UPDATE ingest_queue SET state = 'failed', error = :error, finished_at = now()
+WHERE id = :id AND state = 'processing' AND claimed_at = :claimed_at
+""")
+
+_RETRY_SQL = text("""
+UPDATE ingest_queue SET state = 'queued', claimed_at = NULL, error = :error
+WHERE id = :id AND state = 'processing' AND claimed_at = :claimed_at
+""")
+
+_PURGE_SQL = text("""
+DELETE FROM ingest_queue
+WHERE id IN (
+    SELECT id FROM ingest_queue
+    WHERE state IN ('done', 'failed') AND finished_at < now() - make_interval(secs => :retention)
+    LIMIT :batch
+    FOR UPDATE SKIP LOCKED
+)
+""")
+
+class ClaimLost(ValueError):
+    """Заявку перехватил другой воркер, пока эта пачка вставлялась."""
+
+def prefers_async(prefer: Optional[str]) -> bool:
+    """Есть ли respond-async в заголовке Prefer (RFC 7240)."""
+    if not prefer:
+        return False
+    return any(p.split(";", 1)[0].strip().lower() == PREFER_ASYNC for p in prefer.split(","))
+
+def _restore(payload: dict) -> dict:
+    """payload из очереди -> вид, который принимает create_perevals_batch."""
+    payload["images"] = [
+        {"title": im["title"], "blob": StoredBlob(im["sha256"], im["size"], im["mime_type"])}
+        for im in payload["images"]
+    ]
+    return payload
+
+def _error_message(e: Exception) -> str:
+    # Те же тексты, что у синхронного POST /submitData
+    if isinstance(e, IntegrityError):
+        return "Нарушение уникальности: " + str(e.orig)
+    if isinstance(e, ValueError):
+        return str(e)
+    return "Ошибка сервера: " + str(e)
+
+class IngestWorker:
+    def __init__(self, workers: int, batch: int, poll_seconds: float, claim_timeout: int,
+                 max_attempts: int, retention_seconds: int):
+        self.workers = workers
+        self.batch = batch
+        self.poll_seconds = poll_seconds
+        self.claim_timeout = claim_timeout
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self._tasks: List[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        self._purged_at = 0.0
+
+    async def start(self) -> None:
+        # Заявки, брошенные прошлым запуском в queued, уходят в работу сразу, в processing — по таймауту
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def wake(self) -> None:
+        """Пнуть воркер после новой заявки, не дожидаясь опроса."""
+        self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                done = await self.run_once()
+                if time.monotonic() - self._purged_at > 3600:
+                    self._purged_at = time.monotonic()
+                    await self.purge()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("ошибка очереди приёма")
+                done = 0
+            if done < self.batch:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    async def run_once(self) -> int:
+        """Одна пачка: claim -> вставка с отметкой done -> разбор ошибок. Возвращает размер пачки."""
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(_CLAIM_SQL, {"batch": self.batch, "timeout": float(self.claim_timeout)})).all()
+            await db.commit()
+        if not rows:
+            return 0
+        # Одна пачка — один claimed_at (now() транзакции claim)
+        claimed_at = rows[0].claimed_at
+        exhausted = [r for r in rows if r.attempts > self.max_attempts]
+        rows = [r for r in rows if r.attempts <= self.max_attempts]
+        for r in exhausted:
+            await self._finish(_FAILED_SQL, r, "Превышено число попыток обработки")
+            INGEST_TOTAL.inc(("failed",))
+        if not rows:
+            return len(exhausted)
+
+        t0 = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            async def mark_done(positions: List[int], ids: List[int]) -> None:
+                marked = (await db.execute(_DONE_SQL, {
+                    "id": [rows[i].id for i in positions], "pereval_id": ids, "claimed_at": claimed_at,
+                })).rowcount
+                if marked != len(positions):
+                    raise ClaimLost("Заявку уже обрабатывает другой воркер")
+
+            outcomes = await DataRepository(db).create_perevals_batch(
+                [_restore(r.payload) for r in rows], before_commit=mark_done)
+        INGEST_BATCH_SECONDS.observe((), time.perf_counter() - t0)
+
+        now = time.time()
+        for row, outcome in zip(rows, outcomes):
+            if isinstance(outcome, int):
+                INGEST_TOTAL.inc(("done",))
+                INGEST_LAG_SECONDS.observe((), now - row.created_at.timestamp())
+            elif isinstance(outcome, ClaimLost):
+                INGEST_TOTAL.inc(("lost",))
+            elif isinstance(outcome, (ValueError, IntegrityError, DataError)) or row.attempts >= self.max_attempts:
+                INGEST_TOTAL.inc(("failed",))
+                await self._finish(_FAILED_SQL, row, _error_message(outcome))
+            else:
+                # Связь с БД, таймаут оператора и т.п. — повторим следующей пачкой
+                INGEST_TOTAL.inc(("retried",))
+                logger.warning("заявка %s вернулась в очередь: %s", row.id, outcome)
+                await self._finish(_RETRY_SQL, row, _error_message(outcome))
+        if any(isinstance(o, int) for o in outcomes):
+            thumbnail_worker.wake()
+        return len(rows) + len(exhausted)
+
+    @staticmethod
+    async def _finish(stmt, row, error: str) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(stmt, {"id": row.id, "claimed_at": row.claimed_at, "error": error[:1000]})
+            await db.commit()
+
+    async def purge(self, batch: int = 10_000) -> int:
+        """Удалить завершённые заявки старше INGEST_RETENTION_SECONDS."""
+        total = 0
+        async with AsyncSessionLocal() as db:
+            while True:
+                deleted = (await db.execute(_PURGE_SQL, {"batch": batch, "retention": float(self.retention_seconds)})).rowcount
+                await db.commit()
+                total += deleted
+                if deleted < batch:
+                    break
+        if total:
+            logger.info("удалено завершённых заявок: %d", total)
+        return total
+
+ingest_worker = IngestWorker(
+    workers=max(settings.INGEST_WORKERS, 1),
+    batch=settings.INGEST_BATCH,
+    poll_seconds=settings.INGEST_POLL_SECONDS,
+    claim_timeout=settings.INGEST_CLAIM_TIMEOUT,
+    max_attempts=settings.INGEST_MAX_ATTEMPTS,
+    retention_seconds=settings.INGEST_RETENTION_SECONDS,
+)
+
+async def _drain() -> None:
+    total, t0 = 0, time.perf_counter()
+    try:
+        while True:
+            n = await ingest_worker.run_once()
+            if not n:
+                break
+            total += n
+            print(f"обработано {total} заявок, {total / (time.perf_counter() - t0):.1f}/с")
+    finally:
+        await async_engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Создать записи из всех заявок очереди приёма")
+    parser.add_argument("--drain", action="store_true", required=True)
+    parser.parse_args()
+    asyncio.run(_drain())
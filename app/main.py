@@ -1,65 +1,730 @@
-from fastapi import FastAPI, Depends, Query
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Query, Request, Header
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import DBAPIError, IntegrityError
 from typing import List, Optional
-from pydantic import EmailStr
+from datetime import datetime
+import asyncio
+import io
+import json
+import uuid
+from pydantic import EmailStr, ValidationError
 
-from .db import get_db, Base, engine
-from .schemas import SubmitDataIn, SubmitDataOut, PerevalOut, PatchOut
+from .db import get_async_db, Base, engine, async_engine, prewarm_pool
+from . import migrate
+from .replicas import ReadYourWritesMiddleware, get_read_db, is_replica, open_read_session, replicas, wants_primary
+from .schemas import (SubmitDataIn, SubmitDataPatch, SubmitDataOut, PatchOut, BatchItemOut, IngestOut,
+                      PerevalOut, PerevalNearOut, PerevalSearchOut, PerevalChangeOut,
+                      ClaimIn, DecisionIn, ReleaseIn, ModerationResultOut)
+from .config import settings
 from .repository import DataRepository
+from .uploads import MultipartSubmission, UploadRejected, MULTIPART_OPENAPI
+from .responses import blob_response, etag_for, etag_matches
+from .serializers import RawJSONResponse, dumps_pereval, dumps_pereval_list
+from .cache import response_cache, CachedResponse
+from .storage import get_blob_store
+from .pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor, cursor_int
+from . import geo
+from .metrics import MetricsMiddleware, registry, pool_collector, cache_collector
+from .models import ORIGINAL_VARIANT, ModerationStatus
+from .imaging import parse_variants
+from .thumbnails import thumbnail_worker
+from .ingest import INGEST_TOTAL, PREFER_ASYNC, ingest_worker, prefers_async
+from .admission import (ADMISSION_REJECTED, AdmissionRejected, BodyLimitMiddleware, PayloadTooLarge,
+                        budget_collector, check_images, image_budget, rejection_response)
+from .export import FORMATS as EXPORT_FORMATS, ExportFilter, as_utc, stream_export
+from .idempotency import (IDEMPOTENCY_HEADER, REPLAYED_HEADER, IDEMPOTENCY_TOTAL, IdempotencyKeyMismatch,
+                          check_key, fingerprint, purge_loop)
 
-app = FastAPI(title="FSTR Submit API", version="2.0.0")
+# ?variant= у чтений: original или производная из IMAGE_VARIANTS
+IMAGE_VARIANT_NAMES = (ORIGINAL_VARIANT, *parse_variants(settings.IMAGE_VARIANTS))
+if settings.DEFAULT_IMAGE_VARIANT not in IMAGE_VARIANT_NAMES:
+    raise ValueError(f"DEFAULT_IMAGE_VARIANT={settings.DEFAULT_IMAGE_VARIANT!r} нет в IMAGE_VARIANTS")
 
-# На проде — Alembic, здесь создаём, если не существует
-Base.metadata.create_all(bind=engine)
+def _variant_query(default: str = settings.DEFAULT_IMAGE_VARIANT):
+    return Query(default, regex="^(%s)$" % "|".join(IMAGE_VARIANT_NAMES),
+                 description="производная картинок; пока она не построена — оригинал")
+
+async def _prepare_schema(mode: str) -> None:
+    if mode == "create":
+        # Разработка: недостающие таблицы создаются сами (индексы и функции — только 00_schema.sql)
+        await run_in_threadpool(Base.metadata.create_all, bind=engine)
+    elif mode == "verify":
+        problems = await run_in_threadpool(migrate.verify)
+        if problems:
+            raise RuntimeError("Схема БД не совпадает, выполните python -m app.migrate: " + "; ".join(problems))
+    elif mode != "skip":
+        raise ValueError(f"SCHEMA_ON_STARTUP={mode!r}: ожидается create, verify или skip")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await _prepare_schema(settings.SCHEMA_ON_STARTUP)
+    await prewarm_pool(settings.DB_POOL_PREWARM)
+    # Превью строятся в фоне: в задержку POST/PATCH обработка картинок не входит
+    # Пустой IMAGE_VARIANTS — строить нечего: картинки остаются pending до появления вариантов
+    if settings.THUMBNAIL_WORKERS > 0 and thumbnail_worker.variants:
+        await thumbnail_worker.start()
+    # Заявки POST с Prefer: respond-async; оставшиеся от прошлого запуска разбираются сразу
+    if settings.INGEST_WORKERS > 0:
+        await ingest_worker.start()
+    purger = asyncio.create_task(purge_loop(settings.IDEMPOTENCY_PURGE_SECONDS))
+    yield
+    purger.cancel()
+    await ingest_worker.stop()
+    await thumbnail_worker.stop()
+    await async_engine.dispose()
+    await replicas.dispose()
+
+app = FastAPI(title="FSTR Submit API", version="2.0.0", lifespan=lifespan)
+# Лимит тела — внутри метрик: отказы 413 тоже попадают в гистограммы
+app.add_middleware(BodyLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
+if replicas:
+    app.add_middleware(ReadYourWritesMiddleware, sticky_seconds=settings.REPLICA_STICKY_SECONDS)
+registry.add_collector(pool_collector(async_engine.pool))
+registry.add_collector(cache_collector(response_cache))
+registry.add_collector(budget_collector(image_budget))
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    return rejection_response(request.method, exc)
 
 # ====== Спринт 1: создание ======
-@app.post("/submitData", response_model=SubmitDataOut)
-async def submit_data(payload: SubmitDataIn, db: Session = Depends(get_db)):
+async def _create_pereval(repo: DataRepository, payload: dict, idempotency_key: Optional[str],
+                          response: Response) -> int:
+    if idempotency_key is None:
+        new_id = await repo.create_pereval_from_payload(payload)
+    else:
+        key = check_key(idempotency_key)
+        # sha256 тела с base64 картинок — мегабайты, не в потоке событийного цикла
+        request_hash = await run_in_threadpool(fingerprint, payload)
+        try:
+            new_id, replayed = await repo.create_pereval_idempotent(
+                payload, key, request_hash, settings.IDEMPOTENCY_KEY_TTL_SECONDS)
+        except IdempotencyKeyMismatch:
+            IDEMPOTENCY_TOTAL.inc(("mismatch",))
+            raise
+        IDEMPOTENCY_TOTAL.inc(("replayed" if replayed else "created",))
+        response.headers[REPLAYED_HEADER] = "true" if replayed else "false"
+        if replayed:
+            return new_id
+    thumbnail_worker.wake()
+    return new_id
+
+_IDEMPOTENCY_RESPONSES = {
+    200: {"headers": {REPLAYED_HEADER: {"description": f"true — повтор запроса с тем же {IDEMPOTENCY_HEADER}"}}},
+    422: {"description": f"{IDEMPOTENCY_HEADER} уже использован с другим телом"},
+}
+_SUBMIT_RESPONSES = {
+    **_IDEMPOTENCY_RESPONSES,
+    202: {"model": IngestOut, "description": f"Prefer: {PREFER_ASYNC} — заявка в очереди, статус по Location"},
+}
+
+async def _enqueue_pereval(repo: DataRepository, payload: dict) -> Response:
+    ticket = str(await repo.enqueue_pereval(payload))
+    INGEST_TOTAL.inc(("queued",))
+    ingest_worker.wake()
+    return JSONResponse(
+        content={"ticket": ticket, "state": "queued", "id": None, "message": None}, status_code=202,
+        headers={"Location": f"/submitData/ingest/{ticket}", "Preference-Applied": PREFER_ASYNC},
+    )
+
+@app.post("/submitData", response_model=SubmitDataOut, responses=_SUBMIT_RESPONSES)
+async def submit_data(
+    payload: SubmitDataIn,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, description="ключ повтора (UUID клиента); живёт IDEMPOTENCY_KEY_TTL_SECONDS"),
+    prefer: Optional[str] = Header(None, description=f"{PREFER_ASYNC} — 202 и запись в фоне (без Idempotency-Key)"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    repo = DataRepository(db)
+    need = check_images(payload.images)  # 413 -> admission_rejected
+    # С Idempotency-Key предпочтение не применяется: повтор должен вернуть тот же id сразу
+    queue = settings.INGEST_ASYNC and idempotency_key is None and prefers_async(prefer)
+    async with image_budget.reserve(need, settings.ADMISSION_WAIT_SECONDS):  # 503
+        try:
+            if queue:
+                return await _enqueue_pereval(repo, payload.dict())
+            new_id = await _create_pereval(repo, payload.dict(), idempotency_key, response)
+            return SubmitDataOut(status=200, message=None, id=new_id)
+        except IdempotencyKeyMismatch as km:
+            await db.rollback()
+            return JSONResponse(content={"status": 422, "message": str(km), "id": None}, status_code=422)
+        except ValueError as ve:
+            await db.rollback()
+            return JSONResponse(content={"status": 400, "message": str(ve), "id": None}, status_code=400)
+        except IntegrityError as ie:
+            await db.rollback()
+            return JSONResponse(content={"status": 400, "message": "Нарушение уникальности: " + str(ie.orig), "id": None}, status_code=400)
+        except Exception as e:
+            await db.rollback()
+            return JSONResponse(content={"status": 500, "message": "Ошибка сервера: " + str(e), "id": None}, status_code=500)
+
+# ====== Отложенная запись (Prefer: respond-async): статус заявки ======
+@app.get("/submitData/ingest/{ticket}", response_model=IngestOut, responses={404: {"description": "Нет такой заявки"}})
+async def get_ingest_status(ticket: str, db: AsyncSession = Depends(get_async_db)):
+    """Статус заявки из 202. С primary: реплика может ещё не знать о заявке."""
+    try:
+        key = uuid.UUID(ticket)
+    except ValueError:
+        return JSONResponse(content={"detail": "Not found"}, status_code=404)
+    entry = await DataRepository(db).get_ingest_entry(key)
+    if entry is None:
+        return JSONResponse(content={"detail": "Not found"}, status_code=404)
+    return IngestOut(ticket=str(entry.ticket), state=entry.state, id=entry.pereval_id,
+                     message=entry.error if entry.state == "failed" else None)
+
+# ====== Потоковая загрузка multipart: фото не держатся в памяти целиком ======
+@app.post("/submitData/upload", response_model=SubmitDataOut, openapi_extra=MULTIPART_OPENAPI,
+          responses=_IDEMPOTENCY_RESPONSES)
+async def submit_data_multipart(
+    request: Request,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, description="ключ повтора (UUID клиента); живёт IDEMPOTENCY_KEY_TTL_SECONDS"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    try:
+        upload = await MultipartSubmission().read(request)
+    except UploadRejected as ur:
+        return JSONResponse(content={"status": ur.status_code, "message": str(ur), "id": None}, status_code=ur.status_code)
+    try:
+        payload = upload.to_payload()
+        await run_in_threadpool(upload.commit)
+    except UploadRejected as ur:
+        upload.abort()
+        return JSONResponse(content={"status": ur.status_code, "message": str(ur), "id": None}, status_code=ur.status_code)
+    except BaseException:
+        upload.abort()
+        raise
     repo = DataRepository(db)
     try:
-        new_id = repo.create_pereval_from_payload(payload.dict())
+        new_id = await _create_pereval(repo, payload, idempotency_key, response)
         return SubmitDataOut(status=200, message=None, id=new_id)
+    except IdempotencyKeyMismatch as km:
+        await db.rollback()
+        return JSONResponse(content={"status": 422, "message": str(km), "id": None}, status_code=422)
     except ValueError as ve:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(content={"status": 400, "message": str(ve), "id": None}, status_code=400)
     except IntegrityError as ie:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(content={"status": 400, "message": "Нарушение уникальности: " + str(ie.orig), "id": None}, status_code=400)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(content={"status": 500, "message": "Ошибка сервера: " + str(e), "id": None}, status_code=500)
 
-# ====== Спринт 2: чтение одной записи ======
-@app.get("/submitData/{pereval_id}", response_model=PerevalOut)
-async def get_pereval(pereval_id: int, db: Session = Depends(get_db)):
-    repo = DataRepository(db)
-    per = repo.get_pereval(pereval_id)
-    if not per:
-        return JSONResponse(content={"detail": "Not found"}, status_code=404)
-    return repo.to_dict(per)
-
-# ====== Спринт 2: правка (только status=new, без изменений ФИО/email/phone) ======
-@app.patch("/submitData/{pereval_id}", response_model=PatchOut)
-async def patch_pereval(pereval_id: int, payload: SubmitDataIn, db: Session = Depends(get_db)):
+@app.patch("/submitData/{pereval_id}/upload", response_model=PatchOut, openapi_extra=MULTIPART_OPENAPI)
+async def patch_pereval_multipart(pereval_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    try:
+        upload = await MultipartSubmission().read(request)
+    except UploadRejected as ur:
+        return PatchOut(state=0, message=str(ur))
+    try:
+        payload = upload.to_payload()
+        await run_in_threadpool(upload.commit)
+    except UploadRejected as ur:
+        upload.abort()
+        return PatchOut(state=0, message=str(ur))
+    except BaseException:
+        upload.abort()
+        raise
     repo = DataRepository(db)
     try:
-        repo.update_pereval_from_payload(pereval_id, payload.dict())
+        await repo.update_pereval_from_payload(pereval_id, payload)
+        thumbnail_worker.wake()
         return PatchOut(state=1, message=None)
     except ValueError as ve:
-        db.rollback()
+        await db.rollback()
         return PatchOut(state=0, message=str(ve))
     except IntegrityError as ie:
-        db.rollback()
+        await db.rollback()
         return PatchOut(state=0, message="Нарушение уникальности: " + str(ie.orig))
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return PatchOut(state=0, message="Ошибка сервера: " + str(e))
 
+# ====== Пакетная загрузка: NDJSON, по записи на строку ======
+def _batch_result(line: int, outcome) -> BatchItemOut:
+    if isinstance(outcome, int):
+        return BatchItemOut(line=line, status=200, message=None, id=outcome)
+    if isinstance(outcome, ValidationError):
+        return BatchItemOut(line=line, status=422, message=json.dumps(outcome.errors(), ensure_ascii=False), id=None)
+    if isinstance(outcome, ValueError):
+        return BatchItemOut(line=line, status=400, message=str(outcome), id=None)
+    if isinstance(outcome, IntegrityError):
+        return BatchItemOut(line=line, status=400, message="Нарушение уникальности: " + str(outcome.orig), id=None)
+    if isinstance(outcome, AdmissionRejected):
+        return BatchItemOut(line=line, status=outcome.status_code, message=outcome.detail, id=None)
+    return BatchItemOut(line=line, status=500, message="Ошибка сервера: " + str(outcome), id=None)
+
+@app.post(
+    "/submitData/batch",
+    response_model=List[BatchItemOut],
+    openapi_extra={"requestBody": {"required": True, "content": {"application/x-ndjson": {"schema": {"$ref": "#/components/schemas/SubmitDataIn"}}}}},
+)
+async def submit_data_batch(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Каждая строка — SubmitDataIn. Ответ — статус и id на каждую строку;
+    плохая строка не роняет остальные. Вставка пачками по BATCH_CHUNK_SIZE.
+    Строка длиннее MAX_BODY_BYTES пропускается не читаясь в память (413 в её результате)."""
+    repo = DataRepository(db)
+    results: List[BatchItemOut] = []
+    chunk: List[tuple] = []
+    chunk_bytes = 0
+    too_long = PayloadTooLarge("body", f"Строка больше {settings.MAX_BODY_BYTES} байт")
+
+    async def flush():
+        nonlocal chunk_bytes
+        # Пачка ждёт бюджет сколько нужно: отказ посреди потока хуже, чем притормозить клиента
+        async with image_budget.reserve(chunk_bytes, None):
+            outcomes = await repo.create_perevals_batch([p for _, p in chunk])
+        results.extend(_batch_result(n, o) for (n, _), o in zip(chunk, outcomes))
+        chunk.clear()
+        chunk_bytes = 0
+
+    async def lines():
+        buf = bytearray()
+        skipping = False  # хвост слишком длинной строки: байты отбрасываются до \n
+        async for data in request.stream():
+            start = 0
+            while (nl := data.find(b"\n", start)) != -1:
+                if skipping:
+                    yield None
+                else:
+                    buf += data[start:nl]
+                    yield None if len(buf) > settings.MAX_BODY_BYTES else bytes(buf)
+                buf.clear()
+                skipping = False
+                start = nl + 1
+            if not skipping:
+                buf += data[start:]
+                if len(buf) > settings.MAX_BODY_BYTES:
+                    buf.clear()
+                    skipping = True
+        yield None if skipping else bytes(buf)
+
+    line_no = 0
+    async for line in lines():
+        line_no += 1
+        if line is None:
+            ADMISSION_REJECTED.inc(("body",))
+            results.append(_batch_result(line_no, too_long))
+            continue
+        if not line.strip():
+            continue
+        try:
+            payload = SubmitDataIn.parse_raw(line).dict()
+            need = check_images(payload["images"])
+        except ValidationError as e:
+            # parse_raw отдаёт и битый JSON как ValidationError
+            results.append(_batch_result(line_no, e))
+            continue
+        except AdmissionRejected as e:
+            ADMISSION_REJECTED.inc((e.reason,))
+            results.append(_batch_result(line_no, e))
+            continue
+        chunk.append((line_no, payload))
+        chunk_bytes += need
+        # Пачка копится до BATCH_CHUNK_SIZE записей или до MAX_BODY_BYTES картинок
+        if len(chunk) >= settings.BATCH_CHUNK_SIZE or chunk_bytes >= settings.MAX_BODY_BYTES:
+            await flush()
+    if chunk:
+        await flush()
+    thumbnail_worker.wake()
+    results.sort(key=lambda r: r.line)
+    return results
+
+# ====== Гео-поиск: рядом с точкой и в рамке карты ======
+async def _near_page(db: AsyncSession, lat: float, lon: float, boxes: List[geo.Box], radius_km: Optional[float],
+                     include_images: bool, limit: int, cursor: Optional[str], variant: str) -> Response:
+    try:
+        after = None
+        if cursor:
+            key = decode_cursor(cursor)
+            after = (float(key["d"]), cursor_int(key, "id"))
+    except (KeyError, TypeError, ValueError):
+        return JSONResponse(content={"detail": "Некорректный cursor"}, status_code=400)
+    repo = DataRepository(db)
+    rows = await repo.list_perevals_near(lat, lon, boxes, radius_km, include_images, limit + 1, after, variant)
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        per, d = rows[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor({"d": d, "id": int(per.id)})
+    items = []
+    for per, d in rows:
+        item = await repo.to_dict(per, include_images=include_images, variant=variant)
+        item["distance_km"] = round(d, 3)
+        items.append(item)
+    return RawJSONResponse(dumps_pereval_list(items), headers=headers)
+
+_GEO_RESPONSES = {200: {"headers": {NEXT_CURSOR_HEADER: {"description": "курсор следующей страницы"}}}}
+
+@app.get("/submitData/near", response_model=List[PerevalNearOut], responses=_GEO_RESPONSES)
+async def list_near(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(..., gt=0, le=1000),
+    include_images: bool = Query(False, description="true — с base64 картинок"),
+    variant: str = _variant_query(),
+    limit: int = Query(50, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description=f"значение {NEXT_CURSOR_HEADER} предыдущей страницы"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Перевалы в радиусе ``radius_km`` от точки, ближние первыми."""
+    return await _near_page(db, lat, lon, geo.boxes_around(lat, lon, radius_km), radius_km,
+                            include_images, limit, cursor, variant)
+
+@app.get("/submitData/bbox", response_model=List[PerevalNearOut], responses=_GEO_RESPONSES)
+async def list_in_bbox(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    lat: Optional[float] = Query(None, ge=-90, le=90, description="точка отсчёта расстояния; по умолчанию центр рамки"),
+    lon: Optional[float] = Query(None, ge=-180, le=180),
+    include_images: bool = Query(False, description="true — с base64 картинок"),
+    variant: str = _variant_query(),
+    limit: int = Query(50, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description=f"значение {NEXT_CURSOR_HEADER} предыдущей страницы"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Перевалы в рамке карты; min_lon > max_lon — рамка через 180-й меридиан."""
+    if min_lat > max_lat:
+        return JSONResponse(content={"detail": "min_lat больше max_lat"}, status_code=400)
+    if (lat is None) != (lon is None):
+        return JSONResponse(content={"detail": "lat и lon задаются вместе"}, status_code=400)
+    if lat is None:
+        lat, lon = geo.box_center(min_lat, min_lon, max_lat, max_lon)
+    return await _near_page(db, lat, lon, geo.split_antimeridian(min_lat, min_lon, max_lat, max_lon), None,
+                            include_images, limit, cursor, variant)
+
+# ====== Нечёткий поиск по названиям (pg_trgm) ======
+@app.get("/submitData/search", response_model=List[PerevalSearchOut], responses=_GEO_RESPONSES)
+async def search_perevals(
+    q: str = Query(..., min_length=2, max_length=100, description="название или его часть, опечатки допустимы"),
+    variant: str = _variant_query(),
+    limit: int = Query(50, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description=f"значение {NEXT_CURSOR_HEADER} предыдущей страницы"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Поиск по beauty_title, title и other_titles; лучшие совпадения первыми, картинки без base64."""
+    try:
+        after = None
+        if cursor:
+            key = decode_cursor(cursor)
+            after = (float(key["s"]), cursor_int(key, "id"))
+    except (KeyError, TypeError, ValueError):
+        return JSONResponse(content={"detail": "Некорректный cursor"}, status_code=400)
+    repo = DataRepository(db)
+    try:
+        rows = await repo.search_perevals(q, settings.SEARCH_SIMILARITY, limit + 1, after, variant)
+    except DBAPIError as e:
+        # 42883 undefined_function: в БД не установлен pg_trgm (00_schema.sql не применён)
+        if getattr(e.orig, "pgcode", None) == "42883":
+            await db.rollback()
+            return JSONResponse(content={"detail": "Поиск недоступен: нет расширения pg_trgm"}, status_code=503)
+        raise
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        per, sc = rows[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor({"s": sc, "id": int(per.id)})
+    items = []
+    for per, sc in rows:
+        item = await repo.to_dict(per, include_images=False, variant=variant)
+        item["score"] = round(sc, 4)
+        items.append(item)
+    return RawJSONResponse(dumps_pereval_list(items), headers=headers)
+
+# ====== Лента изменений для офлайн-синхронизации ======
+HAS_MORE_HEADER = "X-Has-More"
+
+def _decode_changes_cursor(cursor: str):
+    key = decode_cursor(cursor)
+    try:
+        updated_at = datetime.fromisoformat(key["t"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Некорректный cursor")
+    if updated_at.tzinfo is None:
+        raise ValueError("Некорректный cursor")
+    return updated_at, cursor_int(key, "id")
+
+@app.get(
+    "/submitData/changes",
+    response_model=List[PerevalChangeOut],
+    responses={200: {"headers": {
+        NEXT_CURSOR_HEADER: {"description": "передать как since в следующий раз"},
+        HAS_MORE_HEADER: {"description": "true — за этой страницей есть ещё изменения"},
+    }}},
+)
+async def list_changes(
+    since: Optional[str] = Query(None, description=f"{NEXT_CURSOR_HEADER} прошлой синхронизации; без него — с начала"),
+    user__email: Optional[EmailStr] = Query(None, description="только записи пользователя"),
+    include_images: bool = Query(False, description="true — с base64 картинок"),
+    variant: str = _variant_query(),
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Созданные, изменённые и сменившие статус записи после ``since``, по (updated_at, id).
+
+    Курсор приходит всегда (на пустой странице — тот же ``since``): клиент
+    хранит его между синхронизациями и докачивает, пока X-Has-More: true.
+    """
+    try:
+        after = _decode_changes_cursor(since) if since else None
+    except ValueError as ve:
+        return JSONResponse(content={"detail": str(ve)}, status_code=400)
+    repo = DataRepository(db)
+    rows = await repo.list_changes(user__email, settings.CHANGES_SAFETY_LAG_SECONDS, limit + 1, after,
+                                   include_images, variant)
+    headers = {HAS_MORE_HEADER: "true" if len(rows) > limit else "false"}
+    rows = rows[:limit]
+    if rows:
+        last = rows[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor({"t": last.updated_at.isoformat(), "id": int(last.id)})
+    elif since:
+        headers[NEXT_CURSOR_HEADER] = since
+    items = []
+    for per in rows:
+        item = await repo.to_dict(per, include_images, variant)
+        item["updated_at"] = per.updated_at.isoformat(sep=" ")
+        items.append(item)
+    return RawJSONResponse(dumps_pereval_list(items), headers=headers)
+
+# ====== Выгрузка каталога (NDJSON / CSV / GeoJSON) ======
+@app.get(
+    "/submitData/export",
+    response_class=StreamingResponse,
+    responses={200: {"content": {media: {} for media, _ in EXPORT_FORMATS.values()}}},
+)
+async def export_catalog(
+    request: Request,
+    format: str = Query("ndjson", regex="^(%s)$" % "|".join(EXPORT_FORMATS)),
+    status: Optional[List[str]] = Query(None, description="можно несколько раз; без него — все статусы"),
+    updated_since: Optional[datetime] = Query(None, description="updated_at >= (без пояса — UTC)"),
+    updated_before: Optional[datetime] = Query(None, description="updated_at <"),
+):
+    """Весь каталог или выборка потоком: серверный курсор, без картинок и персональных данных."""
+    bad = sorted(set(status or ()) - {s.value for s in ModerationStatus})
+    if bad:
+        return JSONResponse(content={"detail": f"Неизвестный status: {', '.join(bad)}"}, status_code=400)
+    flt = ExportFilter(status or (), as_utc(updated_since), as_utc(updated_before))
+    prefer_primary = wants_primary(request)
+
+    async def body():
+        # Своя сессия на всё время потока: зависимость закрылась бы до конца тела
+        async with await open_read_session(prefer_primary) as db:
+            async for chunk in stream_export(db, format, flt):
+                yield chunk
+
+    media_type, ext = EXPORT_FORMATS[format]
+    headers = {"Content-Disposition": f'attachment; filename="perevals.{ext}"'}
+    return StreamingResponse(body(), media_type=media_type, headers=headers)
+
+# ====== Спринт 2: чтение одной записи ======
+@app.get(
+    "/submitData/{pereval_id}",
+    response_model=PerevalOut,
+    responses={304: {"description": "Not Modified (If-None-Match совпал с ETag)"}},
+)
+async def get_pereval(
+    pereval_id: int,
+    include_images: bool = Query(True, description="false — без base64, только метаданные и url картинок"),
+    variant: str = _variant_query(),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_read_db),
+):
+    # Кэш готовых тел: попадание и 304 обходятся без БД
+    key = (include_images, variant)
+    cached = response_cache.get(pereval_id, key)
+    if cached is None:
+        generation = response_cache.generation(pereval_id)
+        repo = DataRepository(db)
+        per = await repo.get_pereval(pereval_id, include_images=include_images, variant=variant)
+        if not per:
+            return JSONResponse(content={"detail": "Not found"}, status_code=404)
+        body = dumps_pereval(await repo.to_dict(per, include_images=include_images, variant=variant))
+        cached = CachedResponse(body=body, etag=etag_for(None, body), updated_at=per.updated_at)
+        # С реплики: сразу после локальной правки тело может быть старым — не кэшируем
+        response_cache.put(pereval_id, key, cached, generation,
+                           settle=settings.REPLICA_STICKY_SECONDS if is_replica(db) else 0.0)
+    headers = {"ETag": cached.etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, cached.etag):
+        return Response(status_code=304, headers=headers)
+    return RawJSONResponse(content=cached.body, headers=headers)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return response_cache.stats()
+
+# ====== Метрики Prometheus ======
+@app.get("/metrics", response_class=Response, include_in_schema=False)
+async def metrics():
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# ====== Сырые байты картинки: Range, ETag/If-None-Match ======
+IMAGE_VARIANT_HEADER = "X-Image-Variant"
+
+@app.get(
+    "/submitData/{pereval_id}/images/{image_id}",
+    response_class=Response,
+    responses={200: {"content": {"image/*": {}}}, 206: {"description": "Partial Content"}, 304: {"description": "Not Modified"}},
+)
+async def get_pereval_image(
+    pereval_id: int,
+    image_id: int,
+    variant: str = _variant_query(ORIGINAL_VARIANT),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_read_db),
+):
+    repo = DataRepository(db)
+    im = await repo.get_image(pereval_id, image_id, variant)
+    if not im:
+        return JSONResponse(content={"detail": "Not found"}, status_code=404)
+    # Производная ещё не готова — отдаём оригинал, что именно ушло, видно по заголовку
+    im = repo.pick_variant(im, variant) or im
+    headers = {IMAGE_VARIANT_HEADER: getattr(im, "variant", ORIGINAL_VARIANT)}
+    media_type = im.mime_type or "application/octet-stream"
+    if im.sha256:
+        store = get_blob_store()
+        try:
+            f = await run_in_threadpool(store.open, im.sha256)
+        except KeyError:
+            return JSONResponse(content={"detail": "Image data missing"}, status_code=404)
+        size = im.size if im.size is not None else await run_in_threadpool(store.size, im.sha256)
+        etag = etag_for(im.sha256)
+    else:
+        f, size, etag = io.BytesIO(im.data), len(im.data), etag_for(None, im.data)
+    response = blob_response(f, size, media_type, etag, range_header, if_none_match)
+    response.headers.update(headers)
+    if headers[IMAGE_VARIANT_HEADER] != variant:
+        # Подмена оригиналом временная: по этому url позже будет превью
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# ====== Спринт 2: правка (только status=new, без изменений ФИО/email/phone) ======
+@app.patch("/submitData/{pereval_id}", response_model=PatchOut)
+async def patch_pereval(pereval_id: int, payload: SubmitDataPatch, db: AsyncSession = Depends(get_async_db)):
+    """JSON merge-patch: только меняемые поля; ``images`` — новый список целиком,
+    уже загруженные картинки можно передать как ``{"sha256", "title"}``."""
+    repo = DataRepository(db)
+    need = check_images(payload.images)
+    async with image_budget.reserve(need, settings.ADMISSION_WAIT_SECONDS):
+        try:
+            await repo.update_pereval_from_payload(pereval_id, payload.dict(exclude_unset=True))
+            thumbnail_worker.wake()
+            return PatchOut(state=1, message=None)
+        except ValueError as ve:
+            await db.rollback()
+            return PatchOut(state=0, message=str(ve))
+        except IntegrityError as ie:
+            await db.rollback()
+            return PatchOut(state=0, message="Нарушение уникальности: " + str(ie.orig))
+        except Exception as e:
+            await db.rollback()
+            return PatchOut(state=0, message="Ошибка сервера: " + str(e))
+
+# ====== Очередь модерации: аренда пачек (SKIP LOCKED), пакетное решение ======
+CLAIM_EXPIRES_HEADER = "X-Claim-Expires-At"
+
+@app.post(
+    "/moderation/claim",
+    response_model=List[PerevalOut],
+    responses={200: {"headers": {CLAIM_EXPIRES_HEADER: {"description": "срок аренды, ISO 8601"}}}},
+)
+async def moderation_claim(
+    body: ClaimIn,
+    include_images: bool = Query(False, description="true — с base64 картинок"),
+    variant: str = _variant_query(),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Берёт в работу до ``limit`` записей (new -> pending) на ``lease_seconds``.
+
+    Не решённые за срок аренды записи снова выдаются следующему claim.
+    """
+    if body.limit > settings.MODERATION_MAX_CLAIM:
+        return JSONResponse(content={"detail": f"limit больше {settings.MODERATION_MAX_CLAIM}"}, status_code=400)
+    lease = min(body.lease_seconds or settings.MODERATION_LEASE_SECONDS, settings.MODERATION_MAX_LEASE_SECONDS)
+    repo = DataRepository(db)
+    try:
+        ids, expires_at = await repo.claim_for_moderation(body.moderator, body.limit, lease)
+    except Exception as e:
+        await db.rollback()
+        return JSONResponse(content={"detail": "Ошибка сервера: " + str(e)}, status_code=500)
+    headers = {CLAIM_EXPIRES_HEADER: expires_at.isoformat()} if expires_at else {}
+    items = await repo.list_perevals_by_ids(ids, include_images=include_images, variant=variant)
+    return RawJSONResponse(dumps_pereval_list([await repo.to_dict(p, include_images, variant) for p in items]),
+                           headers=headers)
+
+@app.post("/moderation/decide", response_model=ModerationResultOut)
+async def moderation_decide(body: DecisionIn, db: AsyncSession = Depends(get_async_db)):
+    """accepted/rejected с moderator_note для своих арендованных записей."""
+    try:
+        done = await DataRepository(db).decide_moderation(body.moderator, body.ids, body.status, body.moderator_note)
+    except Exception as e:
+        await db.rollback()
+        return JSONResponse(content={"detail": "Ошибка сервера: " + str(e)}, status_code=500)
+    return ModerationResultOut(updated=done, skipped=sorted(set(body.ids) - set(done)))
+
+@app.post("/moderation/release", response_model=ModerationResultOut)
+async def moderation_release(body: ReleaseIn, db: AsyncSession = Depends(get_async_db)):
+    """Вернуть свои арендованные записи в очередь до срока."""
+    try:
+        done = await DataRepository(db).release_claims(body.moderator, body.ids)
+    except Exception as e:
+        await db.rollback()
+        return JSONResponse(content={"detail": "Ошибка сервера: " + str(e)}, status_code=500)
+    return ModerationResultOut(updated=done, skipped=sorted(set(body.ids) - set(done)))
+
 # ====== Спринт 2: список пользователя по email ======
-@app.get("/submitData/", response_model=List[PerevalOut])
-async def list_by_user_email(user__email: EmailStr = Query(..., description="email пользователя"), db: Session = Depends(get_db)):
+@app.get(
+    "/submitData/",
+    response_model=List[PerevalOut],
+    responses={200: {"content": {"application/x-ndjson": {}}, "headers": {NEXT_CURSOR_HEADER: {"description": "курсор следующей страницы"}}}},
+)
+async def list_by_user_email(
+    request: Request,
+    user__email: EmailStr = Query(..., description="email пользователя"),
+    include_images: bool = Query(True, description="false — без base64, только метаданные и url картинок"),
+    variant: str = _variant_query(),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="размер страницы; без него — весь список"),
+    cursor: Optional[str] = Query(None, description=f"значение {NEXT_CURSOR_HEADER} предыдущей страницы"),
+    format: str = Query("json", regex="^(json|ndjson)$", description="ndjson — потоковая выдача по строке на запись"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    try:
+        before_id = cursor_int(decode_cursor(cursor), "id") if cursor else None
+    except ValueError as ve:
+        return JSONResponse(content={"detail": str(ve)}, status_code=400)
     repo = DataRepository(db)
-    items = repo.list_perevals_by_email(user__email)
-    return [repo.to_dict(p) for p in items]
+    headers = {}
+
+    if format == "ndjson":
+        prefer_primary = wants_primary(request)
+        if limit is not None:
+            # Курсор нужен в заголовке до первой строки тела — узнаём его по одним id
+            ids = await repo.list_pereval_ids_by_email(user__email, limit + 1, before_id)
+            if len(ids) > limit:
+                headers[NEXT_CURSOR_HEADER] = encode_cursor({"id": ids[limit - 1]})
+
+        async def rows():
+            # Своя сессия: зависимость get_async_db закрывается раньше, чем досылается тело
+            async with await open_read_session(prefer_primary) as stream_db:
+                stream_repo = DataRepository(stream_db)
+                async for per in stream_repo.iter_perevals_by_email(user__email, include_images, limit, before_id,
+                                                                    variant=variant):
+                    yield dumps_pereval(await stream_repo.to_dict(per, include_images, variant)) + b"\n"
+
+        return StreamingResponse(rows(), media_type="application/x-ndjson", headers=headers)
+
+    items = await repo.list_perevals_by_email(user__email, include_images=include_images,
+                                        limit=limit + 1 if limit is not None else None, before_id=before_id,
+                                        variant=variant)
+    if limit is not None and len(items) > limit:
+        items = items[:limit]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor({"id": int(items[-1].id)})
+    return RawJSONResponse(dumps_pereval_list([await repo.to_dict(p, include_images, variant) for p in items]),
+                           headers=headers)
@@ -0,0 +1,257 @@
+"""Метрики в текстовом формате Prometheus (GET /metrics).
+
+Без prometheus_client: нужны только счётчики и гистограммы, а свой реестр
+— это пара dict и один lock на наблюдение.
+
+* MetricsMiddleware — чистый ASGI (без BaseHTTPMiddleware, чтобы не
+  буферизовать потоковые ответы): латентность по шаблону маршрута, размеры
+  тела запроса и ответа, SQL-операторов и SQL-время на запрос.
+* instrument_engine — before/after_cursor_execute: длительность каждого
+  оператора, атрибуция к текущему запросу через contextvar, лог медленных.
+* TimedAsyncPool — ожидание соединения из пула (checkout).
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from .config import settings
+
+logger = logging.getLogger("fstr.sql")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(10))  # 256 Б .. 64 МБ
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...] = (), value: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        with self._lock:
+            return [(self.name, tuple(zip(self.labelnames, k)), v) for k, v in self._values.items()]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам (не накопительные) + «+Inf», сумма]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            row[0][i] += 1
+            row[1] += value
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        out = []
+        with self._lock:
+            rows = [(k, list(v[0]), v[1]) for k, v in self._values.items()]
+        for key, counts, total in rows:
+            labels = tuple(zip(self.labelnames, key))
+            acc = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                acc += n
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                out.append((self.name + "_bucket", labels + (("le", le),), acc))
+            out.append((self.name + "_sum", labels, total))
+            out.append((self.name + "_count", labels, acc))
+        return out
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+        # Значения, которые дешевле снять в момент scrape (пул, кэш)
+        self._collectors: List[Callable[[], List[Tuple[str, str, str, float]]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn: Callable[[], List[Tuple[str, str, str, float]]]) -> None:
+        self._collectors.append(fn)
+
+    def render(self) -> bytes:
+        lines = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                lines.append(f"{name}{_labels(labels)} {_num(value)}")
+        for fn in self._collectors:
+            for name, kind, help, value in fn():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {_num(value)}")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+def _labels(labels) -> str:
+    if not labels:
+        return ""
+    body = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels)
+    return "{" + body + "}"
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+registry = Registry()
+
+HTTP_DURATION = registry.register(Histogram(
+    "fstr_http_request_duration_seconds", "Время обработки запроса", LATENCY_BUCKETS, ("method", "route", "status")))
+HTTP_REQUEST_BYTES = registry.register(Histogram(
+    "fstr_http_request_size_bytes", "Размер тела запроса", SIZE_BUCKETS, ("method", "route")))
+HTTP_RESPONSE_BYTES = registry.register(Histogram(
+    "fstr_http_response_size_bytes", "Размер тела ответа", SIZE_BUCKETS, ("method", "route")))
+REQUEST_SQL_STATEMENTS = registry.register(Histogram(
+    "fstr_request_sql_statements", "SQL-операторов на один HTTP-запрос", COUNT_BUCKETS, ("method", "route")))
+REQUEST_SQL_SECONDS = registry.register(Histogram(
+    "fstr_request_sql_seconds", "Суммарное время SQL на один HTTP-запрос", LATENCY_BUCKETS, ("method", "route")))
+SQL_DURATION = registry.register(Histogram(
+    "fstr_sql_statement_duration_seconds", "Время одного SQL-оператора", LATENCY_BUCKETS, ("operation",)))
+SQL_SLOW = registry.register(Counter(
+    "fstr_sql_slow_statements_total", "Операторов дольше SLOW_QUERY_MS", ("operation",)))
+POOL_CHECKOUT_WAIT = registry.register(Histogram(
+    "fstr_db_pool_checkout_wait_seconds", "Ожидание соединения из пула", LATENCY_BUCKETS))
+
+# ====== Атрибуция SQL к запросу ======
+class RequestStats:
+    __slots__ = ("route", "sql_statements", "sql_seconds")
+
+    def __init__(self):
+        self.route = ""
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+
+_current: "contextvars.ContextVar[Optional[RequestStats]]" = contextvars.ContextVar("fstr_request_stats", default=None)
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+def _operation(statement: str) -> str:
+    # Первое слово: SELECT/INSERT/UPDATE/DELETE/WITH — метка с малой кардинальностью
+    head = statement.lstrip()[:16].split(None, 1)
+    return head[0].upper() if head else ""
+
+def instrument_engine(sync_engine) -> None:
+    """Вешает замер SQL на движок (для AsyncEngine — на его .sync_engine)."""
+    slow = settings.SLOW_QUERY_MS / 1000 if settings.SLOW_QUERY_MS > 0 else None
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("fstr_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["fstr_query_start"].pop()
+        op = _operation(statement)
+        SQL_DURATION.observe((op,), elapsed)
+        stats = _current.get()
+        if stats is not None:
+            stats.sql_statements += 1
+            stats.sql_seconds += elapsed
+        if slow is not None and elapsed >= slow:
+            SQL_SLOW.inc((op,))
+            logger.warning("медленный SQL %.1f мс [%s]: %s", elapsed * 1000,
+                           stats.route if stats else "-", " ".join(statement.split())[:1000])
+
+    # Ошибка оператора: after_cursor_execute не придёт — снимаем отметку
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("fstr_query_start"):
+            conn.info["fstr_query_start"].pop()
+
+class TimedAsyncPool(AsyncAdaptedQueuePool):
+    """QueuePool для asyncpg, замеряющий ожидание свободного соединения."""
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe((), time.perf_counter() - t0)
+
+def pool_collector(pool) -> Callable[[], List[Tuple[str, str, str, float]]]:
+    def collect():
+        return [
+            ("fstr_db_pool_size", "gauge", "Размер пула", pool.size()),
+            ("fstr_db_pool_checked_out", "gauge", "Соединений выдано", pool.checkedout()),
+            ("fstr_db_pool_overflow", "gauge", "Соединений сверх pool_size", max(pool.overflow(), 0)),
+        ]
+    return collect
+
+def cache_collector(cache) -> Callable[[], List[Tuple[str, str, str, float]]]:
+    def collect():
+        st = cache.stats()
+        return [
+            ("fstr_response_cache_entries", "gauge", "Записей в кэше ответов", st["entries"]),
+            ("fstr_response_cache_size_bytes", "gauge", "Байт в кэше ответов", st["size_bytes"]),
+            ("fstr_response_cache_hits_total", "counter", "Попаданий в кэш ответов", st["hits"]),
+            ("fstr_response_cache_misses_total", "counter", "Промахов кэша ответов", st["misses"]),
+            ("fstr_response_cache_evictions_total", "counter", "Вытеснений из кэша ответов", st["evictions"]),
+        ]
+    return collect
+
+# ====== ASGI middleware ======
+class MetricsMiddleware:
+    def __init__(self, app, skip_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        stats.route = f"{scope['method']} {scope['path']}"
+        token = _current.set(stats)
+        t0 = time.perf_counter()
+        sizes = [0, 0]
+        status = [500]
+
+        async def receive_counted():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes[0] += len(message.get("body", b""))
+            return message
+
+        async def send_counted(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes[1] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_counted, send_counted)
+        finally:
+            _current.reset(token)
+            # Шаблон пути, а не сам путь: иначе метка на каждый id
+            route = scope.get("route")
+            path = getattr(route, "path", "<unmatched>")
+            method = scope["method"]
+            HTTP_DURATION.observe((method, path, str(status[0])), time.perf_counter() - t0)
+            HTTP_REQUEST_BYTES.observe((method, path), sizes[0])
+            HTTP_RESPONSE_BYTES.observe((method, path), sizes[1])
+            REQUEST_SQL_STATEMENTS.observe((method, path), stats.sql_statements)
+            REQUEST_SQL_SECONDS.observe((method, path), stats.sql_seconds)
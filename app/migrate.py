@@ -0,0 +1,119 @@
+"""Схема БД: применение 00_schema.sql и проверка перед запуском API.
+
+    python -m app.migrate            # применить 00_schema.sql (идемпотентно)
+    python -m app.migrate --verify   # только проверить, код возврата 1 при расхождении
+
+В проде схема ставится этой командой один раз до запуска воркеров
+(start.sh), а сами воркеры стартуют с SCHEMA_ON_STARTUP=skip — без
+create_all и рефлексии в каждом процессе.
+"""
+import argparse
+import os
+import re
+import sys
+from typing import Iterator, List
+
+from sqlalchemy import inspect, text
+
+from . import models  # noqa: F401 — регистрирует таблицы в Base.metadata
+from .db import Base, engine
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "00_schema.sql")
+
+_INDEX_RE = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+def split_sql(script: str) -> Iterator[str]:
+    """Операторы скрипта по ``;`` — кроме строк, комментариев и тел $$...$$."""
+    buf, i, n = [], 0, len(script)
+    while i < n:
+        ch = script[i]
+        if script.startswith("--", i):
+            end = script.find("\n", i)
+            i = n if end == -1 else end + 1
+            continue
+        if ch == "'":
+            end = i + 1
+            while True:
+                end = script.find("'", end)
+                if end == -1 or not script.startswith("''", end):
+                    break
+                end += 2
+            end = n if end == -1 else end + 1
+            buf.append(script[i:end])
+            i = end
+            continue
+        m = re.match(r"\$\w*\$", script[i:]) if ch == "$" else None
+        if m:
+            tag = m.group(0)
+            end = script.find(tag, i + len(tag))
+            end = n if end == -1 else end + len(tag)
+            buf.append(script[i:end])
+            i = end
+            continue
+        if ch == ";":
+            stmt = "".join(buf).strip()
+            if stmt:
+                yield stmt
+            buf = []
+        else:
+            buf.append(ch)
+        i += 1
+    stmt = "".join(buf).strip()
+    if stmt:
+        yield stmt
+
+def apply_schema(path: str = SCHEMA_PATH, keep_going: bool = False) -> int:
+    """Выполняет скрипт по оператору в autocommit; число неудачных операторов."""
+    with open(path, encoding="utf-8") as f:
+        statements = list(split_sql(f.read()))
+    failed = 0
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for stmt in statements:
+            try:
+                conn.exec_driver_sql(stmt)
+            except Exception as e:
+                failed += 1
+                first_line = stmt.splitlines()[0]
+                print(f"ошибка: {first_line} ...\n  {getattr(e, 'orig', e)}".rstrip(), file=sys.stderr)
+                if not keep_going:
+                    raise
+    print(f"применено {len(statements) - failed} из {len(statements)} операторов {os.path.basename(path)}")
+    return failed
+
+def verify(path: str = SCHEMA_PATH) -> List[str]:
+    """Расхождения БД со схемой: таблицы и колонки моделей, индексы из скрипта."""
+    problems = []
+    insp = inspect(engine)
+    tables = set(insp.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            problems.append(f"нет таблицы {table.name}")
+            continue
+        have = {c["name"] for c in insp.get_columns(table.name)}
+        problems += [f"нет колонки {table.name}.{c.name}" for c in table.columns if c.name not in have]
+    with open(path, encoding="utf-8") as f:
+        expected = set(_INDEX_RE.findall(f.read()))
+    with engine.connect() as conn:
+        present = set(conn.execute(text("SELECT indexname FROM pg_indexes WHERE schemaname = 'public'")).scalars())
+    problems += [f"нет индекса {name}" for name in sorted(expected - present)]
+    return problems
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Применить или проверить схему БД (00_schema.sql)")
+    parser.add_argument("--verify", action="store_true", help="только проверить")
+    parser.add_argument("--keep-going", action="store_true", help="не останавливаться на ошибке оператора")
+    parser.add_argument("--schema", default=SCHEMA_PATH)
+    args = parser.parse_args()
+    if not args.verify:
+        failed = apply_schema(args.schema, args.keep_going)
+        if failed:
+            sys.exit(1)
+    problems = verify(args.schema)
+    for p in problems:
+        print(p, file=sys.stderr)
+    if problems:
+        sys.exit(1)
+    print("схема в порядке")
+
+if __name__ == "__main__":
+    main()
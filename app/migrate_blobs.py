@@ -0,0 +1,50 @@
+"""Перенос картинок из images.data (BYTEA) в BlobStore.
+
+Запуск: python -m app.migrate_blobs [--batch 100]
+
+Идёт пачками по id, каждая пачка — отдельная транзакция, поэтому
+прерванный перенос можно просто запустить заново.
+"""
+import argparse
+
+from sqlalchemy import select, update
+
+from . import models
+from .db import SessionLocal
+from .storage import get_blob_store
+
+def migrate(batch: int = 100) -> int:
+    store = get_blob_store()
+    moved = 0
+    last_id = 0
+    while True:
+        with SessionLocal() as db:
+            rows = db.execute(
+                select(models.Image.id, models.Image.data)
+                .where(models.Image.sha256.is_(None), models.Image.data.is_not(None), models.Image.id > last_id)
+                .order_by(models.Image.id)
+                .limit(batch)
+            ).all()
+            if not rows:
+                return moved
+            for image_id, data in rows:
+                blob = store.put(bytes(data))
+                db.execute(
+                    update(models.Image)
+                    .where(models.Image.id == image_id)
+                    .values(sha256=blob.sha256, size=blob.size, mime_type=blob.mime_type, data=None)
+                )
+            db.commit()
+            moved += len(rows)
+            last_id = rows[-1][0]
+            print(f"перенесено {moved} (id <= {last_id})")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Перенос images.data в BlobStore")
+    parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args()
+    total = migrate(args.batch)
+    print(f"готово: {total}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from sqlalchemy import (
-    Column, BigInteger, Integer, Text, ForeignKey, DateTime, LargeBinary, Numeric
+    Column, BigInteger, Integer, Text, ForeignKey, DateTime, LargeBinary, Numeric, UniqueConstraint
 )
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .db import Base
@@ -54,20 +55,75 @@ class Pereval(Base):
     from sqlalchemy.dialects.postgresql import ENUM as PGEnum
     status = Column(PGEnum(ModerationStatus, name="moderation_status"), nullable=False, default=ModerationStatus.new)
     moderator_note = Column(Text, nullable=False, default="")
+    # Очередь модерации: аренда записи модератором (status=pending)
+    claimed_by = Column(Text, nullable=True)
+    claim_expires_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
     user = relationship("User", back_populates="perevals")
     coords = relationship("Coords", back_populates="perevals")
     levels = relationship("Levels", back_populates="perevals")
-    images = relationship("Image", back_populates="pereval", cascade="all, delete-orphan")
+    # order_by: порядок загрузки; без него после UPDATE строк (статус превью) он плывёт
+    images = relationship("Image", back_populates="pereval", cascade="all, delete-orphan", order_by="Image.id")
 
 class Image(Base):
     __tablename__ = "images"
     id = Column(BigInteger, primary_key=True)
     pereval_id = Column(BigInteger, ForeignKey("pereval.id", ondelete="CASCADE"), nullable=False)
     title = Column(Text, nullable=False)
-    data = Column(LargeBinary, nullable=False)
+    # Байты лежат в BlobStore по sha256; data — только для ещё не перенесённых строк
+    sha256 = Column(Text, nullable=True)
+    size = Column(BigInteger, nullable=True)
+    mime_type = Column(Text, nullable=True)
+    data = Column(LargeBinary, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Производные (превью и т.п.) строит фоновый ThumbnailWorker:
+    # pending -> processing -> ready | failed
+    variants_status = Column(Text, nullable=False, server_default="pending")
+    variants_claimed_at = Column(DateTime(timezone=True), nullable=True)
+    variants_error = Column(Text, nullable=True)
 
     pereval = relationship("Pereval", back_populates="images")
+    variants = relationship("ImageVariant", back_populates="image", cascade="all, delete-orphan",
+                            passive_deletes=True, lazy="noload")
+
+# Вариант "original" — сам исходник, строки в image_variants у него нет
+ORIGINAL_VARIANT = "original"
+
+class ImageVariant(Base):
+    __tablename__ = "image_variants"
+    id = Column(BigInteger, primary_key=True)
+    image_id = Column(BigInteger, ForeignKey("images.id", ondelete="CASCADE"), nullable=False)
+    variant = Column(Text, nullable=False)
+    sha256 = Column(Text, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    mime_type = Column(Text, nullable=False)
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    image = relationship("Image", back_populates="variants")
+    __table_args__ = (UniqueConstraint("image_id", "variant", name="image_variants_image_variant_key"),)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    key = Column(Text, primary_key=True)
+    request_hash = Column(Text, nullable=False)
+    pereval_id = Column(BigInteger, ForeignKey("pereval.id", ondelete="CASCADE"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+class IngestEntry(Base):
+    __tablename__ = "ingest_queue"
+    id = Column(BigInteger, primary_key=True)
+    ticket = Column(UUID(as_uuid=True), nullable=False)
+    payload = Column(JSONB, nullable=False)
+    state = Column(Text, nullable=False, server_default="queued")
+    attempts = Column(Integer, nullable=False, server_default="0")
+    pereval_id = Column(BigInteger, ForeignKey("pereval.id", ondelete="SET NULL"), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    __table_args__ = (UniqueConstraint("ticket", name="ingest_queue_ticket_key"),)
@@ -0,0 +1,30 @@
+"""Непрозрачные курсоры для keyset-пагинации.
+
+Курсор — urlsafe base64 от JSON с ключом последней отданной строки,
+клиент просто передаёт его обратно в ``cursor=``.
+"""
+import base64
+import json
+from typing import Any, Dict
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(key: Dict[str, Any]) -> str:
+    raw = json.dumps(key, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(raw)
+    except Exception:
+        raise ValueError("Некорректный cursor")
+    if not isinstance(key, dict):
+        raise ValueError("Некорректный cursor")
+    return key
+
+def cursor_int(key: Dict[str, Any], name: str) -> int:
+    try:
+        return int(key[name])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Некорректный cursor")
@@ -0,0 +1,118 @@
+"""Чтения с реплик (DATABASE_REPLICA_URLS), запись — только primary.
+
+* GET-обработчики берут сессию через ``get_read_db``: реплики по кругу,
+  реплика, к которой не удалось подключиться, пропускается
+  REPLICA_RETRY_SECONDS, если живых нет — читаем с primary.
+* Read-your-writes: после успешного POST/PATCH клиент получает cookie
+  ``fstr_primary_until`` (unix-время), и до этого момента его чтения идут на
+  primary — отставание реплики не покажет ему старую версию своей записи.
+  Время в cookie, а не в памяти процесса, поэтому работает и с несколькими
+  воркерами. REPLICA_STICKY_SECONDS должен быть больше обычного лага реплик.
+"""
+import asyncio
+import logging
+import math
+import time
+from typing import List, Sequence
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from starlette.requests import Request
+
+from .config import settings
+from .db import AsyncSessionLocal, make_async_engine
+from .metrics import Counter, registry
+
+logger = logging.getLogger("fstr.replicas")
+
+STICKY_COOKIE = "fstr_primary_until"
+_READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+READS_TOTAL = registry.register(Counter(
+    "fstr_db_reads_total",
+    "Сессии чтения: replica, primary (реплик нет), sticky (после своей записи), failover (реплики недоступны)",
+    ("target",)))
+
+class ReplicaSet:
+    def __init__(self, urls: Sequence[str], retry_seconds: float):
+        self.engines = [make_async_engine(url) for url in urls]
+        self.sessionmakers = [async_sessionmaker(bind=e, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+                              for e in self.engines]
+        self.retry_seconds = retry_seconds
+        self._down_until = [0.0] * len(self.engines)
+        self._next = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.engines)
+
+    def candidates(self) -> List[int]:
+        """Живые реплики, начиная со следующей по кругу."""
+        n = len(self.engines)
+        start, self._next = self._next, (self._next + 1) % n
+        now = time.monotonic()
+        return [i for i in ((start + k) % n for k in range(n)) if self._down_until[i] <= now]
+
+    def mark_down(self, i: int) -> None:
+        self._down_until[i] = time.monotonic() + self.retry_seconds
+
+    async def dispose(self) -> None:
+        await asyncio.gather(*(e.dispose() for e in self.engines))
+
+replicas = ReplicaSet([u.strip() for u in settings.DATABASE_REPLICA_URLS.split(",") if u.strip()],
+                      settings.REPLICA_RETRY_SECONDS)
+
+def wants_primary(request: Request) -> bool:
+    """Клиент недавно писал — его чтения идут на primary."""
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+async def open_read_session(prefer_primary: bool = False) -> AsyncSession:
+    if replicas and not prefer_primary:
+        for i in replicas.candidates():
+            db = replicas.sessionmakers[i]()
+            try:
+                # Соединение берём сразу: недоступная реплика видна до первого запроса обработчика
+                await db.connection()
+            except (OSError, asyncio.TimeoutError, SQLAlchemyError) as e:
+                await db.close()
+                replicas.mark_down(i)
+                logger.warning("реплика #%d недоступна, %.0f с без неё: %s", i, replicas.retry_seconds, e)
+                continue
+            db.info["replica"] = True
+            READS_TOTAL.inc(("replica",))
+            return db
+    READS_TOTAL.inc(("sticky" if prefer_primary and replicas else "failover" if replicas else "primary",))
+    return AsyncSessionLocal()
+
+async def get_read_db(request: Request):
+    db = await open_read_session(wants_primary(request))
+    try:
+        yield db
+    finally:
+        await db.close()
+
+def is_replica(db: AsyncSession) -> bool:
+    return db.info.get("replica", False)
+
+class ReadYourWritesMiddleware:
+    """После успешного не-GET запроса ставит cookie: ``sticky_seconds`` чтения клиента — с primary."""
+
+    def __init__(self, app, sticky_seconds: float):
+        self.app = app
+        self.sticky_seconds = sticky_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in _READ_METHODS:
+            return await self.app(scope, receive, send)
+
+        async def send_sticky(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                max_age = math.ceil(self.sticky_seconds)
+                cookie = (f"{STICKY_COOKIE}={time.time() + self.sticky_seconds:.3f}; Max-Age={max_age}; "
+                          "Path=/; HttpOnly; SameSite=Lax")
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie.encode())]}
+            await send(message)
+
+        await self.app(scope, receive, send_sticky)
@@ -1,216 +1,845 @@
+import asyncio
 import base64
-from datetime import datetime
-from typing import List, Optional, Dict, Any
-from sqlalchemy.orm import Session, joinedload
-from . import models
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import List, Optional, Dict, Any, AsyncIterator, Awaitable, Callable, Tuple, Union
+from sqlalchemy import select, delete, insert, update, func, text, bindparam, tuple_, Numeric, and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, defer, joinedload, selectinload
+from . import geo, models
+from .models import ORIGINAL_VARIANT
+from .storage import StoredBlob, get_blob_store
+from .cache import CachedUser, response_cache, user_cache
+from .idempotency import IdempotencyKeyMismatch
+
+# Вызывается внутри транзакции пачки перед COMMIT: (позиции в payloads, их новые id).
+# Исключение откатывает пачку вместе со вставками
+BeforeCommit = Callable[[List[int], List[int]], Awaitable[None]]
 
 def _norm_email(email: str) -> str:
     return (email or "").strip().lower()
 
+def _full_name(user: dict) -> str:
+    return " ".join(
+        [user["fam"], user["name"]] + ([user["otc"]] if user.get("otc") else [])
+    )
+
+def _name_parts(full_name: str):
+    """Все разбиения full_name на fam/name/otc: части сами могут содержать пробелы."""
+    words = full_name.split(" ")
+    for i in range(1, len(words)):
+        fam, rest = " ".join(words[:i]), words[i:]
+        yield {"fam": fam, "name": " ".join(rest), "otc": ""}
+        for j in range(1, len(rest)):
+            yield {"fam": fam, "name": " ".join(rest[:j]), "otc": " ".join(rest[j:])}
+
+def _normalize_search(q: str) -> str:
+    # То же, что pereval_search_text() в 00_schema.sql: нижний регистр, ё -> е
+    return " ".join(q.lower().replace("ё", "е").split())
+
+def _parse_add_time(raw: str) -> datetime:
+    try:
+        try:
+            return datetime.fromisoformat(raw)
+        except Exception:
+            return datetime.strptime(raw, "%Y-%m-%d %H:%M:%S")
+    except Exception:
+        raise ValueError("Некорректное поле add_time, ожидается 'YYYY-MM-DD HH:MM:SS'")
+
+_COORD_STEP = Decimal("0.000001")
+
+def _store_base64(raw: str) -> StoredBlob:
+    try:
+        data = base64.b64decode(raw, validate=True)
+    except Exception as e:
+        raise ValueError(f"Некорректная картинка (base64): {e}")
+    return get_blob_store().put(data)
+
+# Пользователь (upsert по индексу users_email_unique), coords, levels, pereval
+# и все картинки — одним запросом. Data-modifying CTE выполняются всегда,
+# даже если на них не ссылаются. ФИО/телефон обновляем только при изменении;
+# если строка не менялась, RETURNING пуст и id берём обычным SELECT.
+_UPSERT_USER_CTE = """
+WITH u_upsert AS (
+    INSERT INTO users (full_name, email, phone)
+    VALUES (:full_name, :email, :phone)
+    ON CONFLICT (trim_lower_email(email)) DO UPDATE
+        SET full_name = EXCLUDED.full_name, phone = EXCLUDED.phone
+        WHERE (users.full_name, users.phone) IS DISTINCT FROM (EXCLUDED.full_name, EXCLUDED.phone)
+    RETURNING id
+), u AS (
+    SELECT id FROM u_upsert
+    UNION ALL
+    SELECT id FROM users
+    WHERE trim_lower_email(email) = :email AND NOT EXISTS (SELECT 1 FROM u_upsert)
+    LIMIT 1
+)"""
+# Пользователь из user_cache с теми же ФИО и телефоном: вместо upsert — чтение
+# users по первичному ключу. ФИО и телефон сверяются с БД: кэш процесса мог
+# устареть, если их поменял другой воркер, — тогда u пуст и create идёт upsert-ом
+_KNOWN_USER_CTE = """
+WITH u AS (
+    SELECT id FROM users
+    WHERE id = :user_id AND full_name = :full_name AND phone = :phone
+)"""
+_CREATE_REST_SQL = """, c AS (
+    INSERT INTO coords (latitude, longitude, height)
+    VALUES (:latitude, :longitude, :height)
+    RETURNING id
+), l AS (
+    INSERT INTO levels (winter, summer, autumn, spring)
+    VALUES (:winter, :summer, :autumn, :spring)
+    RETURNING id
+), p AS (
+    INSERT INTO pereval (beauty_title, title, other_titles, connect, add_time,
+                         user_id, coords_id, levels_id, status, moderator_note)
+    SELECT :beauty_title, :title, :other_titles, :connect, :add_time,
+           u.id, c.id, l.id, 'new', ''
+    FROM u, c, l
+    RETURNING id
+), i AS (
+    INSERT INTO images (pereval_id, title, sha256, size, mime_type)
+    SELECT p.id, t.title, t.sha256, t.size, t.mime_type
+    FROM p, unnest(CAST(:image_titles AS text[]), CAST(:image_hashes AS text[]),
+                   CAST(:image_sizes AS bigint[]), CAST(:image_mimes AS text[]))
+         AS t(title, sha256, size, mime_type)
+), k AS (
+    UPDATE idempotency_keys SET pereval_id = p.id
+    FROM p
+    WHERE idempotency_keys.key = :idempotency_key
+)
+SELECT p.id, u.id AS user_id FROM p, u
+"""
+_CREATE_PEREVAL_SQL = text(_UPSERT_USER_CTE + _CREATE_REST_SQL).bindparams(
+    bindparam("latitude", type_=Numeric), bindparam("longitude", type_=Numeric))
+_CREATE_PEREVAL_KNOWN_USER_SQL = text(_KNOWN_USER_CTE + _CREATE_REST_SQL).bindparams(
+    bindparam("latitude", type_=Numeric), bindparam("longitude", type_=Numeric))
+
+# Idempotency-Key: занять свободный или просроченный ключ. Строка с тем же
+# ключом от незавершённой транзакции заставит INSERT ждать её исхода
+_CLAIM_IDEMPOTENCY_SQL = text("""
+INSERT INTO idempotency_keys (key, request_hash, expires_at)
+VALUES (:key, :request_hash, now() + make_interval(secs => :ttl))
+ON CONFLICT (key) DO UPDATE
+    SET request_hash = EXCLUDED.request_hash, pereval_id = NULL,
+        created_at = now(), expires_at = EXCLUDED.expires_at
+    WHERE idempotency_keys.expires_at < now()
+RETURNING key
+""")
+
+# Аренда пачки записей модератором. Сначала просроченные аренды, потом new
+# по id; SKIP LOCKED — параллельные claim не ждут друг друга и не берут
+# одно и то же (WHERE перепроверяется по свежей версии строки). Ветки
+# UNION ALL выполняются по очереди: если просроченных хватило, new не читаются
+_CLAIM_SQL = text("""
+WITH expired AS (
+    SELECT id FROM pereval
+    WHERE status = 'pending' AND claim_expires_at < now()
+    ORDER BY claim_expires_at
+    LIMIT :limit
+    FOR UPDATE SKIP LOCKED
+), fresh AS (
+    SELECT id FROM pereval
+    WHERE status = 'new'
+    ORDER BY id
+    LIMIT :limit
+    FOR UPDATE SKIP LOCKED
+), batch AS (
+    SELECT id FROM expired
+    UNION ALL
+    SELECT id FROM fresh
+    LIMIT :limit
+)
+UPDATE pereval p
+SET status = 'pending', claimed_by = :moderator,
+    claim_expires_at = now() + make_interval(secs => :lease), updated_at = now()
+FROM batch
+WHERE p.id = batch.id
+RETURNING p.id, p.claim_expires_at
+""")
+
 class DataRepository:
-    def __init__(self, db: Session):
+    """Доступ к данным поверх AsyncSession.
+
+    Всё, что ходит в БД, — корутины; CPU/ФС-работа с картинками
+    (base64, sha256, запись файла) уходит в поток, чтобы не держать event loop.
+    """
+
+    def __init__(self, db: AsyncSession):
         self.db = db
 
     # ====== CREATE ======
-    def _get_or_create_user(self, full_name: str, email: str, phone: str) -> models.User:
-        user = self.db.query(models.User).filter(models.User.email == _norm_email(email)).one_or_none()
-        if user:
-            changed = False
-            if user.full_name != full_name:
-                user.full_name = full_name
-                changed = True
-            if user.phone != phone:
-                user.phone = phone
-                changed = True
-            if changed:
-                self.db.add(user)
-            return user
-        user = models.User(full_name=full_name, email=_norm_email(email), phone=phone)
-        self.db.add(user)
-        self.db.flush()
-        return user
-
-    def _create_coords(self, lat: str, lon: str, height: str) -> models.Coords:
-        coords = models.Coords(
-            latitude=float(lat),
-            longitude=float(lon),
-            height=int(height)
-        )
-        self.db.add(coords)
-        self.db.flush()
-        return coords
-
-    def _create_levels(self, level: dict) -> models.Levels:
-        levels = models.Levels(
-            winter=level.get("winter", "") or "",
-            summer=level.get("summer", "") or "",
-            autumn=level.get("autumn", "") or "",
-            spring=level.get("spring", "") or "",
-        )
-        self.db.add(levels)
-        self.db.flush()
-        return levels
-
-    def _create_images(self, pereval_id: int, images: list):
+    async def _create_images(self, pereval_id: int, images: list):
         for img in images:
-            raw = img["data"]
-            try:
-                blob = base64.b64decode(raw, validate=True)
-            except Exception as e:
-                raise ValueError(f"Некорректная картинка (base64): {e}")
-            image = models.Image(pereval_id=pereval_id, title=img["title"], data=blob)
+            # multipart-загрузка приносит уже сохранённый blob, JSON — base64
+            blob = img.get("blob")
+            if blob is None:
+                blob = await asyncio.to_thread(_store_base64, img["data"])
+            image = models.Image(
+                pereval_id=pereval_id,
+                title=img["title"],
+                sha256=blob.sha256,
+                size=blob.size,
+                mime_type=blob.mime_type,
+            )
             self.db.add(image)
 
-    def create_pereval_from_payload(self, payload: dict) -> int:
-        user_full_name = " ".join(
-            [payload["user"]["fam"], payload["user"]["name"]] + (
-                [payload["user"]["otc"]] if payload["user"].get("otc") else []
-            )
-        )
-        user = self._get_or_create_user(
-            full_name=user_full_name,
-            email=payload["user"]["email"],
-            phone=payload["user"]["phone"],
-        )
+    @staticmethod
+    async def image_bytes(im: models.Image) -> bytes:
+        # Строки, ещё не перенесённые migrate_blobs, держат байты в BYTEA
+        if im.sha256:
+            return await asyncio.to_thread(get_blob_store().get, im.sha256)
+        return im.data
 
-        coords = self._create_coords(
-            lat=payload["coords"]["latitude"],
-            lon=payload["coords"]["longitude"],
-            height=payload["coords"]["height"],
-        )
-        levels = self._create_levels(payload.get("level", {}))
+    async def create_pereval_from_payload(self, payload: dict) -> int:
+        """Создание одним SQL-запросом (+ COMMIT) вместо flush на каждую сущность."""
+        new_id, _ = await self._create_pereval(payload)
+        return new_id
 
-        try:
+    async def create_pereval_idempotent(self, payload: dict, key: str, request_hash: str,
+                                        ttl_seconds: int) -> Tuple[int, bool]:
+        """То же под Idempotency-Key: (id, True), если запрос с этим ключом уже выполнен."""
+        return await self._create_pereval(payload, (key, request_hash, ttl_seconds))
+
+    async def _claim_idempotency_key(self, key: str, request_hash: str, ttl_seconds: int) -> Optional[int]:
+        """Занимает ключ до конца транзакции; id записи, если он уже отработал."""
+        claimed = (await self.db.execute(_CLAIM_IDEMPOTENCY_SQL, {
+            "key": key, "request_hash": request_hash, "ttl": float(ttl_seconds),
+        })).scalar_one_or_none()
+        if claimed is not None:
+            return None
+        # Конфликт: INSERT дождался чужой транзакции, новый снимок видит её ключ
+        row = (await self.db.execute(
+            select(models.IdempotencyKey.request_hash, models.IdempotencyKey.pereval_id)
+            .filter(models.IdempotencyKey.key == key)
+        )).one_or_none()
+        if row is None:
+            raise ValueError("Idempotency-Key только что истёк, повторите запрос")
+        if row.request_hash != request_hash:
+            raise IdempotencyKeyMismatch("Idempotency-Key уже использован с другим телом запроса")
+        return int(row.pereval_id)
+
+    async def _create_params(self, payload: dict) -> dict:
+        images = payload.get("images", [])
+        if not images:
+            raise ValueError("Отсутствуют изображения (images)")
+        add_dt = _parse_add_time(payload["add_time"])
+        blobs = []
+        for img in images:
+            # multipart-загрузка приносит уже сохранённый blob, JSON — base64
+            blob = img.get("blob")
+            if blob is None:
+                blob = await asyncio.to_thread(_store_base64, img["data"])
+            blobs.append(blob)
+
+        lvl = payload.get("level") or {}
+        return {
+            "full_name": _full_name(payload["user"]),
+            "email": _norm_email(payload["user"]["email"]),
+            "phone": payload["user"]["phone"],
+            "latitude": float(payload["coords"]["latitude"]),
+            "longitude": float(payload["coords"]["longitude"]),
+            "height": int(payload["coords"]["height"]),
+            "winter": lvl.get("winter", "") or "",
+            "summer": lvl.get("summer", "") or "",
+            "autumn": lvl.get("autumn", "") or "",
+            "spring": lvl.get("spring", "") or "",
+            "beauty_title": payload["beauty_title"],
+            "title": payload["title"],
+            "other_titles": payload.get("other_titles", "") or "",
+            "connect": payload.get("connect", "") or "",
+            "add_time": add_dt,
+            "image_titles": [img["title"] for img in images],
+            "image_hashes": [b.sha256 for b in blobs],
+            "image_sizes": [b.size for b in blobs],
+            "image_mimes": [b.mime_type for b in blobs],
+            "idempotency_key": None,
+        }
+
+    async def _create_pereval(self, payload: dict, idempotency: Optional[Tuple[str, str, int]] = None) -> Tuple[int, bool]:
+        params = None
+        for attempt in range(3):
+            if idempotency is not None:
+                # Ключ — до декодирования картинок: повтор не делает ничего лишнего
+                done = await self._claim_idempotency_key(*idempotency)
+                if done is not None:
+                    await self.db.rollback()
+                    return done, True
+            if params is None:
+                params = await self._create_params(payload)
+                params["idempotency_key"] = idempotency[0] if idempotency is not None else None
+            known = user_cache.get(params["email"])
+            if known is not None and (known.full_name, known.phone) == (params["full_name"], params["phone"]):
+                row = (await self.db.execute(_CREATE_PEREVAL_KNOWN_USER_SQL, dict(params, user_id=known.id))).one_or_none()
+                if row is None:
+                    # В БД другие ФИО/телефон (или пользователя удалили) — upsert-ом, вставки c/l откатываем
+                    await self.db.rollback()
+                    user_cache.discard(params["email"])
+                    continue
+            else:
+                # Нового пользователя или смену ФИО/телефона пишет upsert, кэш обновится ниже
+                row = (await self.db.execute(_CREATE_PEREVAL_SQL, params)).one_or_none()
+            if row is not None:
+                await self.db.commit()
+                user_cache.put(params["email"], CachedUser(int(row.user_id), params["full_name"], params["phone"]))
+                return int(row.id), False
+            # Пользователя вставили параллельно уже после снимка нашего запроса:
+            # ON CONFLICT его видит, а SELECT — нет. Новый снимок это исправит
+            await self.db.rollback()
+        raise ValueError("Не удалось определить пользователя, повторите запрос")
+
+    # ====== BATCH ======
+    @staticmethod
+    def _prepare_batch_item(payload: dict) -> None:
+        """Проверки, которые делает одиночный create, плюс запись картинок в хранилище."""
+        if not payload.get("images"):
+            raise ValueError("Отсутствуют изображения (images)")
+        payload["_add_time"] = _parse_add_time(payload["add_time"])
+        for img in payload["images"]:
+            if img.get("blob") is None:
+                img["blob"] = _store_base64(img["data"])
+
+    async def _insert_batch(self, items: List[dict], before_commit: Optional[Callable[[List[int]], Awaitable[None]]] = None) -> List[int]:
+        """Пачка одной транзакцией: по одному многострочному INSERT на таблицу."""
+        users: Dict[str, dict] = {}
+        for p in items:
+            # Повтор email внутри пачки: как при последовательной вставке — побеждает последний
+            users[_norm_email(p["user"]["email"])] = {
+                "email": _norm_email(p["user"]["email"]),
+                "full_name": _full_name(p["user"]),
+                "phone": p["user"]["phone"],
+            }
+        users_t = models.User.__table__
+        upsert = pg_insert(users_t).values(list(users.values()))
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[func.trim_lower_email(users_t.c.email)],
+            set_={"full_name": upsert.excluded.full_name, "phone": upsert.excluded.phone},
+        ).returning(users_t.c.id, users_t.c.email)
+        user_ids = {_norm_email(email): uid for uid, email in (await self.db.execute(upsert)).all()}
+
+        async def insert_returning_ids(table, rows: List[dict]) -> List[int]:
+            stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+            return list((await self.db.execute(stmt, rows)).scalars())
+
+        coords_ids = await insert_returning_ids(models.Coords.__table__, [
+            {
+                "latitude": float(p["coords"]["latitude"]),
+                "longitude": float(p["coords"]["longitude"]),
+                "height": int(p["coords"]["height"]),
+            }
+            for p in items
+        ])
+        levels_ids = await insert_returning_ids(models.Levels.__table__, [
+            {k: (p.get("level") or {}).get(k, "") or "" for k in ("winter", "summer", "autumn", "spring")}
+            for p in items
+        ])
+        pereval_ids = await insert_returning_ids(models.Pereval.__table__, [
+            {
+                "beauty_title": p["beauty_title"],
+                "title": p["title"],
+                "other_titles": p.get("other_titles", "") or "",
+                "connect": p.get("connect", "") or "",
+                "add_time": p["_add_time"],
+                "user_id": user_ids[_norm_email(p["user"]["email"])],
+                "coords_id": c_id,
+                "levels_id": l_id,
+                "status": models.ModerationStatus.new,
+                "moderator_note": "",
+            }
+            for p, c_id, l_id in zip(items, coords_ids, levels_ids)
+        ])
+        await self.db.execute(insert(models.Image.__table__), [
+            {
+                "pereval_id": per_id,
+                "title": img["title"],
+                "sha256": img["blob"].sha256,
+                "size": img["blob"].size,
+                "mime_type": img["blob"].mime_type,
+            }
+            for p, per_id in zip(items, pereval_ids)
+            for img in p["images"]
+        ])
+        if before_commit is not None:
+            await before_commit([int(i) for i in pereval_ids])
+        await self.db.commit()
+        for email, uid in user_ids.items():
+            user_cache.put(email, CachedUser(int(uid), users[email]["full_name"], users[email]["phone"]))
+        return [int(i) for i in pereval_ids]
+
+    async def create_perevals_batch(self, payloads: List[dict],
+                                    before_commit: Optional[BeforeCommit] = None) -> List[Union[int, Exception]]:
+        """Вставляет пачку; на каждый payload — id или исключение.
+
+        Если пачка целиком не легла (например, чужой телефон), откатываемся
+        и вставляем по одной, чтобы ошибка досталась только своей записи.
+        ``before_commit`` пишет что-то в той же транзакции, что и вставка
+        (очередь приёма отмечает заявки выполненными); ValueError из него
+        тоже разбивает пачку по одной.
+        """
+        results: List[Union[int, Exception, None]] = [None] * len(payloads)
+        ready: List[int] = []
+        for i, p in enumerate(payloads):
             try:
-                add_dt = datetime.fromisoformat(payload["add_time"])
-            except Exception:
-                add_dt = datetime.strptime(payload["add_time"], "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            raise ValueError("Некорректное поле add_time, ожидается 'YYYY-MM-DD HH:MM:SS'")
-
-        pereval = models.Pereval(
-            beauty_title=payload["beauty_title"],
-            title=payload["title"],
-            other_titles=payload.get("other_titles", "") or "",
-            connect=payload.get("connect", "") or "",
-            add_time=add_dt,
-            user_id=user.id,
-            coords_id=coords.id,
-            levels_id=levels.id,
-            status=models.ModerationStatus.new,
-            moderator_note="",
-        )
-        self.db.add(pereval)
-        self.db.flush()
+                await asyncio.to_thread(self._prepare_batch_item, p)
+                ready.append(i)
+            except ValueError as e:
+                results[i] = e
+        if not ready:
+            return results
+        def hook(positions: List[int]):
+            if before_commit is None:
+                return None
+            return lambda ids: before_commit(positions, ids)
+
+        try:
+            ids = await self._insert_batch([payloads[i] for i in ready], hook(ready))
+            for i, new_id in zip(ready, ids):
+                results[i] = new_id
+        except (DBAPIError, ValueError):
+            await self.db.rollback()
+            for i in ready:
+                try:
+                    # Пачка из одной записи: её before_commit в той же транзакции
+                    results[i] = (await self._insert_batch([payloads[i]], hook([i])))[0]
+                except Exception as e:
+                    await self.db.rollback()
+                    results[i] = e
+        return results
+
+    # ====== INGEST QUEUE ======
+    async def enqueue_pereval(self, payload: dict) -> uuid.UUID:
+        """Заявка в ingest_queue: картинки — в хранилище, в очередь — только их sha256.
 
+        Всё, что отвергнет create (нет картинок, add_time, base64), проверяется
+        здесь же — клиент узнает об ошибке сразу, а не из статуса заявки.
+        """
         images = payload.get("images", [])
         if not images:
             raise ValueError("Отсутствуют изображения (images)")
-        self._create_images(pereval.id, images)
+        _parse_add_time(payload["add_time"])
+        queued = dict(payload, images=[])
+        for img in images:
+            blob = img.get("blob")
+            if blob is None:
+                blob = await asyncio.to_thread(_store_base64, img["data"])
+            queued["images"].append({"title": img["title"], "sha256": blob.sha256,
+                                     "size": blob.size, "mime_type": blob.mime_type})
+        ticket = uuid.uuid4()
+        await self.db.execute(insert(models.IngestEntry.__table__).values(ticket=ticket, payload=queued))
+        await self.db.commit()
+        return ticket
 
-        self.db.commit()
-        return int(pereval.id)
+    async def get_ingest_entry(self, ticket: uuid.UUID) -> Optional[models.IngestEntry]:
+        return (await self.db.execute(
+            select(models.IngestEntry).filter(models.IngestEntry.ticket == ticket)
+        )).scalar_one_or_none()
 
     # ====== READ ======
-    def get_pereval(self, pereval_id: int) -> Optional[models.Pereval]:
-        return (
-            self.db.query(models.Pereval)
+    @staticmethod
+    def _image_options(images, include_images: bool, variant: str):
+        sub = []
+        if not include_images:
+            # legacy BYTEA не тянем вовсе — в ответ пойдут только метаданные
+            sub.append(defer(models.Image.data))
+        if variant != ORIGINAL_VARIANT:
+            # Производные — одним IN-запросом на все картинки выборки
+            sub.append(selectinload(models.Image.variants))
+        return images.options(*sub) if sub else images
+
+    @classmethod
+    def _load_options(cls, include_images: bool = True, variant: str = ORIGINAL_VARIANT) -> list:
+        return [
+            joinedload(models.Pereval.user),
+            joinedload(models.Pereval.coords),
+            joinedload(models.Pereval.levels),
+            cls._image_options(joinedload(models.Pereval.images), include_images, variant),
+        ]
+
+    @classmethod
+    def _images_selectin(cls, include_images: bool = True, variant: str = ORIGINAL_VARIANT):
+        # Для выборок с LIMIT и серверных курсоров: коллекция отдельным IN-запросом
+        return cls._image_options(selectinload(models.Pereval.images), include_images, variant)
+
+    async def get_pereval(self, pereval_id: int, include_images: bool = True,
+                          variant: str = ORIGINAL_VARIANT) -> Optional[models.Pereval]:
+        result = await self.db.execute(
+            select(models.Pereval)
+            .options(*self._load_options(include_images, variant))
+            .filter(models.Pereval.id == pereval_id)
+        )
+        return result.unique().scalar_one_or_none()
+
+    @staticmethod
+    def _of_user(stmt, email: str):
+        """Записи пользователя: id из user_cache — без users вовсе, иначе join по
+        выражению индекса users_email_unique (простое email = ... его не использует)."""
+        known = user_cache.get(_norm_email(email))
+        if known is not None:
+            return stmt.filter(models.Pereval.user_id == known.id)
+        return stmt.join(models.User, models.Pereval.user_id == models.User.id).filter(
+            func.trim_lower_email(models.User.email) == _norm_email(email)
+        )
+
+    def _by_email(self, email: str, before_id: Optional[int]):
+        stmt = self._of_user(select(models.Pereval), email)
+        if before_id is not None:
+            stmt = stmt.filter(models.Pereval.id < before_id)
+        return stmt.order_by(models.Pereval.id.desc())
+
+    async def list_perevals_by_email(self, email: str, include_images: bool = True,
+                                     limit: Optional[int] = None, before_id: Optional[int] = None,
+                                     variant: str = ORIGINAL_VARIANT) -> List[models.Pereval]:
+        """Keyset по id (убывание): следующая страница — before_id = id последней записи."""
+        stmt = self._by_email(email, before_id).options(*self._load_options(include_images, variant))
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        items = list((await self.db.execute(stmt)).unique().scalars())
+        if items:
+            # Следующая страница и повторный запрос — уже без поиска по email
+            user = items[0].user
+            user_cache.put(_norm_email(email), CachedUser(int(user.id), user.full_name, user.phone))
+        return items
+
+    async def list_pereval_ids_by_email(self, email: str, limit: int, before_id: Optional[int] = None) -> List[int]:
+        stmt = self._by_email(email, before_id).with_only_columns(models.Pereval.id).limit(limit)
+        return [int(i) for i in (await self.db.execute(stmt)).scalars()]
+
+    async def iter_perevals_by_email(self, email: str, include_images: bool = True, limit: Optional[int] = None,
+                                     before_id: Optional[int] = None, batch: int = 100,
+                                     variant: str = ORIGINAL_VARIANT) -> AsyncIterator[models.Pereval]:
+        """Потоковое чтение серверным курсором: в памяти не больше ``batch`` записей.
+
+        Коллекция images грузится selectinload по каждой пачке — joinedload
+        коллекций с yield_per несовместим.
+        """
+        stmt = self._by_email(email, before_id).options(
+            joinedload(models.Pereval.user),
+            joinedload(models.Pereval.coords),
+            joinedload(models.Pereval.levels),
+            self._images_selectin(include_images, variant),
+        )
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        result = await self.db.stream(stmt.execution_options(yield_per=batch))
+        async for per in result.scalars():
+            yield per
+
+    async def list_perevals_near(self, lat: float, lon: float, boxes: List[geo.Box], radius_km: Optional[float],
+                                 include_images: bool = True, limit: int = 50,
+                                 after: Optional[Tuple[float, int]] = None,
+                                 variant: str = ORIGINAL_VARIANT) -> List[Tuple[models.Pereval, float]]:
+        """Записи в рамках ``boxes`` (и в радиусе), по расстоянию от (lat, lon).
+
+        Рамки отбирает GiST idx_coords_point, pereval подтягивается по
+        idx_pereval_coords_id. Keyset по (distance, id): ``after`` — ключ
+        последней строки предыдущей страницы. Картинки — selectinload, чтобы
+        LIMIT не уходил в подзапрос из-за joinedload коллекции.
+        """
+        dist = geo.distance_km(lat, lon)
+        stmt = (
+            select(models.Pereval, dist)
+            .join(models.Coords, models.Pereval.coords_id == models.Coords.id)
+            .filter(geo.in_boxes(boxes))
             .options(
+                contains_eager(models.Pereval.coords),
                 joinedload(models.Pereval.user),
-                joinedload(models.Pereval.coords),
                 joinedload(models.Pereval.levels),
-                joinedload(models.Pereval.images),
+                self._images_selectin(include_images, variant),
             )
-            .filter(models.Pereval.id == pereval_id)
-            .one_or_none()
         )
+        if radius_km is not None:
+            stmt = stmt.filter(dist <= radius_km)
+        if after is not None:
+            stmt = stmt.filter(geo.after_key(dist, *after))
+        stmt = stmt.order_by(dist, models.Pereval.id).limit(limit)
+        return [(per, float(d)) for per, d in (await self.db.execute(stmt)).all()]
 
-    def list_perevals_by_email(self, email: str) -> List[models.Pereval]:
-        return (
-            self.db.query(models.Pereval)
-            .join(models.User, models.Pereval.user_id == models.User.id)
+    async def search_perevals(self, q: str, threshold: float, limit: int = 50,
+                              after: Optional[Tuple[float, int]] = None,
+                              variant: str = ORIGINAL_VARIANT) -> List[Tuple[models.Pereval, float]]:
+        """Нечёткий поиск по beauty_title/title/other_titles (pg_trgm).
+
+        ``q <% текст`` отбирает кандидатов по GIN idx_pereval_search_trgm,
+        ранг — word_similarity (лучшее совпадение q с частью текста, так что
+        опечатка или неполное слово тоже находятся). Keyset по (score
+        убыв., id): ``after`` — ключ последней строки предыдущей страницы.
+        """
+        # Порог оператора <% — GUC; true: только до конца транзакции
+        await self.db.execute(select(func.set_config("pg_trgm.word_similarity_threshold", str(threshold), True)))
+        target = func.pereval_search_text(models.Pereval.title, models.Pereval.beauty_title, models.Pereval.other_titles)
+        needle = bindparam("q", _normalize_search(q))
+        score = func.word_similarity(needle, target)
+        stmt = (
+            select(models.Pereval, score)
+            .filter(needle.op("<%")(target))
             .options(
                 joinedload(models.Pereval.user),
                 joinedload(models.Pereval.coords),
                 joinedload(models.Pereval.levels),
-                joinedload(models.Pereval.images),
+                self._images_selectin(include_images=False, variant=variant),
             )
-            .filter(models.User.email == _norm_email(email))
-            .order_by(models.Pereval.id.desc())
-            .all()
         )
+        if after is not None:
+            last_score, last_id = after
+            stmt = stmt.filter(or_(score < last_score, and_(score == last_score, models.Pereval.id > last_id)))
+        stmt = stmt.order_by(score.desc(), models.Pereval.id).limit(limit)
+        return [(per, float(sc)) for per, sc in (await self.db.execute(stmt)).all()]
 
-    # ====== UPDATE (только когда status=new; запрещаем менять ФИО/email/phone) ======
-    def update_pereval_from_payload(self, pereval_id: int, payload: dict) -> None:
-        per = self.get_pereval(pereval_id)
-        if not per:
-            raise ValueError("Объект не найден")
-        if per.status != models.ModerationStatus.new:
-            raise ValueError(f"Редактирование запрещено: статус {per.status.value}")
+    async def list_changes(self, email: Optional[str], lag_seconds: float, limit: int,
+                           after: Optional[Tuple[datetime, int]] = None, include_images: bool = False,
+                           variant: str = ORIGINAL_VARIANT) -> List[models.Pereval]:
+        """Записи, созданные или изменённые после ``after``, по (updated_at, id).
 
-        # Нельзя менять ФИО/email/phone
-        incoming_full_name = " ".join(
-            [payload["user"]["fam"], payload["user"]["name"]] + (
-                [payload["user"]["otc"]] if payload["user"].get("otc") else []
+        updated_at ведёт триггер trg_pereval_updated_at; keyset идёт по
+        idx_pereval_updated (или idx_pereval_user_updated при ``email``).
+        Строки моложе ``lag_seconds`` откладываются до следующего запроса:
+        транзакция, начатая раньше, ещё может закоммитить более раннюю метку.
+        """
+        stmt = select(models.Pereval).filter(
+            models.Pereval.updated_at < func.now() - timedelta(seconds=lag_seconds)
+        )
+        if email is not None:
+            stmt = self._of_user(stmt, email)
+        if after is not None:
+            stmt = stmt.filter(tuple_(models.Pereval.updated_at, models.Pereval.id) > tuple_(*after))
+        stmt = (
+            stmt.options(
+                joinedload(models.Pereval.user),
+                joinedload(models.Pereval.coords),
+                joinedload(models.Pereval.levels),
+                self._images_selectin(include_images, variant),
             )
+            .order_by(models.Pereval.updated_at, models.Pereval.id)
+            .limit(limit)
         )
-        incoming_email = _norm_email(payload["user"]["email"])
-        incoming_phone = payload["user"]["phone"]
+        return list((await self.db.execute(stmt)).scalars())
+
+    async def get_image(self, pereval_id: int, image_id: int,
+                        variant: str = ORIGINAL_VARIANT) -> Optional[models.Image]:
+        stmt = select(models.Image).filter(models.Image.id == image_id, models.Image.pereval_id == pereval_id)
+        if variant != ORIGINAL_VARIANT:
+            stmt = stmt.options(selectinload(models.Image.variants))
+        return (await self.db.execute(stmt)).scalar_one_or_none()
 
-        if _norm_email(per.user.email) != incoming_email:
+    @staticmethod
+    def pick_variant(im: models.Image, variant: str) -> Optional[models.ImageVariant]:
+        """Готовая производная ``variant`` или None (оригинал)."""
+        if variant == ORIGINAL_VARIANT:
+            return None
+        return next((v for v in im.variants if v.variant == variant), None)
+
+    # ====== UPDATE (только когда status=new; запрещаем менять ФИО/email/phone) ======
+    @staticmethod
+    def _assign(obj, attr: str, value) -> bool:
+        # Пишем только реально изменившиеся поля: нет изменений — нет UPDATE
+        if getattr(obj, attr) == value:
+            return False
+        setattr(obj, attr, value)
+        return True
+
+    @staticmethod
+    def _check_user(per: models.Pereval, user: dict) -> None:
+        if "email" in user and _norm_email(per.user.email) != _norm_email(user["email"]):
             raise ValueError("Нельзя изменять email пользователя")
-        if per.user.phone != incoming_phone:
+        if "phone" in user and per.user.phone != user["phone"]:
             raise ValueError("Нельзя изменять телефон пользователя")
-        if per.user.full_name != incoming_full_name:
+        # Merge-patch: переданы могут быть не все части ФИО — сверяем только их
+        given = {k: user[k] or "" for k in ("fam", "name", "otc") if k in user}
+        if given and not any(all(parts[k] == v for k, v in given.items())
+                             for parts in _name_parts(per.user.full_name)):
             raise ValueError("Нельзя изменять ФИО пользователя")
 
-        # Обновляем coords
-        per.coords.latitude = float(payload["coords"]["latitude"])
-        per.coords.longitude = float(payload["coords"]["longitude"])
-        per.coords.height = int(payload["coords"]["height"])
-
-        # Обновляем levels
-        lvl = payload.get("level", {})
-        per.levels.winter = lvl.get("winter", "") or ""
-        per.levels.summer = lvl.get("summer", "") or ""
-        per.levels.autumn = lvl.get("autumn", "") or ""
-        per.levels.spring = lvl.get("spring", "") or ""
-
-        # Основные поля
-        per.beauty_title = payload["beauty_title"]
-        per.title = payload["title"]
-        per.other_titles = payload.get("other_titles", "") or ""
-        per.connect = payload.get("connect", "") or ""
-
-        # Дата
-        try:
-            try:
-                per.add_time = datetime.fromisoformat(payload["add_time"])
-            except Exception:
-                per.add_time = datetime.strptime(payload["add_time"], "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            raise ValueError("Некорректное поле add_time, ожидается 'YYYY-MM-DD HH:MM:SS'")
+    async def _update_images(self, per: models.Pereval, incoming: list) -> bool:
+        """Новый список картинок против текущего — по sha256 содержимого.
 
-        # Полная замена изображений БЕЗ оставления «мертвых» ORM-объектов
-        new_images = payload.get("images", [])
-        if not new_images:
+        Совпавшие остаются (при другом title — UPDATE только title), лишние
+        удаляются одним DELETE, новые вставляются. ``{"sha256": ...}`` —
+        ссылка на уже загруженную картинку записи, без повторной отправки.
+        Legacy-строки без sha256 (не перенесены migrate_blobs) не совпадают
+        ни с чем и заменяются.
+        """
+        if not incoming:
             raise ValueError("Отсутствуют изображения (images)")
+        current: Dict[str, List[models.Image]] = {}
+        for im in per.images:
+            if im.sha256:
+                current.setdefault(im.sha256, []).append(im)
+        changed = False
+        added = []
+        for img in incoming:
+            blob = img.get("blob")
+            if blob is None and img.get("data"):
+                # put() не пишет байты, если такой объект уже есть в хранилище
+                blob = await asyncio.to_thread(_store_base64, img["data"])
+            sha256 = blob.sha256 if blob is not None else img.get("sha256")
+            same = current.get(sha256)
+            if not same:
+                if blob is None:
+                    raise ValueError(f"Картинка {sha256} не найдена у записи")
+                added.append({"title": img["title"], "blob": blob})
+                continue
+            # Из одинаковых по содержимому берём ту, что с тем же названием
+            im = next((x for x in same if x.title == img["title"]), same[0])
+            same.remove(im)
+            changed |= self._assign(im, "title", img["title"])
+        stale = [im.id for ims in current.values() for im in ims]
+        stale += [im.id for im in per.images if not im.sha256]
+        if stale:
+            # Пакетно, минуя коллекцию relationship (иначе висячие ссылки)
+            await self.db.execute(
+                delete(models.Image).where(models.Image.id.in_(stale)).execution_options(synchronize_session=False)
+            )
+        if added:
+            await self._create_images(per.id, added)
+        return changed or bool(stale) or bool(added)
+
+    async def update_pereval_from_payload(self, pereval_id: int, payload: dict) -> None:
+        """Частичное обновление с семантикой JSON merge-patch (RFC 7396).
+
+        Меняются только переданные поля, вложенные объекты сливаются по
+        ключам, ``images`` заменяется списком целиком (см. _update_images).
+        Полный SubmitDataIn — частный случай. Записываются только строки,
+        где что-то действительно изменилось; пустая правка — один SELECT.
+        """
+        per = await self.get_pereval(pereval_id, include_images=False)
+        if not per:
+            raise ValueError("Объект не найден")
+        if per.status != models.ModerationStatus.new:
+            raise ValueError(f"Редактирование запрещено: статус {per.status.value}")
 
-        # 1) удаляем пакетно, минуя коллекцию relationship (иначе висячие ссылки)
-        self.db.query(models.Image).filter(models.Image.pereval_id == per.id).delete(synchronize_session=False)
-        self.db.flush()  # очистили БД от старых записей
+        for field in ("beauty_title", "title", "add_time", "user", "coords", "level", "images"):
+            if field in payload and payload[field] is None:
+                raise ValueError(f"Поле {field} нельзя удалить")
 
-        # 2) создаём новые
-        self._create_images(per.id, new_images)
+        # Нельзя менять ФИО/email/phone
+        self._check_user(per, payload.get("user") or {})
+
+        changed = False
+        coords = payload.get("coords") or {}
+        for field in ("latitude", "longitude"):
+            if coords.get(field) is not None:
+                # Numeric(9, 6): сравниваем с тем, что реально ляжет в колонку
+                value = Decimal(str(coords[field])).quantize(_COORD_STEP)
+                changed |= self._assign(per.coords, field, value)
+        if coords.get("height") is not None:
+            changed |= self._assign(per.coords, "height", int(coords["height"]))
+
+        for season, value in (payload.get("level") or {}).items():
+            changed |= self._assign(per.levels, season, value or "")
+
+        for field in ("beauty_title", "title"):
+            if field in payload:
+                changed |= self._assign(per, field, payload[field])
+        for field in ("other_titles", "connect"):
+            if field in payload:
+                changed |= self._assign(per, field, payload[field] or "")
+        if "add_time" in payload:
+            add_dt = _parse_add_time(payload["add_time"])
+            if add_dt.tzinfo is None:
+                # asyncpg пишет наивное время в timestamptz как UTC
+                add_dt = add_dt.replace(tzinfo=timezone.utc)
+            changed |= self._assign(per, "add_time", add_dt)
 
-        # Финальный коммит
-        self.db.add(per)
-        self.db.commit()
+        if "images" in payload:
+            changed |= await self._update_images(per, payload["images"])
+
+        if not changed:
+            await self.db.rollback()
+            return
+        # Правка coords/levels/картинок не трогает строку pereval — а лента
+        # изменений (/submitData/changes) идёт по её updated_at
+        per.updated_at = func.now()
+        await self.db.commit()
+        # Строго после коммита: иначе параллельное чтение успеет закэшировать старое
+        response_cache.invalidate(per.id)
+
+    # ====== Очередь модерации ======
+    async def claim_for_moderation(self, moderator: str, limit: int, lease_seconds: int) -> Tuple[List[int], Optional[datetime]]:
+        """Берёт до ``limit`` записей в аренду: new -> pending. (ids, срок аренды)."""
+        rows = (await self.db.execute(_CLAIM_SQL, {
+            "moderator": moderator, "limit": limit, "lease": float(lease_seconds),
+        })).all()
+        await self.db.commit()
+        ids = sorted(int(r.id) for r in rows)
+        for pid in ids:
+            response_cache.invalidate(pid)
+        return ids, (rows[0].claim_expires_at if rows else None)
+
+    async def _finish_claims(self, moderator: str, ids: List[int], **values) -> List[int]:
+        # Только свои аренды: истёкшую и перехваченную другим запись не трогаем
+        stmt = (
+            update(models.Pereval)
+            .where(
+                models.Pereval.id.in_(ids),
+                models.Pereval.status == models.ModerationStatus.pending,
+                models.Pereval.claimed_by == moderator,
+            )
+            .values(claimed_by=None, claim_expires_at=None, updated_at=func.now(), **values)
+            .returning(models.Pereval.id)
+            .execution_options(synchronize_session=False)
+        )
+        done = sorted(int(i) for i in (await self.db.execute(stmt)).scalars())
+        await self.db.commit()
+        for pid in done:
+            response_cache.invalidate(pid)
+        return done
+
+    async def decide_moderation(self, moderator: str, ids: List[int], status: str, note: str) -> List[int]:
+        """Пакетное accepted/rejected по арендованным записям; возвращает применённые id."""
+        return await self._finish_claims(moderator, ids, status=models.ModerationStatus(status), moderator_note=note)
+
+    async def release_claims(self, moderator: str, ids: List[int]) -> List[int]:
+        """Досрочный возврат в очередь: pending -> new."""
+        return await self._finish_claims(moderator, ids, status=models.ModerationStatus.new)
+
+    async def list_perevals_by_ids(self, ids: List[int], include_images: bool = True,
+                                   variant: str = ORIGINAL_VARIANT) -> List[models.Pereval]:
+        if not ids:
+            return []
+        stmt = (
+            select(models.Pereval)
+            .filter(models.Pereval.id.in_(ids))
+            .options(
+                joinedload(models.Pereval.user),
+                joinedload(models.Pereval.coords),
+                joinedload(models.Pereval.levels),
+                self._images_selectin(include_images, variant),
+            )
+            .order_by(models.Pereval.id)
+        )
+        return list((await self.db.execute(stmt)).scalars())
 
     # ====== Утилита: ORM -> dict для ответа ======
-    def to_dict(self, per: models.Pereval) -> Dict[str, Any]:
+    async def to_dict(self, per: models.Pereval, include_images: bool = True,
+                      variant: str = ORIGINAL_VARIANT) -> Dict[str, Any]:
+        """``variant`` — производная картинки (thumb, web...); пока она не готова, отдаётся оригинал."""
         def b64(data: bytes) -> str:
             return base64.b64encode(data).decode("ascii")
+
+        async def image(im: models.Image) -> Dict[str, Any]:
+            v = self.pick_variant(im, variant)
+            src = v or im
+            out = {
+                "id": int(im.id),
+                "title": im.title,
+                "sha256": im.sha256,
+                "mime_type": src.mime_type,
+                "size": src.size,
+                "url": f"/submitData/{per.id}/images/{im.id}" + (f"?variant={v.variant}" if v else ""),
+                "variant": v.variant if v else ORIGINAL_VARIANT,
+                "variants_status": im.variants_status,
+            }
+            if not include_images:
+                out["data"] = None
+            elif v:
+                out["data"] = b64(await asyncio.to_thread(get_blob_store().get, v.sha256))
+            else:
+                out["data"] = b64(await self.image_bytes(im))
+            return out
+
         return {
             "id": int(per.id),
             "status": per.status.value,
@@ -235,5 +864,5 @@ class DataRepository:
                 "autumn": per.levels.autumn,
                 "spring": per.levels.spring
             },
-            "images": [{"title": im.title, "data": b64(im.data)} for im in per.images]
+            "images": [await image(im) for im in per.images]
         }
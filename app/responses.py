@@ -0,0 +1,101 @@
+"""HTTP-утилиты: готовые тела ответов, ETag и Range."""
+import hashlib
+import re
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+def render_model(model: "type[BaseModel]", data) -> bytes:
+    """Те же байты, что FastAPI отдал бы через response_model=model."""
+    return JSONResponse(content=jsonable_encoder(model.parse_obj(data))).body
+
+def etag_for(sha256: Optional[str], data: Optional[bytes] = None) -> str:
+    return '"%s"' % (sha256 or hashlib.sha256(data or b"").hexdigest())
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Для If-None-Match сравнение слабое: W/"x" совпадает с "x"
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Один диапазон ``bytes=a-b`` -> (start, end) включительно.
+
+    None — заголовка нет или он нам не подходит (несколько диапазонов,
+    другие единицы): тогда по RFC 9110 просто отдаём весь объект.
+    """
+    if not header:
+        return None
+    m = _RANGE_RE.match(header.strip())
+    if not m:
+        return None
+    first, last = m.group(1), m.group(2)
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # bytes=-N — последние N байт
+        n = int(last)
+        if n == 0:
+            raise RangeNotSatisfiable()
+        return max(size - n, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+def _iter_file(f: BinaryIO, start: int, length: int) -> Iterator[bytes]:
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+def blob_response(f: BinaryIO, size: int, media_type: str, etag: str,
+                  range_header: Optional[str] = None, if_none_match: Optional[str] = None) -> Response:
+    """Отдаёт файл кусками с поддержкой 304 и 206; файл закрывается сам."""
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        # id картинки никогда не меняет содержимое — PATCH создаёт новые id
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if etag_matches(if_none_match, etag):
+        f.close()
+        return Response(status_code=304, headers=headers)
+    try:
+        rng = parse_range(range_header, size)
+    except RangeNotSatisfiable:
+        f.close()
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if rng is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_iter_file(f, 0, size), media_type=media_type, headers=headers)
+    start, end = rng
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(_iter_file(f, start, end - start + 1), status_code=206,
+                             media_type=media_type, headers=headers)
@@ -1,8 +1,15 @@
-from pydantic import BaseModel, EmailStr, constr, validator
+from pydantic import BaseModel, EmailStr, Field, constr, root_validator, validator
 from typing import List, Optional
 from datetime import datetime
 
 # ====== ВХОД submitData / PATCH ======
+def _check_add_time(v: str) -> str:
+    try:
+        datetime.fromisoformat(v)
+    except Exception:
+        datetime.strptime(v, "%Y-%m-%d %H:%M:%S")
+    return v
+
 class UserIn(BaseModel):
     email: EmailStr
     fam: constr(strip_whitespace=True, min_length=1)
@@ -55,17 +62,77 @@ class SubmitDataIn(BaseModel):
 
     @validator("add_time")
     def check_dt(cls, v):
-        try:
-            datetime.fromisoformat(v)
-        except Exception:
-            datetime.strptime(v, "%Y-%m-%d %H:%M:%S")
+        return _check_add_time(v)
+
+# ====== PATCH: JSON merge-patch — передаются только меняемые поля ======
+class UserPatch(BaseModel):
+    email: Optional[EmailStr]
+    fam: Optional[constr(strip_whitespace=True, min_length=1)]
+    name: Optional[constr(strip_whitespace=True, min_length=1)]
+    otc: Optional[constr(strip_whitespace=True, min_length=0)]
+    phone: Optional[constr(strip_whitespace=True, min_length=3)]
+
+class CoordsPatch(BaseModel):
+    latitude: Optional[constr(strip_whitespace=True, min_length=1)]
+    longitude: Optional[constr(strip_whitespace=True, min_length=1)]
+    height: Optional[constr(strip_whitespace=True, min_length=1)]
+
+    @validator("latitude", "longitude")
+    def check_float(cls, v):
+        float(v)
+        return v
+
+    @validator("height")
+    def check_int(cls, v):
+        int(v)
         return v
 
+class LevelPatch(BaseModel):
+    winter: Optional[str]
+    summer: Optional[str]
+    autumn: Optional[str]
+    spring: Optional[str]
+
+class ImagePatchIn(BaseModel):
+    data: Optional[constr(min_length=1)]  # новая картинка, base64
+    sha256: Optional[constr(regex=r"^[0-9a-f]{64}$")]  # уже загруженная картинка этой записи
+    title: constr(strip_whitespace=True, min_length=1)
+
+    @root_validator(skip_on_failure=True)
+    def data_or_sha256(cls, values):
+        if bool(values.get("data")) == bool(values.get("sha256")):
+            raise ValueError("Нужно одно из полей картинки: data или sha256")
+        return values
+
+class SubmitDataPatch(BaseModel):
+    beauty_title: Optional[constr(strip_whitespace=True, min_length=1)]
+    title: Optional[constr(strip_whitespace=True, min_length=1)]
+    other_titles: Optional[str]
+    connect: Optional[str]
+    add_time: Optional[constr(strip_whitespace=True, min_length=1)]
+    user: Optional[UserPatch]
+    coords: Optional[CoordsPatch]
+    level: Optional[LevelPatch]
+    images: Optional[List[ImagePatchIn]]  # заменяет список целиком
+
+    @validator("add_time")
+    def check_dt(cls, v):
+        return _check_add_time(v)
+
 class SubmitDataOut(BaseModel):
     status: int
     message: Optional[str] = None
     id: Optional[int] = None
 
+class BatchItemOut(SubmitDataOut):
+    line: int  # номер строки NDJSON, с 1
+
+class IngestOut(BaseModel):
+    ticket: str  # GET /submitData/ingest/{ticket}
+    state: str  # queued, processing, done, failed
+    id: Optional[int] = None  # id записи, когда done
+    message: Optional[str] = None  # причина, когда failed
+
 # ====== ВЫХОД для GET ======
 class UserOut(BaseModel):
     email: EmailStr
@@ -84,8 +151,15 @@ class LevelOut(BaseModel):
     spring: str
 
 class ImageOut(BaseModel):
+    id: int
     title: str
-    data: str  # base64
+    mime_type: Optional[str] = None
+    size: Optional[int] = None
+    sha256: Optional[str] = None  # хэш оригинала: ссылка на картинку в PATCH без повторной загрузки
+    url: str  # сырые байты: GET /submitData/{id}/images/{image_id}[?variant=...]
+    data: Optional[str] = None  # base64; нет при include_images=false
+    variant: str = "original"  # что отдано: запрошенная производная или оригинал, если она не готова
+    variants_status: Optional[str] = None  # pending | processing | ready | failed
 
 class PerevalOut(BaseModel):
     id: int
@@ -100,6 +174,41 @@ class PerevalOut(BaseModel):
     level: LevelOut
     images: List[ImageOut]
 
+class PerevalNearOut(PerevalOut):
+    distance_km: float
+
+class PerevalSearchOut(PerevalOut):
+    score: float
+
+class PerevalChangeOut(PerevalOut):
+    updated_at: str
+
+# ====== Очередь модерации ======
+class ClaimIn(BaseModel):
+    moderator: constr(strip_whitespace=True, min_length=1, max_length=200)
+    limit: int = Field(10, ge=1)
+    lease_seconds: Optional[int] = Field(None, ge=1, description="по умолчанию MODERATION_LEASE_SECONDS")
+
+class DecisionIn(BaseModel):
+    moderator: constr(strip_whitespace=True, min_length=1, max_length=200)
+    ids: List[int] = Field(..., min_items=1, max_items=1000)
+    status: str
+    moderator_note: str = ""
+
+    @validator("status")
+    def check_status(cls, v):
+        if v not in ("accepted", "rejected"):
+            raise ValueError("status: accepted или rejected")
+        return v
+
+class ReleaseIn(BaseModel):
+    moderator: constr(strip_whitespace=True, min_length=1, max_length=200)
+    ids: List[int] = Field(..., min_items=1, max_items=1000)
+
+class ModerationResultOut(BaseModel):
+    updated: List[int]  # применено
+    skipped: List[int]  # не в аренде у этого модератора (решены, отпущены или аренда истекла и перехвачена)
+
 # ====== ВЫХОД для PATCH ======
 class PatchOut(BaseModel):
     state: int
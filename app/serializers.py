@@ -0,0 +1,36 @@
+"""Быстрая сериализация ответов GET: dict из DataRepository.to_dict -> bytes.
+
+Байты те же, что отдавал FastAPI через response_model=PerevalOut
+(JSONResponse: ensure_ascii=False, separators=(",", ":")), но без повторной
+валидации pydantic и прохода jsonable_encoder по каждой base64-строке.
+Схема в OpenAPI остаётся прежней — response_model у маршрутов не убран.
+
+Единственное расхождение orjson с json.dumps — запись float (1e-6 против
+1e-06), поэтому координаты вставляются готовым фрагментом через repr.
+"""
+from typing import Any, Dict, Iterable
+
+import orjson
+from fastapi import Response
+
+def _float(v: float) -> orjson.Fragment:
+    # json.dumps пишет float через float.__repr__
+    return orjson.Fragment(float.__repr__(float(v)).encode("ascii"))
+
+def dumps_pereval(item: Dict[str, Any]) -> bytes:
+    coords = item["coords"]
+    return orjson.dumps({
+        **item,
+        "coords": {
+            "latitude": _float(coords["latitude"]),
+            "longitude": _float(coords["longitude"]),
+            "height": coords["height"],
+        },
+    })
+
+def dumps_pereval_list(items: Iterable[Dict[str, Any]]) -> bytes:
+    return b"[" + b",".join(dumps_pereval(item) for item in items) + b"]"
+
+class RawJSONResponse(Response):
+    """Тело уже сериализовано — Response только выставляет media_type."""
+    media_type = "application/json"
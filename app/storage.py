@@ -0,0 +1,193 @@
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import BinaryIO, Optional, Set
+
+from .config import settings
+
+# Сигнатуры форматов, которые реально приходят с телефонов
+_MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+def sniff_mime(head: bytes) -> str:
+    for magic, mime in _MAGIC:
+        if head.startswith(magic):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    return "application/octet-stream"
+
+@dataclass(frozen=True)
+class StoredBlob:
+    sha256: str
+    size: int
+    mime_type: str
+
+class BlobTooLarge(ValueError):
+    pass
+
+class BlobTypeNotAllowed(ValueError):
+    pass
+
+class BlobWriter:
+    """Потоковая запись одного объекта во временный файл хранилища.
+
+    Хэш и размер считаются по мере поступления чанков; ``max_size`` и
+    ``allowed_types`` проверяются сразу, не дожидаясь конца данных.
+    ``commit`` переносит файл на место по хэшу, ``abort`` — удаляет.
+    """
+
+    def __init__(self, store: "LocalBlobStore", max_size: int, allowed_types: Optional[Set[str]] = None):
+        self.store = store
+        self.max_size = max_size
+        self.allowed_types = allowed_types
+        self.size = 0
+        self.mime_type: Optional[str] = None
+        self.blob: Optional[StoredBlob] = None
+        self._head = b""
+        self._hash = hashlib.sha256()
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.tmp_dir)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise BlobTooLarge(f"Картинка больше {self.max_size} байт")
+        if self.mime_type is None:
+            self._head += chunk[:16]
+            if len(self._head) >= 16:
+                self._check_type()
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def _check_type(self) -> None:
+        self.mime_type = sniff_mime(self._head)
+        if self.allowed_types is not None and self.mime_type not in self.allowed_types:
+            raise BlobTypeNotAllowed(f"Недопустимый тип картинки: {self.mime_type}")
+
+    def finish(self) -> StoredBlob:
+        if self.size == 0:
+            raise ValueError("Пустая картинка")
+        if self.mime_type is None:
+            self._check_type()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self.blob = StoredBlob(sha256=self._hash.hexdigest(), size=self.size, mime_type=self.mime_type)
+        return self.blob
+
+    def commit(self) -> StoredBlob:
+        blob = self.blob or self.finish()
+        self.store._commit(self.tmp_path, blob.sha256)
+        return blob
+
+    def abort(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+
+class BlobStore(ABC):
+    """Хранилище картинок, адресуемое по sha256 содержимого.
+
+    Одинаковые байты хранятся один раз; запись атомарна — читатель
+    видит либо весь объект, либо ничего.
+    """
+
+    @abstractmethod
+    def put(self, data: bytes) -> StoredBlob:
+        """Сохранить байты; уже лежащий объект не перезаписывается."""
+
+    @abstractmethod
+    def open(self, sha256: str) -> BinaryIO:
+        """Файловый объект на чтение; KeyError, если ключа нет."""
+
+    @abstractmethod
+    def exists(self, sha256: str) -> bool:
+        """Есть ли объект с таким ключом."""
+
+    @abstractmethod
+    def size(self, sha256: str) -> int:
+        """Размер в байтах без чтения содержимого."""
+
+    @abstractmethod
+    def writer(self, max_size: int, allowed_types: Optional[Set[str]] = None) -> BlobWriter:
+        """Потоковая запись: байты пишутся по частям, ключ известен после commit."""
+
+    def get(self, sha256: str) -> bytes:
+        with self.open(sha256) as f:
+            return f.read()
+
+class LocalBlobStore(BlobStore):
+    """Бэкенд на локальной ФС: <root>/ab/cd/<sha256>."""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, sha256: str) -> str:
+        if len(sha256) != 64 or not all(c in "0123456789abcdef" for c in sha256):
+            raise ValueError(f"Некорректный ключ картинки: {sha256!r}")
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path(sha256))
+
+    def open(self, sha256: str) -> BinaryIO:
+        try:
+            return open(self.path(sha256), "rb")
+        except FileNotFoundError:
+            raise KeyError(sha256)
+
+    def size(self, sha256: str) -> int:
+        return os.path.getsize(self.path(sha256))
+
+    def writer(self, max_size: int, allowed_types: Optional[Set[str]] = None) -> BlobWriter:
+        return BlobWriter(self, max_size, allowed_types)
+
+    def _commit(self, tmp_path: str, sha256: str) -> None:
+        dst = self.path(sha256)
+        if os.path.exists(dst):
+            # Дубликат — оставляем уже лежащий файл
+            os.unlink(tmp_path)
+            return
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(tmp_path, dst)
+
+    def put(self, data: bytes) -> StoredBlob:
+        sha256 = hashlib.sha256(data).hexdigest()
+        blob = StoredBlob(sha256=sha256, size=len(data), mime_type=sniff_mime(data[:16]))
+        if self.exists(sha256):
+            return blob
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._commit(tmp_path, sha256)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return blob
+
+_store: Optional[BlobStore] = None
+
+def get_blob_store() -> BlobStore:
+    global _store
+    if _store is None:
+        if settings.BLOB_STORE_BACKEND == "local":
+            _store = LocalBlobStore(settings.BLOB_STORE_PATH)
+        else:
+            raise ValueError(f"Неизвестный BLOB_STORE_BACKEND: {settings.BLOB_STORE_BACKEND}")
+    return _store
@@ -0,0 +1,194 @@
+"""Фоновый конвейер производных картинок (превью, веб-версия).
+
+POST/PATCH только сохраняют оригинал: у новой строки images статус
+variants_status='pending' (DEFAULT в схеме), так что в очередь попадает
+любая картинка — из JSON, multipart, batch или миграции.
+
+ThumbnailWorker живёт в каждом процессе API (lifespan) и:
+* берёт пачку pending одним UPDATE ... FOR UPDATE SKIP LOCKED — воркеры
+  разных процессов делят очередь без блокировок; новые картинки раньше
+  старых, зависшие в processing дольше THUMBNAIL_CLAIM_TIMEOUT — заново;
+* отдаёт декодирование/сжатие в ProcessPoolExecutor (imaging.render_variants),
+  событийный цикл не блокируется;
+* фиксирует результат одним оператором на картинку и сбрасывает кэш ответа.
+
+Догнать очередь без сервера (например, после миграции):
+    python -m app.thumbnails --drain
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from .cache import response_cache
+from .config import settings
+from .db import AsyncSessionLocal
+from .imaging import parse_variants, render_variants
+from .metrics import LATENCY_BUCKETS, Counter, Histogram, registry
+
+logger = logging.getLogger("fstr.thumbnails")
+
+THUMBNAIL_SECONDS = registry.register(Histogram(
+    "fstr_thumbnail_seconds", "Построение всех вариантов одной картинки", LATENCY_BUCKETS + (30.0, 60.0)))
+THUMBNAILS_TOTAL = registry.register(Counter(
+    "fstr_thumbnails_total", "Обработано картинок", ("status",)))
+
+_CLAIM_SQL = text("""
+UPDATE images i
+SET variants_status = 'processing', variants_claimed_at = now()
+FROM (
+    SELECT id FROM images
+    WHERE variants_status = 'pending'
+       OR (variants_status = 'processing' AND variants_claimed_at < now() - make_interval(secs => :timeout))
+    ORDER BY id DESC
+    LIMIT :batch
+    FOR UPDATE SKIP LOCKED
+) todo
+WHERE i.id = todo.id
+RETURNING i.id, i.pereval_id, i.sha256, CASE WHEN i.sha256 IS NULL THEN i.data END AS data, i.variants_claimed_at
+""")
+
+# Только своя заявка: если воркер завис и картинку перехватили, его результат
+# уже не нужен. Картинку, удалённую PATCH, UPDATE не найдёт — и вставки не будет
+_READY_SQL = text("""
+WITH img AS (
+    UPDATE images SET variants_status = 'ready', variants_error = NULL
+    WHERE id = :id AND variants_status = 'processing' AND variants_claimed_at = :claimed_at
+    RETURNING id
+)
+INSERT INTO image_variants (image_id, variant, sha256, size, mime_type, width, height)
+SELECT img.id, v.variant, v.sha256, v.size, v.mime_type, v.width, v.height
+FROM img, unnest(CAST(:variant AS text[]), CAST(:sha256 AS text[]), CAST(:size AS bigint[]),
+                 CAST(:mime_type AS text[]), CAST(:width AS int[]), CAST(:height AS int[]))
+    AS v(variant, sha256, size, mime_type, width, height)
+ON CONFLICT (image_id, variant) DO UPDATE
+SET sha256 = EXCLUDED.sha256, size = EXCLUDED.size, mime_type = EXCLUDED.mime_type,
+    width = EXCLUDED.width, height = EXCLUDED.height
+""")
+
+_FAILED_SQL = text("""
+UPDATE images SET variants_status = 'failed', variants_error = :error
+WHERE id = :id AND variants_status = 'processing' AND variants_claimed_at = :claimed_at
+""")
+
+class ThumbnailWorker:
+    def __init__(self, variants: Dict[str, int], workers: int, batch: int,
+                 poll_seconds: float, claim_timeout: int):
+        self.variants = variants
+        self.workers = workers
+        self.batch = batch
+        self.poll_seconds = poll_seconds
+        self.claim_timeout = claim_timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+
+    async def start(self) -> None:
+        # spawn: fork процесса с открытыми сокетами asyncpg и живым циклом небезопасен
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pool is not None:
+            # Недоделанные картинки останутся processing и вернутся в очередь по таймауту
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def wake(self) -> None:
+        """Пнуть воркер после записи новых картинок, не дожидаясь опроса."""
+        self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                done = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("ошибка конвейера превью")
+                done = 0
+            if done < self.batch:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    async def run_once(self) -> int:
+        """Одна пачка: claim -> обработка в процессах -> фиксация. Возвращает размер пачки."""
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(_CLAIM_SQL, {"batch": self.batch, "timeout": float(self.claim_timeout)})).all()
+            await db.commit()
+        if not rows:
+            return 0
+        await asyncio.gather(*(self._process(row) for row in rows))
+        return len(rows)
+
+    async def _process(self, row) -> None:
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(self._pool, render_variants, row.sha256, row.data, self.variants)
+        except Exception as e:
+            # Битый файл, HEIC без плагина и т.п.: оригинал по-прежнему отдаётся
+            THUMBNAILS_TOTAL.inc(("failed",))
+            async with AsyncSessionLocal() as db:
+                await db.execute(_FAILED_SQL, {"id": row.id, "claimed_at": row.variants_claimed_at,
+                                               "error": f"{type(e).__name__}: {e}"[:500]})
+                await db.commit()
+            return
+        THUMBNAIL_SECONDS.observe((), time.perf_counter() - t0)
+        THUMBNAILS_TOTAL.inc(("ready",))
+        names: List[str] = list(result)
+        async with AsyncSessionLocal() as db:
+            await db.execute(_READY_SQL, {
+                "id": row.id, "claimed_at": row.variants_claimed_at,
+                "variant": names,
+                "sha256": [result[n]["sha256"] for n in names],
+                "size": [result[n]["size"] for n in names],
+                "mime_type": [result[n]["mime_type"] for n in names],
+                "width": [result[n]["width"] for n in names],
+                "height": [result[n]["height"] for n in names],
+            })
+            await db.commit()
+        response_cache.invalidate(row.pereval_id)
+
+thumbnail_worker = ThumbnailWorker(
+    parse_variants(settings.IMAGE_VARIANTS),
+    workers=max(settings.THUMBNAIL_WORKERS, 1),
+    batch=settings.THUMBNAIL_BATCH,
+    poll_seconds=settings.THUMBNAIL_POLL_SECONDS,
+    claim_timeout=settings.THUMBNAIL_CLAIM_TIMEOUT,
+)
+
+async def _drain() -> None:
+    worker = thumbnail_worker
+    worker._pool = ProcessPoolExecutor(worker.workers, mp_context=multiprocessing.get_context("spawn"))
+    total, t0 = 0, time.perf_counter()
+    try:
+        while True:
+            n = await worker.run_once()
+            if not n:
+                break
+            total += n
+            print(f"обработано {total} картинок, {total / (time.perf_counter() - t0):.1f}/с")
+    finally:
+        worker._pool.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Построить производные для всех картинок в очереди")
+    parser.add_argument("--drain", action="store_true", required=True)
+    parser.parse_args()
+    asyncio.run(_drain())
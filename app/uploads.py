@@ -0,0 +1,204 @@
+"""Потоковый приём multipart/form-data для submitData.
+
+Части запроса:
+  * ``metadata`` — JSON с полями SubmitDataIn; вместо ``images`` можно
+    передать список ``[{"title": ...}]`` по порядку файловых частей;
+  * ``images`` — файлы картинок (сколько угодно частей с этим именем).
+
+Тело не читается целиком: каждый чанк из ``request.stream()`` сразу
+уходит в парсер, а байты картинок — во временный файл BlobStore. В памяти
+одновременно живёт только текущий чанк и JSON метаданных.
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi.exceptions import RequestValidationError
+from multipart.multipart import MultipartParser, parse_options_header
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+from .admission import ADMISSION_REJECTED
+from .config import settings
+from .schemas import SubmitDataIn
+from .storage import BlobTooLarge, BlobTypeNotAllowed, BlobWriter, StoredBlob, get_blob_store
+
+class UploadRejected(ValueError):
+    def __init__(self, message: str, status_code: int = 400, reason: str = ""):
+        super().__init__(message)
+        self.status_code = status_code
+        if reason:
+            # Отказ по лимиту — в тот же счётчик, что у JSON (admission.py)
+            ADMISSION_REJECTED.inc((reason,))
+
+MULTIPART_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["metadata", "images"],
+                    "properties": {
+                        "metadata": {"type": "string", "description": "JSON SubmitDataIn (images — только title)"},
+                        "images": {"type": "array", "items": {"type": "string", "format": "binary"}},
+                    },
+                }
+            }
+        },
+    }
+}
+
+class _Part:
+    def __init__(self):
+        self.name = ""
+        self.filename: Optional[str] = None
+        self.writer: Optional[BlobWriter] = None
+        self.buf = bytearray()
+
+class MultipartSubmission:
+    """Разбор одного запроса; ``blobs`` — (имя файла, StoredBlob) по порядку частей."""
+
+    def __init__(self):
+        self.metadata: Optional[bytes] = None
+        self.blobs: List[Tuple[Optional[str], StoredBlob]] = []
+        self._writers: List[BlobWriter] = []
+        self._allowed = {t.strip() for t in settings.ALLOWED_IMAGE_TYPES.split(",") if t.strip()}
+
+    async def read(self, request: Request) -> "MultipartSubmission":
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise UploadRejected("Ожидается multipart/form-data с boundary", 415)
+
+        events: List[Tuple[str, Any]] = []
+        header_field = bytearray()
+        header_value = bytearray()
+        headers: Dict[bytes, bytes] = {}
+
+        def on_header_field(data, start, end):
+            header_field.extend(data[start:end])
+
+        def on_header_value(data, start, end):
+            header_value.extend(data[start:end])
+
+        def on_header_end():
+            headers[bytes(header_field).lower()] = bytes(header_value)
+            header_field.clear()
+            header_value.clear()
+
+        def on_headers_finished():
+            events.append(("begin", dict(headers)))
+            headers.clear()
+
+        def on_part_data(data, start, end):
+            events.append(("data", data[start:end]))
+
+        def on_part_end():
+            events.append(("end", None))
+
+        parser = MultipartParser(boundary, {
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        })
+
+        part: Optional[_Part] = None
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                for kind, value in events:
+                    if kind == "begin":
+                        part = self._begin_part(value)
+                    elif kind == "data":
+                        await self._part_data(part, value)
+                    else:
+                        await self._end_part(part)
+                        part = None
+                events.clear()
+            parser.finalize()
+        except BaseException:
+            self.abort()
+            raise
+        if self.metadata is None:
+            self.abort()
+            raise UploadRejected("Отсутствует часть metadata")
+        return self
+
+    def _begin_part(self, headers: Dict[bytes, bytes]) -> _Part:
+        part = _Part()
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        part.name = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in options:
+            part.filename = options[b"filename"].decode("utf-8", "replace")
+        if part.name == "images":
+            if len(self._writers) >= settings.MAX_IMAGES_PER_SUBMIT:
+                raise UploadRejected(f"Картинок больше {settings.MAX_IMAGES_PER_SUBMIT}", 413, "image_count")
+            part.writer = get_blob_store().writer(settings.MAX_IMAGE_BYTES, self._allowed)
+            self._writers.append(part.writer)
+        elif part.name != "metadata":
+            raise UploadRejected(f"Неизвестная часть формы: {part.name!r}")
+        return part
+
+    async def _part_data(self, part: _Part, data: bytes) -> None:
+        if part.writer is not None:
+            try:
+                await run_in_threadpool(part.writer.write, data)
+            except BlobTooLarge as e:
+                raise UploadRejected(str(e), 413, "image_size")
+            except BlobTypeNotAllowed as e:
+                raise UploadRejected(str(e), 415)
+            return
+        part.buf.extend(data)
+        if len(part.buf) > settings.MAX_METADATA_BYTES:
+            raise UploadRejected("Слишком большие metadata", 413, "body")
+
+    async def _end_part(self, part: _Part) -> None:
+        if part.writer is not None:
+            try:
+                blob = await run_in_threadpool(part.writer.finish)
+            except BlobTypeNotAllowed as e:
+                raise UploadRejected(str(e), 415)
+            except ValueError as e:
+                raise UploadRejected(str(e))
+            self.blobs.append((part.filename, blob))
+        else:
+            self.metadata = bytes(part.buf)
+
+    def to_payload(self) -> Dict[str, Any]:
+        """Валидирует metadata через SubmitDataIn и подставляет загруженные картинки."""
+        try:
+            meta = json.loads(self.metadata)
+        except ValueError as e:
+            raise UploadRejected(f"metadata — некорректный JSON: {e}")
+        if not isinstance(meta, dict):
+            raise UploadRejected("metadata должна быть JSON-объектом")
+        titles = [im.get("title") if isinstance(im, dict) else None for im in meta.get("images") or []]
+        images = []
+        for i, (filename, blob) in enumerate(self.blobs):
+            title = titles[i] if i < len(titles) and titles[i] else filename
+            # data — только чтобы пройти ImageIn; байты уже лежат в хранилище
+            images.append({"title": title or "", "data": blob.sha256})
+        try:
+            validated = SubmitDataIn.parse_obj({**meta, "images": images})
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+        payload = validated.dict()
+        payload["images"] = [
+            {"title": im["title"], "blob": blob}
+            for im, (_, blob) in zip(payload["images"], self.blobs)
+        ]
+        return payload
+
+    def commit(self) -> None:
+        for w in self._writers:
+            w.commit()
+        self._writers = []
+
+    def abort(self) -> None:
+        for w in self._writers:
+            w.abort()
+        self._writers = []
@@ -0,0 +1,105 @@
+"""Сколько обращений к БД стоит один POST /submitData.
+
+Сравнивает прежний путь (SELECT пользователя + flush на каждую сущность,
+воспроизведён здесь как эталон) с текущим DataRepository.create_pereval_from_payload.
+Считаются SQL-операторы (before_cursor_execute) плюс BEGIN/COMMIT.
+
+Запуск (нужна БД со схемой 00_schema.sql):
+    python -m benchmarks.bench_create_roundtrips [-n 200]
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import event, select
+
+from app import models
+from app.db import AsyncSessionLocal, async_engine
+from app.repository import DataRepository, _full_name, _norm_email, _parse_add_time, _store_base64
+
+PNG = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mP8/x8AAwMB/ek9nYQAAAAASUVORK5CYII="
+
+def make_payload(email: str, phone: str, n_images: int = 2) -> dict:
+    return {
+        "beauty_title": "пер.", "title": "Пхия", "other_titles": "Триев", "connect": "",
+        "add_time": "2021-09-22 13:18:13",
+        "user": {"email": email, "fam": "Пупкин", "name": "Василий", "otc": "Иванович", "phone": phone},
+        "coords": {"latitude": "45.3842", "longitude": "7.1525", "height": "1200"},
+        "level": {"winter": "", "summer": "1А", "autumn": "1А", "spring": ""},
+        "images": [{"data": PNG, "title": f"Фото {i}"} for i in range(n_images)],
+    }
+
+async def legacy_create(db, payload: dict) -> int:
+    """Прежняя последовательность запросов create_pereval_from_payload."""
+    email = _norm_email(payload["user"]["email"])
+    user = (await db.execute(select(models.User).filter(models.User.email == email))).scalar_one_or_none()
+    if user is None:
+        user = models.User(full_name=_full_name(payload["user"]), email=email, phone=payload["user"]["phone"])
+        db.add(user)
+        await db.flush()
+    coords = models.Coords(latitude=45.3842, longitude=7.1525, height=1200)
+    db.add(coords)
+    await db.flush()
+    levels = models.Levels(**payload["level"])
+    db.add(levels)
+    await db.flush()
+    per = models.Pereval(
+        beauty_title=payload["beauty_title"], title=payload["title"], other_titles=payload["other_titles"],
+        connect="", add_time=_parse_add_time(payload["add_time"]), user_id=user.id, coords_id=coords.id,
+        levels_id=levels.id, status=models.ModerationStatus.new, moderator_note="",
+    )
+    db.add(per)
+    await db.flush()
+    for img in payload["images"]:
+        blob = _store_base64(img["data"])
+        # До пакетной вставки ORM каждая картинка была отдельным INSERT
+        db.add(models.Image(pereval_id=per.id, title=img["title"], sha256=blob.sha256, size=blob.size, mime_type=blob.mime_type))
+        await db.flush()
+    await db.commit()
+    return per.id
+
+async def run(label: str, create, n: int, n_images: int) -> None:
+    counts = {"statements": 0, "begin": 0, "commit": 0}
+
+    def on_exec(*args):
+        counts["statements"] += 1
+
+    def on_begin(*args):
+        counts["begin"] += 1
+
+    def on_commit(*args):
+        counts["commit"] += 1
+
+    sync_engine = async_engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", on_exec)
+    event.listen(sync_engine, "begin", on_begin)
+    event.listen(sync_engine, "commit", on_commit)
+    # Повторный отправитель — самый частый случай
+    email, phone = f"bench-{uuid.uuid4().hex[:8]}@mail.ru", "+7 " + uuid.uuid4().hex[:10]
+    try:
+        t0 = time.perf_counter()
+        for _ in range(n):
+            async with AsyncSessionLocal() as db:
+                await create(db, make_payload(email, phone, n_images))
+        elapsed = time.perf_counter() - t0
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", on_exec)
+        event.remove(sync_engine, "begin", on_begin)
+        event.remove(sync_engine, "commit", on_commit)
+    per_req = {k: v / n for k, v in counts.items()}
+    total = per_req["statements"] + per_req["begin"] + per_req["commit"]
+    print(f"{label:8s} images={n_images}: {per_req['statements']:.1f} SQL + BEGIN/COMMIT = "
+          f"{total:.1f} round trips/submit, {elapsed / n * 1000:.2f} ms/submit")
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=200)
+    args = parser.parse_args()
+    for n_images in (1, 2, 5):
+        await run("legacy", legacy_create, args.n, n_images)
+        await run("current", lambda db, p: DataRepository(db).create_pereval_from_payload(p), args.n, n_images)
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
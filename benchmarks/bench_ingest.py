@@ -0,0 +1,112 @@
+"""Задержка POST /submitData: синхронная запись против очереди (Prefer: respond-async).
+
+Оба режима гоняются в одном процессе через httpx.ASGITransport, как
+benchmarks.run; IngestWorker запускается здесь же и делит с запросами
+событийный цикл и пул соединений — как в процессе API. Для очереди кроме
+задержки ответа меряется, за сколько все заявки стали done (сквозная
+пропускная способность) и сколько записей выходило на пачку.
+
+Нужен PostgreSQL со схемой 00_schema.sql (DATABASE_URL):
+    python -m benchmarks.bench_ingest [-n 500] [-c 32] [--images 2] [--image-kb 64]
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+import httpx
+
+from app.db import async_engine
+from app.ingest import INGEST_BATCH_SECONDS, ingest_worker
+from app.main import app
+from benchmarks.run import make_payload, new_user, percentile
+
+async def submit_all(client: httpx.AsyncClient, payloads: List[dict], concurrency: int,
+                     headers: Dict[str, str]) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    locations: List[str] = []
+
+    async def one(p: dict) -> None:
+        async with sem:
+            t0 = time.perf_counter()
+            r = await client.post("/submitData", json=p, headers=headers)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if r.status_code not in (200, 202):
+                raise RuntimeError(f"{r.status_code}: {r.text[:200]}")
+            if r.status_code == 202:
+                locations.append(r.headers["Location"])
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(p) for p in payloads))
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "p50_ms": percentile(latencies, 50), "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99), "max_ms": latencies[-1],
+        "rps": len(payloads) / elapsed, "elapsed": elapsed, "locations": locations,
+    }
+
+async def wait_done(client: httpx.AsyncClient, locations: List[str]) -> int:
+    pending = list(locations)
+    failed = 0
+    while pending:
+        still = []
+        for loc in pending:
+            st = (await client.get(loc)).json()
+            if st["state"] == "failed":
+                failed += 1
+            elif st["state"] != "done":
+                still.append(loc)
+        pending = still
+        if pending:
+            await asyncio.sleep(0.05)
+    return failed
+
+def batches_done() -> int:
+    return int(sum(v for name, _, v in INGEST_BATCH_SECONDS.samples() if name.endswith("_count")))
+
+def report(name: str, r: dict) -> None:
+    print(f"{name:<7} p50 {r['p50_ms']:7.1f} мс  p95 {r['p95_ms']:7.1f} мс  p99 {r['p99_ms']:7.1f} мс  "
+          f"max {r['max_ms']:7.1f} мс  {r['rps']:7.1f} запр/с")
+
+async def main(n: int, concurrency: int, images: int, image_kb: int) -> None:
+    # Каждый запрос — новый отправитель: очередь не должна выигрывать на кэше пользователей
+    def payloads() -> List[dict]:
+        return [make_payload(u["email"], u["phone"], images, image_kb) for u in (new_user() for _ in range(n))]
+
+    await ingest_worker.start()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            # Прогрев пула и кэшей в обоих режимах
+            await submit_all(client, payloads()[:concurrency], concurrency, {})
+            warm = await submit_all(client, payloads()[:concurrency], concurrency, {"Prefer": "respond-async"})
+            await wait_done(client, warm["locations"])
+
+            sync = await submit_all(client, payloads(), concurrency, {})
+            report("sync", sync)
+
+            batches_before = batches_done()
+            t0 = time.perf_counter()
+            queued = await submit_all(client, payloads(), concurrency, {"Prefer": "respond-async"})
+            report("async", queued)
+            failed = await wait_done(client, queued["locations"])
+            drained = time.perf_counter() - t0
+            batches = batches_done() - batches_before
+            print(f"очередь: все {n} заявок done за {drained:.2f} с ({n / drained:.1f} записей/с), "
+                  f"пачек {batches}, в среднем {n / max(batches, 1):.1f} записей на пачку, failed {failed}")
+            print(f"p99: {sync['p99_ms']:.1f} -> {queued['p99_ms']:.1f} мс "
+                  f"(x{sync['p99_ms'] / max(queued['p99_ms'], 0.001):.1f})")
+    finally:
+        await ingest_worker.stop()
+        await async_engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="p99 POST /submitData: синхронно против очереди")
+    parser.add_argument("-n", type=int, default=500, help="запросов на режим")
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("--images", type=int, default=2)
+    parser.add_argument("--image-kb", type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(main(args.n, args.concurrency, args.images, args.image_kb))
@@ -0,0 +1,132 @@
+"""Гео-поиск на большом объёме: /submitData/near и /submitData/bbox.
+
+Генерирует N синтетических перевалов (generate_series, одним INSERT на
+таблицу) со случайными точками по горным районам, затем меряет запрос
+страницы из DataRepository.list_perevals_near и печатает план: в нём
+должны быть Bitmap/Index Scan по idx_coords_point и idx_pereval_coords_id,
+а не Seq Scan по coords. Синтетические строки помечены beauty_title
+'bench-geo' и удаляются в конце (--keep — оставить).
+
+    python -m benchmarks.bench_near --rows 1000000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import event, text
+
+from app import geo
+from app.db import AsyncSessionLocal, async_engine
+from app.repository import DataRepository
+
+MARK = "bench-geo"
+
+# (lat, lon, разброс в градусах): Альпы, Кавказ, Памир, Алтай, Анды
+REGIONS = [(46.0, 8.0, 3.0), (43.0, 43.0, 3.0), (38.5, 72.5, 3.0), (50.0, 87.0, 3.0), (-33.0, -70.0, 5.0)]
+
+SEED_SQL = """
+WITH u AS (
+    INSERT INTO users (full_name, email, phone) VALUES ('Bench Geo', 'bench-geo@mail.ru', 'bench-geo')
+    ON CONFLICT (phone) DO UPDATE SET full_name = EXCLUDED.full_name RETURNING id
+), l AS (
+    INSERT INTO levels (winter, summer, autumn, spring) VALUES ('', '1А', '', '') RETURNING id
+), c AS (
+    INSERT INTO coords (latitude, longitude, height)
+    SELECT round((r.lat + (random() - 0.5) * 2 * r.spread)::numeric, 6),
+           round((r.lon + (random() - 0.5) * 2 * r.spread)::numeric, 6),
+           (1000 + random() * 4000)::int
+    FROM generate_series(1, :n) g
+    CROSS JOIN LATERAL (
+        SELECT * FROM unnest(CAST(:lats AS float8[]), CAST(:lons AS float8[]), CAST(:spreads AS float8[]))
+            AS r(lat, lon, spread)
+        OFFSET (g % :regions) LIMIT 1
+    ) r
+    RETURNING id
+)
+INSERT INTO pereval (beauty_title, title, other_titles, connect, add_time, user_id, coords_id, levels_id, status, moderator_note)
+SELECT :mark, 'Перевал ' || c.id, '', '', now(), (SELECT id FROM u), c.id, (SELECT id FROM l), 'new', ''
+FROM c
+"""
+
+async def seed(n: int) -> None:
+    async with AsyncSessionLocal() as db:
+        t0 = time.perf_counter()
+        await db.execute(text(SEED_SQL), {
+            "n": n, "mark": MARK, "regions": len(REGIONS),
+            "lats": [r[0] for r in REGIONS], "lons": [r[1] for r in REGIONS], "spreads": [r[2] for r in REGIONS],
+        })
+        await db.commit()
+        await db.execute(text("ANALYZE coords"))
+        await db.execute(text("ANALYZE pereval"))
+        print(f"вставлено {n} записей за {time.perf_counter() - t0:.1f} с")
+
+async def cleanup() -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(text(
+            "WITH p AS (DELETE FROM pereval WHERE beauty_title = :mark RETURNING coords_id, levels_id), "
+            "c AS (DELETE FROM coords WHERE id IN (SELECT coords_id FROM p)) "
+            "DELETE FROM levels WHERE id IN (SELECT levels_id FROM p)"
+        ), {"mark": MARK})
+        await db.execute(text("DELETE FROM users WHERE phone = 'bench-geo'"))
+        await db.commit()
+
+async def explain(stmt_label: str, lat: float, lon: float, boxes, radius_km) -> None:
+    async with AsyncSessionLocal() as db:
+        repo = DataRepository(db)
+        captured = {}
+
+        # План того же SQL, что шлёт репозиторий: перехватываем первый оператор
+        def grab(conn, cursor, statement, parameters, context, executemany):
+            captured.setdefault("sql", (statement, parameters))
+        event.listen(async_engine.sync_engine, "before_cursor_execute", grab)
+        try:
+            await repo.list_perevals_near(lat, lon, boxes, radius_km, include_images=False, limit=51)
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", grab)
+        statement, parameters = captured["sql"]
+        raw = await db.connection()
+        driver = (await raw.get_raw_connection()).driver_connection
+        plan = await driver.fetch("EXPLAIN (ANALYZE, COSTS OFF) " + statement, *parameters)
+        print(f"--- план: {stmt_label}")
+        for row in plan:
+            print("   ", row[0])
+
+async def measure(label: str, lat: float, lon: float, boxes, radius_km, n: int) -> None:
+    times, found = [], 0
+    async with AsyncSessionLocal() as db:
+        repo = DataRepository(db)
+        for _ in range(n):
+            t0 = time.perf_counter()
+            rows = await repo.list_perevals_near(lat, lon, boxes, radius_km, include_images=False, limit=50)
+            times.append((time.perf_counter() - t0) * 1000)
+            found = len(rows)
+    times.sort()
+    print(f"{label:40s} строк={found:3d}  p50={statistics.median(times):7.2f} мс  "
+          f"p95={times[int(len(times) * 0.95) - 1]:7.2f} мс")
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("-n", type=int, default=50, help="повторов каждого запроса")
+    parser.add_argument("--keep", action="store_true", help="не удалять синтетические строки")
+    args = parser.parse_args()
+    await seed(args.rows)
+    try:
+        cases = [
+            ("near Альпы r=5 км", 46.0, 8.0, 5.0),
+            ("near Альпы r=50 км", 46.0, 8.0, 50.0),
+            ("near океан r=100 км (пусто)", 0.0, -150.0, 100.0),
+        ]
+        for label, lat, lon, r in cases:
+            await measure(label, lat, lon, geo.boxes_around(lat, lon, r), r, args.n)
+        boxes = geo.split_antimeridian(45.9, 7.9, 46.1, 8.1)
+        await measure("bbox 0.2°x0.2° (вьюпорт)", 46.0, 8.0, boxes, None, args.n)
+        await explain("near r=5 км", 46.0, 8.0, geo.boxes_around(46.0, 8.0, 5.0), 5.0)
+    finally:
+        if not args.keep:
+            await cleanup()
+        await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
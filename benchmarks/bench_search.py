@@ -0,0 +1,141 @@
+"""Нечёткий поиск /submitData/search на большом объёме.
+
+Генерирует N синтетических перевалов с названиями из случайных слогов
+(кириллица в title/beauty_title, латиница в other_titles), затем меряет
+страницу DataRepository.search_perevals для точного слова, опечатки,
+латиницы и пустого результата, а для сравнения — ILIKE по тем же полям
+без индекса. Печатает план: в нём должен быть Bitmap Index Scan по
+idx_pereval_search_trgm. Нужен pg_trgm (00_schema.sql). Синтетические
+строки помечены connect = 'bench-search' и удаляются в конце (--keep).
+
+    python -m benchmarks.bench_search --rows 1000000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import event, text
+
+from app.config import settings
+from app.db import AsyncSessionLocal, async_engine
+from app.repository import DataRepository
+
+MARK = "bench-search"
+
+SEED_SQL = """
+WITH u AS (
+    INSERT INTO users (full_name, email, phone) VALUES ('Bench Search', 'bench-search@mail.ru', 'bench-search')
+    ON CONFLICT (phone) DO UPDATE SET full_name = EXCLUDED.full_name RETURNING id
+), l AS (
+    INSERT INTO levels (winter, summer, autumn, spring) VALUES ('', '1А', '', '') RETURNING id
+), c AS (
+    INSERT INTO coords (latitude, longitude, height)
+    SELECT 43.0, 42.0, 3000 FROM generate_series(1, :n)
+    RETURNING id
+), syl AS (
+    SELECT ARRAY['ка','ра','ту','шха','бе','ло','ми','да','зу','чи','гор','пер','ан','ос','ел','ур','ха','ки','на','ве'] AS ru,
+           ARRAY['ka','ra','tu','shkha','be','lo','mi','da','zu','chi','gor','per','an','os','el','ur','kha','ki','na','ve'] AS lat
+), named AS (
+    SELECT c.id AS coords_id,
+           initcap(ru[1 + (random() * 19)::int] || ru[1 + (random() * 19)::int] || ru[1 + (random() * 19)::int]) AS ru_name,
+           initcap(lat[1 + (random() * 19)::int] || lat[1 + (random() * 19)::int] || lat[1 + (random() * 19)::int]) AS lat_name
+    FROM c, syl
+)
+INSERT INTO pereval (beauty_title, title, other_titles, connect, add_time, user_id, coords_id, levels_id, status, moderator_note)
+SELECT 'пер.', ru_name, lat_name || ' pass', :mark, now(), (SELECT id FROM u), coords_id, (SELECT id FROM l), 'new', ''
+FROM named
+"""
+
+ILIKE_SQL = """
+SELECT id FROM pereval
+WHERE beauty_title ILIKE :p OR title ILIKE :p OR other_titles ILIKE :p
+ORDER BY id LIMIT 50
+"""
+
+async def seed(n: int) -> None:
+    async with AsyncSessionLocal() as db:
+        t0 = time.perf_counter()
+        await db.execute(text(SEED_SQL), {"n": n, "mark": MARK})
+        await db.commit()
+        await db.execute(text("ANALYZE pereval"))
+        print(f"вставлено {n} записей за {time.perf_counter() - t0:.1f} с")
+
+async def cleanup() -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(text(
+            "WITH p AS (DELETE FROM pereval WHERE connect = :mark RETURNING coords_id, levels_id), "
+            "c AS (DELETE FROM coords WHERE id IN (SELECT coords_id FROM p)) "
+            "DELETE FROM levels WHERE id IN (SELECT levels_id FROM p)"
+        ), {"mark": MARK})
+        await db.execute(text("DELETE FROM users WHERE phone = 'bench-search'"))
+        await db.commit()
+
+def report(label: str, times, found: int) -> None:
+    times.sort()
+    print(f"{label:36s} строк={found:3d}  p50={statistics.median(times):8.2f} мс  "
+          f"p95={times[max(int(len(times) * 0.95) - 1, 0)]:8.2f} мс")
+
+async def measure_search(label: str, q: str, n: int) -> None:
+    times, found = [], 0
+    async with AsyncSessionLocal() as db:
+        repo = DataRepository(db)
+        for _ in range(n):
+            t0 = time.perf_counter()
+            rows = await repo.search_perevals(q, settings.SEARCH_SIMILARITY, limit=50)
+            times.append((time.perf_counter() - t0) * 1000)
+            found = len(rows)
+            await db.rollback()
+    report(label, times, found)
+
+async def measure_ilike(label: str, q: str, n: int) -> None:
+    times, found = [], 0
+    async with AsyncSessionLocal() as db:
+        for _ in range(n):
+            t0 = time.perf_counter()
+            found = len((await db.execute(text(ILIKE_SQL), {"p": f"%{q}%"})).all())
+            times.append((time.perf_counter() - t0) * 1000)
+    report(label, times, found)
+
+async def explain(q: str) -> None:
+    captured = []
+
+    def grab(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    async with AsyncSessionLocal() as db:
+        event.listen(async_engine.sync_engine, "before_cursor_execute", grab)
+        try:
+            await DataRepository(db).search_perevals(q, settings.SEARCH_SIMILARITY, limit=51)
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", grab)
+        # [0] — set_config порога, [1] — сам поиск (порог ещё действует в этой транзакции)
+        statement, parameters = captured[1]
+        driver = (await (await db.connection()).get_raw_connection()).driver_connection
+        plan = await driver.fetch("EXPLAIN (ANALYZE, COSTS OFF) " + statement, *parameters)
+        print(f"--- план: {q!r}")
+        for row in plan:
+            print("   ", row[0])
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("-n", type=int, default=30, help="повторов каждого запроса")
+    parser.add_argument("--keep", action="store_true", help="не удалять синтетические строки")
+    args = parser.parse_args()
+    await seed(args.rows)
+    try:
+        await measure_search("search: слово целиком", "карату", args.n)
+        await measure_search("search: опечатка", "кароту", args.n)
+        await measure_search("search: латиница", "karatu", args.n)
+        await measure_search("search: нет совпадений", "эверест", args.n)
+        await measure_ilike("ILIKE без индекса: слово", "карату", max(args.n // 10, 3))
+        await measure_ilike("ILIKE без индекса: нет совпадений", "эверест", max(args.n // 10, 3))
+        await explain("кароту")
+    finally:
+        if not args.keep:
+            await cleanup()
+        await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
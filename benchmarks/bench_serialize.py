@@ -0,0 +1,63 @@
+"""Сериализация ответа GET: прежний путь через response_model против orjson.
+
+Прежний путь — PerevalOut.parse_obj + jsonable_encoder + JSONResponse
+(ровно то, что делал FastAPI), новый — serializers.dumps_pereval. Перед
+замером проверяется, что байты совпадают. БД не нужна: объекты ORM
+собираются в памяти, картинки — в legacy-поле data.
+
+    python -m benchmarks.bench_serialize [--image-kb 200] [-n 200]
+"""
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from app import models
+from app.repository import DataRepository
+from app.responses import render_model
+from app.schemas import PerevalOut
+from app.serializers import dumps_pereval
+
+def make_pereval(n_images: int, image_kb: int) -> models.Pereval:
+    per = models.Pereval(
+        id=1, beauty_title="пер.", title="Пхия", other_titles="Триев", connect="",
+        add_time=datetime(2021, 9, 22, 13, 18, 13), status=models.ModerationStatus.new,
+    )
+    per.user = models.User(email="qwerty@mail.ru", full_name="Пупкин Василий Иванович", phone="+7 555 55 55")
+    per.coords = models.Coords(latitude=45.3842, longitude=0.000001, height=1200)
+    per.levels = models.Levels(winter="", summer="1А", autumn="1А", spring="")
+    per.images = [
+        models.Image(id=i + 1, title=f"Фото {i}", data=os.urandom(image_kb * 1024),
+                     size=image_kb * 1024, mime_type="image/jpeg")
+        for i in range(n_images)
+    ]
+    return per
+
+def bench(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image-kb", type=int, default=200)
+    parser.add_argument("-n", type=int, default=200)
+    args = parser.parse_args()
+    repo = DataRepository(db=None)
+    print(f"{'images':>9} {'bytes':>10} {'response_model, us':>20} {'orjson, us':>12} {'x':>6}")
+    for n_images in (0, 2, 10):
+        for include_images in (True, False):
+            per = make_pereval(n_images, args.image_kb)
+            item = await repo.to_dict(per, include_images=include_images)
+            old = render_model(PerevalOut, item)
+            new = dumps_pereval(item)
+            assert old == new, "сериализации разошлись"
+            t_old = bench(lambda: render_model(PerevalOut, item), args.n)
+            t_new = bench(lambda: dumps_pereval(item), args.n)
+            label = f"{n_images}{'' if include_images else ' (meta)'}"
+            print(f"{label:>9} {len(new):>10} {t_old:>20.1f} {t_new:>12.1f} {t_old / t_new:>6.1f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
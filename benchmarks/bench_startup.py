@@ -0,0 +1,96 @@
+"""Холодный старт и первые секунды под нагрузкой: dev-профиль против прод-профиля.
+
+Для каждого профиля поднимает uvicorn отдельным процессом (БД из
+DATABASE_URL, схема уже применена), меряет время до первого ответа
+200 и сразу даёт пачку параллельных некэшируемых GET (список по email с
+limit) — p50/p99 этой пачки показывают, сколько стоят холодный пул и
+create_all в первых запросах.
+
+    python -m benchmarks.bench_startup --concurrency 32 --requests 20
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+PROFILES = {
+    # Как было: create_all в каждом процессе, пул открывается по запросам
+    "dev (create_all, без прогрева)": {"SCHEMA_ON_STARTUP": "create", "DB_POOL_PREWARM": "0"},
+    # start.sh: схема заранее, пул прогрет
+    "prod (skip, прогрев пула)": {"SCHEMA_ON_STARTUP": "skip", "DB_POOL_PREWARM": "10"},
+}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def wait_ready(client: httpx.AsyncClient, url: str, t0: float, timeout: float = 30.0) -> float:
+    while time.perf_counter() - t0 < timeout:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return time.perf_counter() - t0
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.005)
+    raise RuntimeError("сервер не поднялся")
+
+async def burst(client: httpx.AsyncClient, url: str, concurrency: int, per_client: int):
+    times = []
+
+    async def one():
+        for _ in range(per_client):
+            t = time.perf_counter()
+            r = await client.get(url)
+            r.raise_for_status()
+            times.append((time.perf_counter() - t) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(concurrency)))
+    times.sort()
+    return times
+
+async def run_profile(label: str, env: dict, args) -> None:
+    port = free_port()
+    proc_env = {**os.environ, **env, "THUMBNAIL_WORKERS": "0"}
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=proc_env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base, timeout=30.0, limits=limits) as client:
+            # /docs не ходит в БД: время до готовности процесса
+            ready = await wait_ready(client, "/docs", t0)
+            url = f"/submitData/?user__email={args.email}&limit=10&include_images=false"
+            first = time.perf_counter()
+            (await client.get(url)).raise_for_status()
+            first_ms = (time.perf_counter() - first) * 1000
+            times = await burst(client, url, args.concurrency, args.requests)
+    finally:
+        proc.terminate()
+        proc.wait()
+    p99 = times[max(int(len(times) * 0.99) - 1, 0)]
+    print(f"{label:34s} старт={ready * 1000:7.0f} мс  первый запрос={first_ms:6.1f} мс  "
+          f"пачка: p50={statistics.median(times):6.1f} мс p99={p99:6.1f} мс")
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=20, help="запросов на клиента")
+    parser.add_argument("--email", default="qwerty@mail.ru")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    for _ in range(args.rounds):
+        for label, env in PROFILES.items():
+            await run_profile(label, env, args)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,261 @@
+"""Бенчмарк всех /submitData-эндпоинтов в одном процессе.
+
+Приложение вызывается напрямую через httpx.ASGITransport — без uvicorn и
+сети, поэтому цифры отражают код и БД, а не стек HTTP. Нужен локальный
+PostgreSQL со схемой 00_schema.sql (DATABASE_URL): SQLite не годится как
+замена — схема и запросы опираются на enum, ON CONFLICT по индексу-выражению
+и unnest массивов.
+
+На каждый сценарий: p50/p95/p99 задержки, пропускная способность,
+SQL-операторов на запрос, пиковый RSS процесса. Результаты — JSON; с
+``--baseline`` прогон сравнивается с прошлым и завершается с кодом 1 при
+регрессии больше ``--max-regression``.
+
+    python -m benchmarks.run --out bench.json
+    python -m benchmarks.run --quick --baseline bench.json --max-regression 0.5
+"""
+import argparse
+import asyncio
+import base64
+import copy
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+from sqlalchemy import event
+
+from app.cache import response_cache
+from app.db import async_engine
+from app.main import app
+
+# Сравниваются с baseline; пропускная способность шумит сильнее — только отчёт
+REGRESSION_METRICS = ("p95_ms", "sql_per_request")
+
+class SqlCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        event.listen(async_engine.sync_engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(async_engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+def peak_rss_mb() -> float:
+    # Linux отдаёт ru_maxrss в КБ, macOS — в байтах
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+def make_payload(email: str, phone: str, n_images: int, image_kb: int) -> dict:
+    return {
+        "beauty_title": "пер.", "title": "Пхия", "other_titles": "Триев", "connect": "",
+        "add_time": "2021-09-22 13:18:13",
+        "user": {"email": email, "fam": "Пупкин", "name": "Василий", "otc": "Иванович", "phone": phone},
+        "coords": {"latitude": "45.3842", "longitude": "7.1525", "height": "1200"},
+        "level": {"winter": "", "summer": "1А", "autumn": "1А", "spring": ""},
+        "images": [
+            # Случайные байты: иначе дедупликация хранилища исказит замер записи
+            {"data": base64.b64encode(b"\xff\xd8\xff" + os.urandom(image_kb * 1024)).decode("ascii"), "title": f"Фото {i}"}
+            for i in range(n_images)
+        ],
+    }
+
+def new_user() -> Dict[str, str]:
+    return {"email": f"bench-{uuid.uuid4().hex[:12]}@mail.ru", "phone": "+7 " + uuid.uuid4().hex[:12]}
+
+async def measure(name: str, params: dict, requests: int, concurrency: int,
+                  call: Callable[[int], Awaitable[httpx.Response]]) -> dict:
+    latencies: List[float] = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        async with sem:
+            t0 = time.perf_counter()
+            r = await call(i)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if r.status_code >= 400:
+                raise RuntimeError(f"{name}: HTTP {r.status_code}: {r.text[:200]}")
+
+    with SqlCounter() as sql:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - t0
+    latencies.sort()
+    result = {
+        "name": name,
+        "params": params,
+        "requests": requests,
+        "concurrency": concurrency,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "sql_per_request": round(sql.count / requests, 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print(f"{name:45s} p50={result['p50_ms']:8.2f}ms p95={result['p95_ms']:8.2f}ms p99={result['p99_ms']:8.2f}ms "
+          f"{result['throughput_rps']:8.1f} rps  sql/req={result['sql_per_request']:5.2f}  rss={result['peak_rss_mb']:.0f}MB")
+    return result
+
+async def run_suite(client: httpx.AsyncClient, quick: bool, requests: int, concurrency: int) -> List[dict]:
+    image_matrix = [(0, 0), (2, 200)] if quick else [(0, 0), (2, 200), (10, 200), (2, 2048)]
+    records_per_user = [10] if quick else [10, 100]
+    results = []
+
+    for n_images, image_kb in image_matrix:
+        # Пустой images отклоняется схемой — «0 фото» это одна крошечная картинка
+        n, kb = (n_images, image_kb) if n_images else (1, 1)
+        params = {"images": n_images, "image_kb": image_kb}
+        tag = f"images={n_images},kb={image_kb}"
+        user = new_user()
+        payloads = [make_payload(user["email"], user["phone"], n, kb) for _ in range(min(requests, 20))]
+        ids: List[int] = []
+
+        async def submit(i: int) -> httpx.Response:
+            r = await client.post("/submitData", json=payloads[i % len(payloads)])
+            ids.append(r.json().get("id"))
+            return r
+        results.append(await measure(f"submit[{tag}]", params, requests, concurrency, submit))
+
+        files = [("images", (f"{i}.jpg", base64.b64decode(img["data"]), "image/jpeg")) for i, img in enumerate(payloads[0]["images"])]
+        metadata = json.dumps({k: v for k, v in payloads[0].items() if k != "images"}, ensure_ascii=False)
+
+        async def upload(i: int) -> httpx.Response:
+            return await client.post("/submitData/upload", data={"metadata": metadata}, files=files)
+        results.append(await measure(f"upload[{tag}]", params, requests, concurrency, upload))
+
+        async def get_cold(i: int) -> httpx.Response:
+            pid = ids[i % len(ids)]
+            response_cache.invalidate(pid)
+            return await client.get(f"/submitData/{pid}")
+        results.append(await measure(f"get[{tag}]", params, requests, concurrency, get_cold))
+
+        async def get_cached(i: int) -> httpx.Response:
+            return await client.get(f"/submitData/{ids[i % len(ids)]}")
+        results.append(await measure(f"get_cached[{tag}]", params, requests, concurrency, get_cached))
+
+        first = (await client.get(f"/submitData/{ids[0]}", params={"include_images": "false"})).json()
+        image_url = first["images"][0]["url"]
+
+        async def get_image(i: int) -> httpx.Response:
+            return await client.get(image_url)
+        results.append(await measure(f"image[{tag}]", params, requests, concurrency, get_image))
+
+        patch_body = copy.deepcopy(payloads[0])
+
+        async def patch(i: int) -> httpx.Response:
+            body = dict(patch_body, title=f"Пхия #{i}")
+            return await client.patch(f"/submitData/{ids[i % len(ids)]}", json=body)
+        results.append(await measure(f"patch[{tag}]", params, requests, concurrency, patch))
+
+    user = new_user()
+    line = json.dumps(make_payload(user["email"], user["phone"], 1, 1), ensure_ascii=False)
+    batch_size = 50
+    ndjson = "\n".join([line] * batch_size).encode("utf-8")
+
+    async def batch(i: int) -> httpx.Response:
+        return await client.post("/submitData/batch", content=ndjson, headers={"Content-Type": "application/x-ndjson"})
+    results.append(await measure(f"batch[lines={batch_size}]", {"lines": batch_size}, max(requests // 10, 3), concurrency, batch))
+
+    for per_user in records_per_user:
+        user = new_user()
+        body = make_payload(user["email"], user["phone"], 2, 50)
+        for _ in range(per_user):
+            await client.post("/submitData", json=body)
+        for include_images in (True, False):
+            params = {"records_per_user": per_user, "include_images": include_images}
+            q = {"user__email": user["email"], "include_images": str(include_images).lower()}
+
+            async def list_all(i: int, q=q) -> httpx.Response:
+                return await client.get("/submitData/", params=q)
+            results.append(await measure(
+                f"list[records={per_user},images={include_images}]", params, max(requests // 4, 5), concurrency, list_all,
+            ))
+    return results
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return ""
+
+def compare(results: List[dict], baseline: dict, max_regression: float, min_delta_ms: float) -> List[str]:
+    base = {r["name"]: r for r in baseline.get("results", [])}
+    failures = []
+    for r in results:
+        old = base.get(r["name"])
+        if not old:
+            continue
+        for metric in REGRESSION_METRICS:
+            before, after = old.get(metric), r.get(metric)
+            if before is None or after is None:
+                continue
+            # Абсолютный допуск поверх относительного: у быстрых сценариев
+            # p95 в единицы мс, и шум планировщика легко даёт +50%
+            slack = min_delta_ms if metric.endswith("_ms") else 0.5
+            if after > before * (1 + max_regression) + slack:
+                failures.append(f"{r['name']}: {metric} {before} -> {after}")
+    return failures
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк /submitData (in-process)")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.5, help="допустимый рост p95 и SQL/запрос, доля")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="рост p95 меньше этого не считается регрессией")
+    parser.add_argument("--requests", type=int, default=100, help="запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--quick", action="store_true", help="урезанная матрица для CI")
+    args = parser.parse_args()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        results = await run_suite(client, args.quick, args.requests, args.concurrency)
+    await async_engine.dispose()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "quick": args.quick,
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"результаты: {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            failures = compare(results, json.load(f), args.max_regression, args.min_delta_ms)
+        if failures:
+            print("РЕГРЕССИИ:")
+            for line in failures:
+                print("  " + line)
+            return 1
+        print("регрессий нет")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
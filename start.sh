@@ -1,2 +1,13 @@
 #!/bin/bash
-uvicorn app.main:app --host 0.0.0.0 --port $PORT
+# Прод-профиль: схема применяется один раз до запуска воркеров, сами воркеры
+# стартуют без create_all (SCHEMA_ON_STARTUP=skip) и с прогретым пулом.
+#   WEB_CONCURRENCY   — процессов uvicorn (по умолчанию 1)
+#   MIGRATE_ON_START  — 0: не трогать схему (её ставит отдельный job)
+#   DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_PREWARM ... — см. app/config.py
+set -e
+export SCHEMA_ON_STARTUP="${SCHEMA_ON_STARTUP:-skip}"
+export DB_POOL_PREWARM="${DB_POOL_PREWARM:-4}"
+if [ "${MIGRATE_ON_START:-1}" = "1" ]; then
+    python -m app.migrate
+fi
+exec uvicorn app.main:app --host 0.0.0.0 --port "${PORT:-8000}" --workers "${WEB_CONCURRENCY:-1}"
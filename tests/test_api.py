@@ -1,5 +1,8 @@
 # tests/test_api.py
 import copy
+import uuid
+
+import pytest
 import requests
 
 BASE = "http://localhost:8000"
@@ -96,3 +99,685 @@ def test_patch_forbidden_on_user_fields_change():
     out = r.json()
     assert out["state"] == 0
     assert "email" in (out.get("message") or "").lower()
+
+def test_submit_and_patch_multipart():
+    import base64, json
+    payload = make_payload()
+    png = base64.b64decode(payload["images"][0]["data"])
+    meta = {k: v for k, v in payload.items() if k != "images"}
+    meta["images"] = [{"title": "Седловина"}, {"title": "Подъём"}]
+    files = [
+        ("metadata", (None, json.dumps(meta), "application/json")),
+        ("images", ("a.png", png, "image/png")),
+        ("images", ("b.png", png, "image/png")),
+    ]
+    r = requests.post(f"{BASE}/submitData/upload", files=files)
+    assert r.status_code == 200, r.text
+    pid = r.json()["id"]
+
+    r = requests.get(f"{BASE}/submitData/{pid}")
+    got = r.json()
+    assert [im["title"] for im in got["images"]] == ["Седловина", "Подъём"]
+    assert base64.b64decode(got["images"][0]["data"]) == png
+
+    # PATCH: заголовок из имени файла, если title не передан
+    meta.pop("images")
+    files = [("metadata", (None, json.dumps(meta), "application/json")), ("images", ("Новая", png, "image/png"))]
+    r = requests.patch(f"{BASE}/submitData/{pid}/upload", files=files)
+    assert r.json()["state"] == 1, r.json()
+    assert [im["title"] for im in requests.get(f"{BASE}/submitData/{pid}").json()["images"]] == ["Новая"]
+
+    # Не картинка — отказ до записи в БД
+    files = [("metadata", (None, json.dumps(meta), "application/json")), ("images", ("x.txt", b"not an image at all", "text/plain"))]
+    r = requests.post(f"{BASE}/submitData/upload", files=files)
+    assert r.status_code == 415
+
+def test_images_projection_and_raw_endpoint():
+    import base64
+    payload = make_payload()
+    r = requests.post(f"{BASE}/submitData", json=payload)
+    pid = r.json()["id"]
+    png = base64.b64decode(payload["images"][0]["data"])
+
+    # Проекция без base64: только метаданные и url
+    r = requests.get(f"{BASE}/submitData/{pid}", params={"include_images": "false"})
+    images = r.json()["images"]
+    assert len(images) == 2
+    assert all(im["data"] is None for im in images)
+    assert images[0]["mime_type"] == "image/png"
+    assert images[0]["size"] == len(png)
+
+    r = requests.get(f"{BASE}/submitData/", params={"user__email": payload["user"]["email"], "include_images": "false"})
+    assert all(im["data"] is None for x in r.json() for im in x["images"])
+
+    # Сырые байты + Range + ETag
+    url = BASE + images[0]["url"]
+    r = requests.get(url)
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/png"
+    assert r.content == png
+    etag = r.headers["etag"]
+
+    r = requests.get(url, headers={"Range": "bytes=0-7"})
+    assert r.status_code == 206
+    assert r.content == png[:8]
+    assert r.headers["content-range"] == f"bytes 0-7/{len(png)}"
+
+    r = requests.get(url, headers={"Range": "bytes=-4"})
+    assert r.status_code == 206 and r.content == png[-4:]
+
+    r = requests.get(url, headers={"Range": f"bytes={len(png)}-"})
+    assert r.status_code == 416
+
+    r = requests.get(url, headers={"If-None-Match": etag})
+    assert r.status_code == 304
+
+def test_list_keyset_pagination_and_ndjson():
+    import json, uuid
+    payload = make_payload()
+    payload["user"]["email"] = f"pages-{uuid.uuid4().hex[:8]}@mail.ru"
+    payload["user"]["phone"] = "+7 " + uuid.uuid4().hex[:10]
+    ids = [requests.post(f"{BASE}/submitData", json=payload).json()["id"] for _ in range(5)]
+    email = payload["user"]["email"]
+
+    seen, cursor = [], None
+    while True:
+        params = {"user__email": email, "limit": 2, "include_images": "false"}
+        if cursor:
+            params["cursor"] = cursor
+        r = requests.get(f"{BASE}/submitData/", params=params)
+        assert r.status_code == 200
+        seen += [x["id"] for x in r.json()]
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == sorted(ids, reverse=True)
+
+    r = requests.get(f"{BASE}/submitData/", params={"user__email": email, "format": "ndjson", "limit": 3})
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(l) for l in r.text.splitlines()]
+    assert [x["id"] for x in lines] == sorted(ids, reverse=True)[:3]
+    assert lines[0]["images"][0]["data"]
+    assert r.headers.get("X-Next-Cursor")
+
+    r = requests.get(f"{BASE}/submitData/", params={"user__email": email, "cursor": "garbage!"})
+    assert r.status_code == 400
+
+def test_batch_ndjson():
+    import json, uuid
+    good = make_payload()
+    good["user"]["email"] = f"batch-{uuid.uuid4().hex[:8]}@mail.ru"
+    good["user"]["phone"] = "+7 " + uuid.uuid4().hex[:10]
+    no_images = copy.deepcopy(good)
+    no_images["images"] = []
+    bad_b64 = copy.deepcopy(good)
+    bad_b64["images"][0]["data"] = "!!!not-base64!!!"
+    lines = [
+        json.dumps(good, ensure_ascii=False),
+        "{broken json",
+        "",
+        json.dumps(no_images, ensure_ascii=False),
+        json.dumps(bad_b64, ensure_ascii=False),
+        json.dumps(good, ensure_ascii=False),
+    ]
+    r = requests.post(f"{BASE}/submitData/batch", data="\n".join(lines).encode("utf-8"),
+                      headers={"Content-Type": "application/x-ndjson"})
+    assert r.status_code == 200, r.text
+    out = {x["line"]: x for x in r.json()}
+    assert sorted(out) == [1, 2, 4, 5, 6]
+    assert out[1]["status"] == 200 and out[6]["status"] == 200
+    assert out[1]["id"] != out[6]["id"]
+    assert out[2]["status"] == 422
+    assert out[4]["status"] == 400 and "images" in out[4]["message"]
+    assert out[5]["status"] == 400 and "base64" in out[5]["message"]
+
+    got = requests.get(f"{BASE}/submitData/{out[6]['id']}").json()
+    assert got["user"]["email"] == good["user"]["email"]
+    assert [im["title"] for im in got["images"]] == ["Седловина", "Подъём"]
+
+    # Чужой телефон валит всю пачку в БД — остальные строки всё равно проходят
+    thief = copy.deepcopy(good)
+    thief["user"]["email"] = f"batch-{uuid.uuid4().hex[:8]}@mail.ru"
+    r = requests.post(f"{BASE}/submitData/batch",
+                      data="\n".join(json.dumps(p, ensure_ascii=False) for p in [good, thief]).encode("utf-8"))
+    res = r.json()
+    assert res[0]["status"] == 200
+    assert res[1]["status"] == 400 and "уникальности" in res[1]["message"]
+
+def test_get_etag_and_cache_invalidation():
+    payload = make_payload()
+    pid = requests.post(f"{BASE}/submitData", json=payload).json()["id"]
+    url = f"{BASE}/submitData/{pid}"
+
+    r1 = requests.get(url)
+    etag = r1.headers["etag"]
+    stats = requests.get(f"{BASE}/cache/stats").json()
+    r2 = requests.get(url)
+    assert r2.content == r1.content and r2.headers["etag"] == etag
+    assert requests.get(f"{BASE}/cache/stats").json()["hits"] == stats["hits"] + 1
+
+    r = requests.get(url, headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.headers["etag"] == etag
+
+    # PATCH сбрасывает кэш — старый ETag больше не совпадает
+    patch = copy.deepcopy(payload)
+    patch["title"] = "Пхия (кэш)"
+    assert requests.patch(url, json=patch).json()["state"] == 1
+    r = requests.get(url, headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.json()["title"] == "Пхия (кэш)"
+    assert r.headers["etag"] != etag
+
+def _metric(text, prefix):
+    return sum(float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(prefix))
+
+def test_metrics_endpoint():
+    pid = requests.post(f"{BASE}/submitData", json=make_payload()).json()["id"]
+    route = 'method="GET",route="/submitData/{pereval_id}"'
+    before = requests.get(f"{BASE}/metrics").text
+    requests.get(f"{BASE}/submitData/{pid}")
+    r = requests.get(f"{BASE}/metrics")
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain")
+    after = r.text
+
+    # Метка — шаблон маршрута, а не конкретный id
+    assert f"/submitData/{pid}" not in after
+    count = "fstr_http_request_duration_seconds_count{" + route + ',status="200"}'
+    assert _metric(after, count) == _metric(before, count) + 1
+    # Промах кэша — ровно один SELECT, и он засчитан этому запросу
+    sql_sum = "fstr_request_sql_statements_sum{" + route + "}"
+    assert _metric(after, sql_sum) == _metric(before, sql_sum) + 1
+    assert "fstr_db_pool_checkout_wait_seconds_count" in after
+    assert "fstr_response_cache_hits_total" in after
+
+def test_near_and_bbox():
+    import random
+    # Случайный центр — не пересекаемся с записями прошлых прогонов
+    lat, lon = round(random.uniform(-60, 60), 4), round(random.uniform(-170, 170), 4)
+    ids = []
+    for dlat in (0.0, 0.03, 0.2):  # ~0, ~3.3 и ~22 км к северу
+        payload = make_payload()
+        payload["coords"] = {"latitude": str(round(lat + dlat, 6)), "longitude": str(lon), "height": "1000"}
+        ids.append(requests.post(f"{BASE}/submitData", json=payload).json()["id"])
+
+    r = requests.get(f"{BASE}/submitData/near", params={"lat": lat, "lon": lon, "radius_km": 10})
+    assert r.status_code == 200
+    items = r.json()
+    assert [i["id"] for i in items] == ids[:2]
+    assert items[0]["distance_km"] < 0.01 and 3.0 < items[1]["distance_km"] < 3.6
+    assert items[0]["images"][0]["data"] is None
+
+    # Пагинация по (distance, id)
+    r1 = requests.get(f"{BASE}/submitData/near", params={"lat": lat, "lon": lon, "radius_km": 30, "limit": 2})
+    assert [i["id"] for i in r1.json()] == ids[:2]
+    r2 = requests.get(f"{BASE}/submitData/near", params={"lat": lat, "lon": lon, "radius_km": 30, "limit": 2,
+                                                       "cursor": r1.headers["x-next-cursor"]})
+    assert [i["id"] for i in r2.json()] == ids[2:]
+    assert "x-next-cursor" not in r2.headers
+
+    box = {"min_lat": lat - 0.01, "max_lat": lat + 0.1, "min_lon": lon - 0.01, "max_lon": lon + 0.01}
+    r = requests.get(f"{BASE}/submitData/bbox", params={**box, "lat": lat, "lon": lon})
+    assert [i["id"] for i in r.json()] == ids[:2]
+    assert requests.get(f"{BASE}/submitData/near", params={"lat": lat, "lon": lon, "radius_km": 10,
+                                                           "cursor": "bad"}).status_code == 400
+
+def test_near_across_antimeridian():
+    import random
+    lat = round(random.uniform(-50, 50), 4)
+    east, west = make_payload(), make_payload()
+    east["coords"] = {"latitude": str(lat), "longitude": "179.99", "height": "10"}
+    west["coords"] = {"latitude": str(lat), "longitude": "-179.99", "height": "10"}
+    id_e = requests.post(f"{BASE}/submitData", json=east).json()["id"]
+    id_w = requests.post(f"{BASE}/submitData", json=west).json()["id"]
+    items = requests.get(f"{BASE}/submitData/near", params={"lat": lat, "lon": 179.995, "radius_km": 5}).json()
+    assert {id_e, id_w} <= {i["id"] for i in items}
+    box = {"min_lat": lat - 0.01, "max_lat": lat + 0.01, "min_lon": 179.98, "max_lon": -179.98}
+    items = requests.get(f"{BASE}/submitData/bbox", params=box).json()
+    assert {id_e, id_w} <= {i["id"] for i in items}
+
+def test_search_by_title():
+    tag = uuid.uuid4().hex[:8]
+    payload = make_payload()
+    payload["title"] = f"Перевал Ёлкин {tag}"
+    payload["other_titles"] = f"Yolkin pass {tag}"
+    pid = requests.post(f"{BASE}/submitData", json=payload).json()["id"]
+
+    r = requests.get(f"{BASE}/submitData/search", params={"q": f"елкин {tag}"})
+    if r.status_code == 503:
+        pytest.skip("в БД нет pg_trgm")
+    assert r.status_code == 200
+    items = r.json()
+    assert items[0]["id"] == pid and items[0]["score"] > 0
+    assert items[0]["images"] and items[0]["images"][0]["data"] is None
+    # Латиница из other_titles и регистр
+    assert pid in [i["id"] for i in requests.get(f"{BASE}/submitData/search", params={"q": f"YOLKIN {tag}"}).json()]
+    # Опечатка в слове
+    assert pid in [i["id"] for i in requests.get(f"{BASE}/submitData/search", params={"q": f"ёлкен {tag}"}).json()]
+
+    # Пагинация по (score, id): страницы не пересекаются
+    other = copy.deepcopy(payload)
+    other["title"] = f"Перевал Ёлкин {tag} Южный"
+    requests.post(f"{BASE}/submitData", json=other)
+    r1 = requests.get(f"{BASE}/submitData/search", params={"q": tag, "limit": 1})
+    r2 = requests.get(f"{BASE}/submitData/search", params={"q": tag, "limit": 1, "cursor": r1.headers["x-next-cursor"]})
+    assert len(r1.json()) == 1 and len(r2.json()) == 1
+    assert r1.json()[0]["id"] != r2.json()[0]["id"]
+
+def test_moderation_queue_parallel_claims():
+    import threading
+    for _ in range(10):
+        requests.post(f"{BASE}/submitData", json=make_payload())
+    tag = uuid.uuid4().hex[:8]
+    claimed = {}
+
+    def claim(n):
+        r = requests.post(f"{BASE}/moderation/claim", json={"moderator": f"mod-{tag}-{n}", "limit": 5})
+        assert r.status_code == 200
+        claimed[n] = [i["id"] for i in r.json()]
+        assert all(i["status"] == "pending" for i in r.json())
+
+    threads = [threading.Thread(target=claim, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    all_ids = [i for ids in claimed.values() for i in ids]
+    # Ни одна запись не выдана двоим
+    assert len(all_ids) == len(set(all_ids)) and all_ids
+
+    ids0 = claimed[0]
+    # Чужие аренды решить нельзя
+    r = requests.post(f"{BASE}/moderation/decide",
+                      json={"moderator": f"mod-{tag}-1", "ids": ids0, "status": "accepted"}).json()
+    assert r["updated"] == [] and r["skipped"] == sorted(ids0)
+    r = requests.post(f"{BASE}/moderation/decide",
+                      json={"moderator": f"mod-{tag}-0", "ids": ids0, "status": "rejected", "moderator_note": "дубль"}).json()
+    assert r["updated"] == sorted(ids0)
+    got = requests.get(f"{BASE}/submitData/{ids0[0]}").json()
+    assert got["status"] == "rejected"
+    # После решения PATCH запрещён
+    assert requests.patch(f"{BASE}/submitData/{ids0[0]}", json=make_payload()).json()["state"] == 0
+
+    for n in range(1, 4):
+        if claimed[n]:
+            requests.post(f"{BASE}/moderation/release", json={"moderator": f"mod-{tag}-{n}", "ids": claimed[n]})
+    assert requests.get(f"{BASE}/submitData/{claimed[1][0]}").json()["status"] == "new"
+    assert requests.post(f"{BASE}/moderation/decide",
+                         json={"moderator": "x", "ids": [1], "status": "new"}).status_code == 422
+
+def test_moderation_expired_claim_returns_to_queue():
+    import time
+    tag = uuid.uuid4().hex[:8]
+    r = requests.post(f"{BASE}/moderation/claim", json={"moderator": f"slow-{tag}", "limit": 2, "lease_seconds": 1})
+    ids = [i["id"] for i in r.json()]
+    assert ids and "x-claim-expires-at" in r.headers
+    time.sleep(1.5)
+    # Просроченные аренды выдаются раньше новых записей
+    r = requests.post(f"{BASE}/moderation/claim", json={"moderator": f"fast-{tag}", "limit": 50})
+    taken = [i["id"] for i in r.json()]
+    assert set(ids) <= set(taken)
+    # Прежний владелец аренду потерял
+    r = requests.post(f"{BASE}/moderation/decide", json={"moderator": f"slow-{tag}", "ids": ids, "status": "accepted"})
+    assert r.json()["updated"] == []
+    requests.post(f"{BASE}/moderation/release", json={"moderator": f"fast-{tag}", "ids": taken})
+
+def test_thumbnails_built_in_background():
+    PIL = pytest.importorskip("PIL.Image")
+    import base64, io, time
+    buf = io.BytesIO()
+    PIL.new("RGB", (1200, 800), (30, 120, 200)).save(buf, "JPEG")
+    payload = make_payload()
+    payload["images"] = [{"data": base64.b64encode(buf.getvalue()).decode(), "title": "Большое фото"}]
+    pid = requests.post(f"{BASE}/submitData", json=payload).json()["id"]
+
+    # Ответ на POST не ждёт превью; пока их нет — отдаётся оригинал
+    deadline = time.time() + 30
+    while True:
+        img = requests.get(f"{BASE}/submitData/{pid}", params={"include_images": "false", "variant": "thumb"}).json()["images"][0]
+        if img["variants_status"] in ("ready", "failed") or time.time() > deadline:
+            break
+        assert img["variant"] == "original"
+        time.sleep(0.3)
+    assert img["variants_status"] == "ready"
+    assert img["variant"] == "thumb" and img["url"].endswith("?variant=thumb")
+
+    r = requests.get(f"{BASE}{img['url']}")
+    assert r.status_code == 200
+    assert r.headers["X-Image-Variant"] == "thumb"
+    assert int(r.headers["Content-Length"]) == img["size"] < len(buf.getvalue())
+    thumb = PIL.open(io.BytesIO(r.content))
+    assert max(thumb.size) <= 320 and thumb.size[0] / thumb.size[1] == pytest.approx(1.5, rel=0.02)
+
+    # Оригинал по умолчанию не меняется
+    r = requests.get(f"{BASE}/submitData/{pid}/images/{img['id']}")
+    assert r.headers["X-Image-Variant"] == "original" and r.content == buf.getvalue()
+
+    # Неизвестный вариант — ошибка валидации
+    assert requests.get(f"{BASE}/submitData/{pid}", params={"variant": "huge"}).status_code == 422
+
+def _sync(email, since=None, limit=2):
+    # Докачивает ленту изменений до конца: (записи, курсор для следующей синхронизации)
+    items = []
+    while True:
+        params = {"user__email": email, "limit": limit}
+        if since:
+            params["since"] = since
+        r = requests.get(f"{BASE}/submitData/changes", params=params)
+        assert r.status_code == 200, r.text
+        items += r.json()
+        since = r.headers.get("X-Next-Cursor")
+        if r.headers["X-Has-More"] == "false":
+            return items, since
+
+def test_changes_feed():
+    import time
+    payload = make_payload()
+    payload["user"]["email"] = f"sync-{uuid.uuid4().hex[:8]}@mail.ru"
+    payload["user"]["phone"] = "+7 " + uuid.uuid4().hex[:10]
+    email = payload["user"]["email"]
+    ids = [requests.post(f"{BASE}/submitData", json=payload).json()["id"] for _ in range(3)]
+
+    # Свежие строки отдаются только после CHANGES_SAFETY_LAG_SECONDS
+    deadline = time.time() + 15
+    items, cursor = _sync(email)
+    while len(items) < 3 and time.time() < deadline:
+        time.sleep(0.5)
+        items, cursor = _sync(email)
+    assert [x["id"] for x in items] == ids
+    assert items[0]["updated_at"] <= items[1]["updated_at"] <= items[2]["updated_at"]
+
+    # Повтор с сохранённым курсором — пусто, курсор тот же
+    assert _sync(email, cursor) == ([], cursor)
+
+    # Правка одной записи — в ленте только она
+    changed = make_payload()
+    changed["user"] = payload["user"]
+    changed["title"] = "Изменено"
+    assert requests.patch(f"{BASE}/submitData/{ids[1]}", json=changed).json()["state"] == 1
+    deadline = time.time() + 15
+    items, new_cursor = _sync(email, cursor)
+    while not items and time.time() < deadline:
+        time.sleep(0.5)
+        items, new_cursor = _sync(email, cursor)
+    assert [(x["id"], x["title"]) for x in items] == [(ids[1], "Изменено")]
+    assert new_cursor != cursor
+
+    r = requests.get(f"{BASE}/submitData/changes", params={"since": "garbage!"})
+    assert r.status_code == 400
+
+def _patch_sql(pid, body, headers=None):
+    # PATCH + число SQL-операторов, засчитанных ему (гистограмма из /metrics)
+    key = 'fstr_request_sql_statements_sum{method="PATCH",route="/submitData/{pereval_id}"}'
+    before = _metric(requests.get(f"{BASE}/metrics").text, key)
+    r = requests.patch(f"{BASE}/submitData/{pid}", json=body, headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json(), _metric(requests.get(f"{BASE}/metrics").text, key) - before
+
+def test_merge_patch_touches_only_changed_rows():
+    import base64
+    payload = make_payload()
+    png = base64.b64decode(payload["images"][0]["data"])
+    other = base64.b64encode(png + b"\0").decode()
+    pid = requests.post(f"{BASE}/submitData", json=payload).json()["id"]
+    images = requests.get(f"{BASE}/submitData/{pid}", params={"include_images": "false"}).json()["images"]
+    ids = [im["id"] for im in images]
+
+    # Опечатка в названии: SELECT + UPDATE pereval, картинки не трогаются
+    out, sql = _patch_sql(pid, {"title": "Пхия-2"})
+    assert out["state"] == 1 and sql == 2
+    got = requests.get(f"{BASE}/submitData/{pid}", params={"include_images": "false"}).json()
+    assert got["title"] == "Пхия-2" and got["other_titles"] == "Триев"
+    assert [im["id"] for im in got["images"]] == ids
+
+    # Полный payload без изменений (картинки снова в base64) — только SELECT
+    out, sql = _patch_sql(pid, {**payload, "title": "Пхия-2"})
+    assert out["state"] == 1 and sql == 1
+
+    # Вложенные объекты сливаются по ключам
+    out, sql = _patch_sql(pid, {"level": {"winter": "2Б"}, "coords": {"height": "1250"}},
+                          {"Content-Type": "application/merge-patch+json"})
+    assert out["state"] == 1 and sql == 4  # SELECT, UPDATE coords, UPDATE levels, UPDATE pereval
+    got = requests.get(f"{BASE}/submitData/{pid}", params={"include_images": "false"}).json()
+    assert got["level"]["winter"] == "2Б" and got["level"]["summer"] == "1А" and got["coords"]["height"] == 1250
+
+    # Замена одной картинки: старая по ссылке sha256, одна удаляется, одна новая
+    body = {"images": [{"sha256": images[0]["sha256"], "title": "Седловина"}, {"data": other, "title": "Новая"}]}
+    out, sql = _patch_sql(pid, body)
+    assert out["state"] == 1 and sql == 4  # SELECT, DELETE images, INSERT images, UPDATE pereval
+    got = requests.get(f"{BASE}/submitData/{pid}", params={"include_images": "false"}).json()["images"]
+    assert got[0]["id"] == ids[0] and ids[1] not in [im["id"] for im in got]
+    assert [im["title"] for im in got] == ["Седловина", "Новая"]
+
+    # Ограничения прежние
+    out, _ = _patch_sql(pid, {"user": {"phone": "+7 000"}})
+    assert out["state"] == 0
+    out, _ = _patch_sql(pid, {"title": None})
+    assert out["state"] == 0
+    out, _ = _patch_sql(pid, {"images": [{"sha256": "0" * 64, "title": "Чужая"}]})
+    assert out["state"] == 0
+    assert requests.patch(f"{BASE}/submitData/{pid}", json={"images": [{"title": "Пусто"}]}).status_code == 422
+
+def test_patch_partial_user_unchanged():
+    # Вложенный user тоже сливается по ключам: непереданные части ФИО берутся из записи
+    payload = make_payload()
+    email = payload["user"]["email"] = f"partial-{uuid.uuid4().hex[:8]}@mail.ru"
+    payload["user"]["phone"] = "+7 " + uuid.uuid4().hex[:10]
+    pid = requests.post(f"{BASE}/submitData", json=payload).json()["id"]
+    for user in ({"fam": "Пупкин"}, {"name": "Василий", "otc": "Иванович"}, {"email": email.upper(), "otc": "Иванович"}):
+        r = requests.patch(f"{BASE}/submitData/{pid}", json={"user": user})
+        assert r.json()["state"] == 1, (user, r.text)
+    for user in ({"fam": "Иванов"}, {"otc": "Петрович"}, {"name": "Пупкин"}):
+        r = requests.patch(f"{BASE}/submitData/{pid}", json={"user": user})
+        assert r.json() == {"state": 0, "message": "Нельзя изменять ФИО пользователя"}, user
+
+def test_idempotency_key():
+    from concurrent.futures import ThreadPoolExecutor
+    payload = make_payload()
+    payload["user"]["email"] = f"retry-{uuid.uuid4().hex[:8]}@mail.ru"
+    payload["user"]["phone"] = "+7 " + uuid.uuid4().hex[:10]
+    email = payload["user"]["email"]
+
+    def post(body, key):
+        return requests.post(f"{BASE}/submitData", json=body, headers={"Idempotency-Key": key})
+
+    key = uuid.uuid4().hex
+    r1 = post(payload, key)
+    assert r1.status_code == 200 and r1.headers["Idempotent-Replayed"] == "false"
+    r2 = post(payload, key)
+    assert r2.status_code == 200 and r2.headers["Idempotent-Replayed"] == "true"
+    assert r2.json() == r1.json()
+
+    # Тот же ключ, другое тело — отказ
+    r = post({**payload, "title": "Другой"}, key)
+    assert r.status_code == 422 and r.json()["id"] is None
+
+    # Параллельные дубли: одна запись на всех
+    key = uuid.uuid4().hex
+    with ThreadPoolExecutor(8) as pool:
+        answers = list(pool.map(lambda _: post(payload, key), range(8)))
+    assert {a.status_code for a in answers} == {200}
+    assert len({a.json()["id"] for a in answers}) == 1
+    assert [a.headers["Idempotent-Replayed"] for a in answers].count("false") == 1
+
+    items = requests.get(f"{BASE}/submitData/", params={"user__email": email, "include_images": "false"}).json()
+    assert len(items) == 2
+
+    assert post(payload, "x" * 300).status_code == 400
+
+def test_read_your_writes_cookie():
+    # Имеет смысл только при DATABASE_REPLICA_URLS: без реплик cookie не ставится
+    s = requests.Session()
+    r = s.post(f"{BASE}/submitData", json=make_payload())
+    assert r.status_code == 200
+    if "fstr_primary_until" not in s.cookies:
+        pytest.skip("сервер без реплик")
+    pid = r.json()["id"]
+
+    before = _metric(requests.get(f"{BASE}/metrics").text, 'fstr_db_reads_total{target="sticky"}')
+    assert s.get(f"{BASE}/submitData/{pid}", params={"include_images": "false"}).json()["id"] == pid
+    after = _metric(requests.get(f"{BASE}/metrics").text, 'fstr_db_reads_total{target="sticky"}')
+    assert after == before + 1
+
+    # Чужой клиент без cookie читает с реплики; неудачная запись cookie не ставит
+    assert "set-cookie" not in requests.get(f"{BASE}/submitData/{pid}").headers
+    assert "set-cookie" not in requests.post(f"{BASE}/submitData", json={}).headers
+
+def test_export_formats():
+    import csv
+    import io
+    import json
+    pid = requests.post(f"{BASE}/submitData", json=make_payload()).json()["id"]
+
+    r = requests.get(f"{BASE}/submitData/export", params={"status": "new"})
+    assert r.status_code == 200 and r.headers["content-type"].startswith("application/x-ndjson")
+    rows = {row["id"]: row for row in map(json.loads, r.text.splitlines())}
+    row = rows[pid]
+    assert row["status"] == "new" and row["images"] == 2 and row["coords"]["height"] == 1200
+    assert "user" not in row
+    assert all(x["status"] == "new" for x in rows.values())
+
+    r = requests.get(f"{BASE}/submitData/export", params={"format": "csv", "status": ["new", "rejected"]})
+    assert r.headers["content-type"].startswith("text/csv")
+    table = list(csv.DictReader(io.StringIO(r.content.decode("utf-8-sig"))))
+    assert any(int(t["id"]) == pid and t["latitude"] == "45.3842" for t in table)
+
+    r = requests.get(f"{BASE}/submitData/export", params={"format": "geojson", "status": "new"})
+    fc = r.json()
+    assert fc["type"] == "FeatureCollection"
+    feature = next(f for f in fc["features"] if f["id"] == pid)
+    assert feature["geometry"]["coordinates"] == [7.1525, 45.3842, 1200]
+
+    # Пустая выборка — всё равно валидный GeoJSON
+    r = requests.get(f"{BASE}/submitData/export",
+                     params={"format": "geojson", "updated_before": "2000-01-01T00:00:00"})
+    assert r.json()["features"] == []
+
+    assert requests.get(f"{BASE}/submitData/export", params={"status": "bogus"}).status_code == 400
+
+def test_repeat_submitter_name_and_phone_change():
+    # Повторный submit идёт мимо upsert в users (user_cache), но смена ФИО/телефона доходит до БД
+    payload = make_payload()
+    email = payload["user"]["email"] = f"repeat-{uuid.uuid4().hex[:8]}@mail.ru"
+    phones = ["+7 " + uuid.uuid4().hex[:10] for _ in range(2)]
+
+    def submit(phone, name):
+        body = copy.deepcopy(payload)
+        body["user"].update(phone=phone, name=name)
+        assert requests.post(f"{BASE}/submitData", json=body).json()["status"] == 200
+
+    def users():
+        items = requests.get(f"{BASE}/submitData/", params={"user__email": email.upper(), "include_images": "false"}).json()
+        return {(i["user"]["phone"], i["user"]["full_name"]) for i in items}, len(items)
+
+    submit(phones[0], "Василий")
+    submit(phones[0], "Василий")
+    assert users() == ({(phones[0], "Пупкин Василий Иванович")}, 2)
+    submit(phones[1], "Пётр")
+    assert users() == ({(phones[1], "Пупкин Пётр Иванович")}, 3)
+    submit(phones[0], "Пётр")
+    assert users() == ({(phones[0], "Пупкин Пётр Иванович")}, 4)
+
+    # Другой воркер записал в users своё ФИО (user_cache этого процесса о нём не знает):
+    # следующая заявка всё равно пишет свои данные
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+    from app.db import engine
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE users SET full_name = 'Пупкин Иван Иванович' WHERE trim_lower_email(email) = :e"),
+                         {"e": email})
+    except OperationalError:
+        pytest.skip("нет БД")
+    submit(phones[0], "Пётр")
+    assert users() == ({(phones[0], "Пупкин Пётр Иванович")}, 5)
+
+def test_admission_limits():
+    import base64
+    import http.client
+    import json
+    from urllib.parse import urlsplit
+
+    def rejected(reason):
+        return _metric(requests.get(f"{BASE}/metrics").text, f'fstr_admission_rejected_total{{reason="{reason}"}}')
+
+    # Content-Length больше лимита — 413 до чтения тела
+    before = rejected("body")
+    u = urlsplit(BASE)
+    conn = http.client.HTTPConnection(u.hostname, u.port, timeout=10)
+    conn.putrequest("POST", "/submitData")
+    conn.putheader("Content-Type", "application/json")
+    conn.putheader("Content-Length", str(10 ** 10))
+    conn.endheaders()
+    r = conn.getresponse()
+    assert r.status == 413 and json.loads(r.read())["status"] == 413
+    conn.close()
+    assert rejected("body") == before + 1
+
+    payload = make_payload()
+    payload["images"] = payload["images"] * 11  # 22 картинки
+    r = requests.post(f"{BASE}/submitData", json=payload)
+    assert r.status_code == 413 and r.json()["id"] is None
+
+    pid = requests.post(f"{BASE}/submitData", json=make_payload()).json()["id"]
+    r = requests.patch(f"{BASE}/submitData/{pid}", json={"images": [{"data": "A" * 28_000_000, "title": "Огромная"}]})
+    assert r.status_code == 413 and r.json()["state"] == 0
+
+    # Батч: плохая строка — 413 в своём результате, остальные проходят
+    big = make_payload()
+    big["images"] = big["images"] * 11
+    body = "\n".join(json.dumps(p) for p in (make_payload(), big)).encode()
+    out = requests.post(f"{BASE}/submitData/batch", data=body).json()
+    assert [o["status"] for o in out] == [200, 413]
+
+    # multipart: лишняя картинка режется на лету
+    png = base64.b64decode(payload["images"][0]["data"])
+    meta = {k: v for k, v in make_payload().items() if k != "images"}
+    files = [("metadata", (None, json.dumps(meta), "application/json"))]
+    files += [("images", (f"{i}.png", png, "image/png")) for i in range(21)]
+    r = requests.post(f"{BASE}/submitData/upload", files=files)
+    assert r.status_code == 413
+
+def test_async_submit_queue():
+    import time
+    payload = make_payload()
+    payload["user"].update(email=f"async-{uuid.uuid4().hex[:8]}@mail.ru", phone="+7 " + uuid.uuid4().hex[:10])
+    r = requests.post(f"{BASE}/submitData", json=payload, headers={"Prefer": "respond-async"})
+    assert r.status_code == 202, r.text
+    assert r.headers["Preference-Applied"] == "respond-async"
+    body = r.json()
+    assert body["state"] == "queued" and body["id"] is None
+    assert r.headers["Location"] == f"/submitData/ingest/{body['ticket']}"
+
+    def wait(location):
+        deadline = time.time() + 15
+        while True:
+            st = requests.get(f"{BASE}{location}").json()
+            if st["state"] in ("done", "failed") or time.time() > deadline:
+                return st
+            time.sleep(0.2)
+
+    st = wait(r.headers["Location"])
+    assert st["state"] == "done" and st["message"] is None
+    item = requests.get(f"{BASE}/submitData/{st['id']}", params={"include_images": "false"}).json()
+    assert item["title"] == "Пхия" and len(item["images"]) == 2
+
+    # Ошибка данных видна в статусе — тем же текстом, что у синхронного POST
+    other = copy.deepcopy(payload)
+    other["user"]["email"] = "other-" + payload["user"]["email"]
+    r = requests.post(f"{BASE}/submitData", json=other, headers={"Prefer": "respond-async"})
+    st = wait(r.headers["Location"])
+    assert st["state"] == "failed" and st["id"] is None
+    assert st["message"].startswith("Нарушение уникальности")
+
+    # Ошибки, известные до очереди, — сразу; с Idempotency-Key — синхронно
+    bad = copy.deepcopy(payload)
+    bad["images"][0]["data"] = "не base64"
+    r = requests.post(f"{BASE}/submitData", json=bad, headers={"Prefer": "respond-async"})
+    assert r.status_code == 400
+    r = requests.post(f"{BASE}/submitData", json=payload,
+                      headers={"Prefer": "respond-async", "Idempotency-Key": str(uuid.uuid4())})
+    assert r.status_code == 200 and r.json()["id"]
+    assert "Preference-Applied" not in r.headers
+
+    assert requests.get(f"{BASE}/submitData/ingest/{uuid.uuid4()}").status_code == 404
+    assert requests.get(f"{BASE}/submitData/ingest/nope").status_code == 404
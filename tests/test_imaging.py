@@ -0,0 +1,32 @@
+# Производные картинок без сервера и БД: хранилище — во временном каталоге
+import base64
+import io
+
+import pytest
+
+PIL = pytest.importorskip("PIL.Image")
+
+from app import storage
+from app.imaging import parse_variants, render_variants
+
+PNG = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mP8/x8AAwMB/ek9nYQAAAAASUVORK5CYII=")
+
+@pytest.fixture(autouse=True)
+def blob_store(tmp_path, monkeypatch):
+    store = storage.LocalBlobStore(str(tmp_path))
+    monkeypatch.setattr(storage, "_store", store)
+    return store
+
+def test_empty_variants_render_nothing(blob_store):
+    assert parse_variants("") == {} and parse_variants(" , ") == {}
+    # Без вариантов исходник даже не читается: ни байтов, ни sha256 не нужно
+    assert render_variants(None, PNG, parse_variants("")) == {}
+    assert render_variants("0" * 64, None, {}) == {}
+
+def test_variants_rendered_largest_first(blob_store):
+    buf = io.BytesIO()
+    PIL.new("RGB", (1200, 800), (30, 120, 200)).save(buf, "JPEG")
+    out = render_variants(None, buf.getvalue(), parse_variants("thumb:320,web:600"))
+    assert (out["web"]["width"], out["web"]["height"]) == (600, 400)
+    assert (out["thumb"]["width"], out["thumb"]["height"]) == (320, 213)
+    assert all(v["mime_type"] == "image/jpeg" and blob_store.exists(v["sha256"]) for v in out.values())
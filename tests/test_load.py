@@ -0,0 +1,64 @@
+# tests/test_load.py
+# Нагрузочная проверка: тяжёлый POST не должен выстраивать GET-запросы в очередь
+import base64
+import os
+import threading
+import time
+
+import requests
+
+from test_api import BASE, make_payload
+
+def _heavy_payload(n_images=10, image_bytes=2 * 1024 * 1024):
+    payload = make_payload()
+    payload["images"] = [
+        {"data": base64.b64encode(os.urandom(image_bytes)).decode("ascii"), "title": f"Большое фото {i}"}
+        for i in range(n_images)
+    ]
+    return payload
+
+def test_get_not_serialized_behind_slow_post():
+    r = requests.post(f"{BASE}/submitData", json=make_payload())
+    pid = r.json()["id"]
+    url = f"{BASE}/submitData/{pid}"
+    requests.get(url, params={"include_images": "false"})  # прогрев пула
+
+    heavy = _heavy_payload()
+    post_span = {}
+
+    def slow_post():
+        t0 = time.perf_counter()
+        resp = requests.post(f"{BASE}/submitData", json=heavy)
+        post_span["t"] = (t0, time.perf_counter())
+        assert resp.status_code == 200
+
+    latencies = []
+    lock = threading.Lock()
+
+    def one_get():
+        t0 = time.perf_counter()
+        resp = requests.get(url, params={"include_images": "false"})
+        assert resp.status_code == 200
+        with lock:
+            latencies.append(time.perf_counter() - t0)
+
+    poster = threading.Thread(target=slow_post)
+    poster.start()
+    getters = []
+    while poster.is_alive() and len(getters) < 100:
+        t = threading.Thread(target=one_get)
+        t.start()
+        getters.append(t)
+        time.sleep(0.02)
+    for t in getters:
+        t.join()
+    poster.join()
+
+    start, end = post_span["t"]
+    post_time = end - start
+    assert len(latencies) >= 5, "POST завершился слишком быстро для проверки"
+    latencies.sort()
+    median = latencies[len(latencies) // 2]
+    # Синхронная сессия держала event loop на всё время вставки, и GET ждали
+    # порядка оставшегося времени POST; теперь они отвечают параллельно
+    assert median < post_time / 2, (median, post_time)
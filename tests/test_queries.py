@@ -0,0 +1,55 @@
+# Планы запросов: нужны индексы, а не seq scan. БД — из DATABASE_URL / FSTR_DB_*
+# (та же, что у сервера); без неё тесты пропускаются.
+import pytest
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import OperationalError
+
+from app.db import engine
+from app.repository import DataRepository, _CREATE_PEREVAL_KNOWN_USER_SQL, _CREATE_PEREVAL_SQL
+
+@pytest.fixture
+def conn():
+    try:
+        c = engine.connect()
+    except OperationalError:
+        pytest.skip("нет БД")
+    # На маленькой таблице seq scan дешевле — запрещаем его, чтобы проверить, что индекс вообще применим
+    c.execute(text("SET LOCAL enable_seqscan = off"))
+    yield c
+    c.rollback()
+    c.close()
+
+def _plan(conn, stmt) -> str:
+    sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    return "\n".join(conn.execute(text("EXPLAIN " + sql)).scalars())
+
+def test_list_by_email_uses_expression_index(conn):
+    # Чужой email: в user_cache его нет, фильтр идёт через users
+    stmt = DataRepository(None)._by_email(" Nobody-Cached@Mail.RU ", None).limit(10)
+    plan = _plan(conn, stmt)
+    assert "users_email_unique" in plan, plan
+    assert "Seq Scan on users" not in plan, plan
+
+# EXPLAIN без ANALYZE не выполняет INSERT-ы из CTE
+_CREATE_PARAMS = {
+    "full_name": "Пупкин Василий", "email": "a@b.c", "phone": "+7 000", "latitude": 45.0, "longitude": 7.0,
+    "height": 1000, "winter": "", "summer": "", "autumn": "", "spring": "", "beauty_title": "пер.",
+    "title": "Т", "other_titles": "", "connect": "", "add_time": "2021-09-22 13:18:13",
+    "image_titles": ["t"], "image_hashes": ["0" * 64], "image_sizes": [1], "image_mimes": ["image/jpeg"],
+    "idempotency_key": None,
+}
+
+def test_create_user_lookup_uses_expression_index(conn):
+    plan = "\n".join(conn.execute(text("EXPLAIN " + _CREATE_PEREVAL_SQL.text), _CREATE_PARAMS).scalars())
+    assert "Conflict Arbiter Indexes: users_email_unique" in plan, plan
+    assert "using users_email_unique on users" in plan, plan
+    assert "Seq Scan on users" not in plan, plan
+
+def test_create_known_user_reads_users_by_primary_key(conn):
+    # Повторный отправитель из user_cache: users — одна строка по уникальному ключу
+    # (id или телефон — на выбор планировщика), без upsert
+    params = dict(_CREATE_PARAMS, user_id=1)
+    plan = "\n".join(conn.execute(text("EXPLAIN " + _CREATE_PEREVAL_KNOWN_USER_SQL.text), params).scalars())
+    assert "using users_pkey on users" in plan or "using users_phone_key on users" in plan, plan
+    assert "Insert on users" not in plan and "Seq Scan on users" not in plan, plan
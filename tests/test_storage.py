@@ -0,0 +1,110 @@
+# BlobStore на локальной ФС (во временном каталоге) и перенос images.data в него.
+# Тест переноса ходит в БД из DATABASE_URL / FSTR_DB_*; без неё — пропускается
+import os
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app import migrate_blobs, models, storage
+from app.db import engine
+
+PNG = bytes.fromhex("89504e470d0a1a0a0000000d4948445200000001000000010804000000b51c0c02")
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    s = storage.LocalBlobStore(str(tmp_path))
+    monkeypatch.setattr(storage, "_store", s)
+    return s
+
+def _files(root):
+    return sorted(os.path.relpath(os.path.join(d, f), root) for d, _, fs in os.walk(root) for f in fs)
+
+def test_put_dedupes_same_bytes(store):
+    a = store.put(PNG)
+    b = store.put(PNG)
+    assert a == b and a.size == len(PNG) and a.mime_type == "image/png"
+    sha = a.sha256
+    assert _files(store.root) == [os.path.join(sha[:2], sha[2:4], sha)]
+    assert store.exists(sha) and store.size(sha) == len(PNG) and store.get(sha) == PNG
+
+    other = store.put(PNG + b"\0")
+    assert other.sha256 != sha and len(_files(store.root)) == 2
+
+def test_missing_and_bad_keys(store):
+    assert not store.exists("0" * 64)
+    with pytest.raises(KeyError):
+        store.open("0" * 64)
+    # Ключ — имя файла: ничего, кроме 64 hex-символов, до ФС не доходит
+    with pytest.raises(ValueError):
+        store.exists("../../etc/passwd")
+
+def test_put_is_atomic(store, monkeypatch):
+    # Сбой посреди записи: на месте по хэшу ничего нет, временный файл удалён
+    def broken_fsync(fd):
+        raise OSError("диск отвалился")
+    monkeypatch.setattr(storage.os, "fsync", broken_fsync)
+    with pytest.raises(OSError):
+        store.put(PNG)
+    assert _files(store.root) == []
+
+def test_writer_commit_abort_and_limits(store):
+    w = store.writer(max_size=1024)
+    w.write(PNG[:10])
+    w.write(PNG[10:])
+    blob = w.commit()
+    assert blob == store.put(PNG) and _files(store.tmp_dir) == []
+
+    # Дубликат: уже лежащий файл остаётся, временный удаляется
+    w = store.writer(max_size=1024)
+    w.write(PNG)
+    assert w.commit() == blob and len(_files(store.root)) == 1
+
+    w = store.writer(max_size=1024)
+    w.write(PNG)
+    w.abort()
+    assert _files(store.tmp_dir) == []
+
+    with pytest.raises(storage.BlobTooLarge):
+        store.writer(max_size=8).write(PNG)
+    with pytest.raises(storage.BlobTypeNotAllowed):
+        store.writer(max_size=1024, allowed_types={"image/jpeg"}).write(PNG)
+
+@pytest.fixture
+def conn():
+    try:
+        c = engine.connect()
+    except OperationalError:
+        pytest.skip("нет БД")
+    t = c.begin()
+    yield c
+    t.rollback()
+    c.close()
+
+def test_migrate_blobs_moves_bytea_rows(store, conn, monkeypatch):
+    # Коммиты migrate() — точки сохранения внутри транзакции теста, которая в конце откатывается
+    monkeypatch.setattr(migrate_blobs, "SessionLocal",
+                        lambda: Session(bind=conn, join_transaction_mode="create_savepoint"))
+    with Session(bind=conn, join_transaction_mode="create_savepoint") as db:
+        tag = uuid.uuid4().hex[:10]
+        per = models.Pereval(
+            beauty_title="пер.", title="Legacy", add_time=datetime(2021, 9, 22, tzinfo=timezone.utc),
+            user=models.User(full_name="Пупкин Василий", email=f"legacy-{tag}@mail.ru", phone=f"+7 {tag}"),
+            coords=models.Coords(latitude=45.0, longitude=7.0, height=1000),
+            levels=models.Levels(),
+        )
+        image = models.Image(pereval=per, title="Седловина", data=PNG)
+        db.add(image)
+        db.commit()
+        image_id = image.id
+
+    assert migrate_blobs.migrate(batch=2) >= 1
+
+    with Session(bind=conn, join_transaction_mode="create_savepoint") as db:
+        image = db.get(models.Image, image_id)
+        blob = store.put(PNG)
+        assert (image.sha256, image.size, image.mime_type) == (blob.sha256, len(PNG), "image/png")
+        assert image.data is None
+    assert store.get(blob.sha256) == PNG